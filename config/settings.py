@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -145,3 +146,154 @@ TAILWIND_APP_NAME = 'theme'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Shared by all worker processes, so per-user progression maps
+# (core/progression.py) stay consistent; use Redis or Memcached in production
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache' / 'django',
+        'OPTIONS': {'MAX_ENTRIES': 50_000},
+    },
+}
+
+# Cached progression maps expire after TIMEOUT seconds without a visit or update
+PROGRESSION = {
+    'TIMEOUT': 24 * 60 * 60,
+}
+
+# Leaderboards are ranked in memory per worker (core/leaderboard.py) and
+# synced with the database at most every SYNC_INTERVAL seconds
+LEADERBOARD = {
+    'TOP_N': 10,
+    'NEIGHBOURS': 2,
+    'SYNC_INTERVAL': 2.0,
+    'RELOAD_INTERVAL': 600,
+    'MAX_BOARDS': 64,
+    'WEEKS_KEPT': 8,
+}
+
+# Query engine
+# Datasets are ingested once into read-only SQLite snapshots stored here
+DATASET_SNAPSHOT_ROOT = BASE_DIR / 'cache' / 'snapshots'
+# Memory-mapped columnar copies the Python executors attach to
+DATASET_COLUMNAR_ROOT = BASE_DIR / 'cache' / 'columns'
+# Compressed Parquet copies read instead of the CSV (when pyarrow is installed)
+DATASET_PARQUET_ROOT = BASE_DIR / 'cache' / 'parquet'
+
+# Datasets are ingested in chunks of CHUNK_ROWS rows, so upload size doesn't
+# bound memory; the columnar copy is built at upload only up to EAGER_COLUMNAR_MAX_MB.
+# With PARQUET, ingest also writes a compressed copy (row groups of CHUNK_ROWS)
+# that later reads use instead of the CSV; it needs the optional pyarrow package.
+DATASET_INGEST = {
+    'CHUNK_ROWS': 50_000,
+    'PREVIEW_ROWS': 100,
+    'EAGER_COLUMNAR_MAX_MB': 256,
+    'PARQUET': True,
+    'PARQUET_COMPRESSION': 'zstd',
+}
+
+# Dataset grid on the case page: rows are fetched from the snapshot in windows
+# of PAGE_ROWS as it scrolls, sorted and filtered by SQLite (core/engines/grid.py)
+DATASET_GRID = {
+    'PAGE_ROWS': 100,
+    'MAX_ROWS': 500,
+    'MAX_FILTERS': 8,
+    'TIME_LIMIT': 5.0,
+}
+
+# Total size of datasets each worker keeps preloaded in memory (LRU evicted)
+SQL_POOL_MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Per-process cache of query results, keyed by dataset version + normalized SQL
+SQL_RESULT_CACHE = {
+    'MAX_ENTRIES': 2048,
+    'TTL': 300,  # seconds
+}
+
+# Per-query resource limits, by Case difficulty ('default' applies to all)
+SQL_QUERY_LIMITS = {
+    'default': {
+        'TIME_LIMIT': 5.0,               # wall-clock seconds
+        'MAX_INSTRUCTIONS': 50_000_000,  # SQLite VM instructions
+        'MAX_ROWS_SCANNED': 10_000_000,  # estimated from EXPLAIN QUERY PLAN
+        'MAX_ROWS_RETURNED': 10_000,     # deepest row reachable through paging
+    },
+    'Medium': {
+        'TIME_LIMIT': 10.0,
+        'MAX_INSTRUCTIONS': 200_000_000,
+    },
+    'Hard': {
+        'TIME_LIMIT': 20.0,
+        'MAX_INSTRUCTIONS': 500_000_000,
+        'MAX_ROWS_SCANNED': 100_000_000,
+    },
+}
+
+# One JSON line per executed SQL query (timings, plan, row counts) and per Python run (resource usage),
+# logged at DEBUG: set the sql_engine / python_pool loggers to 'DEBUG' to collect them
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'core.engines.sql_engine': {'handlers': ['console'], 'level': 'INFO'},
+        'core.engines.python_pool': {'handlers': ['console'], 'level': 'INFO'},
+        'core.jobs': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
+# Warm executor processes for user Python code (core/engines/python_pool.py)
+PYTHON_WORKERS = {
+    'PROCESSES': min(4, os.cpu_count() or 1),
+    'MAX_JOBS_PER_WORKER': 200,
+    'MAX_DATASETS': 4,
+    'MAX_RSS_MB': 1024,
+}
+
+# Per-run limits for user Python code, by case difficulty (falls back to 'default')
+PYTHON_RUN_LIMITS = {
+    'default': {
+        'CPU_SECONDS': 10,
+        'WALL_SECONDS': 15,
+        'MEMORY_MB': 1024,           # address space a run may add to its worker
+        'MAX_OUTPUT_CHARS': 100_000,
+    },
+    'Medium': {
+        'CPU_SECONDS': 20,
+        'WALL_SECONDS': 30,
+    },
+    'Hard': {
+        'CPU_SECONDS': 40,
+        'WALL_SECONDS': 60,
+        'MEMORY_MB': 2048,
+    },
+}
+
+# Opt-in notebook-style Python sessions (variables kept between runs, per user and case)
+PYTHON_SESSIONS = {
+    'IDLE_SECONDS': 1800,
+    'MAX_SESSION_MB': 512,   # a session growing past this is cleared
+    'MAX_TOTAL_MB': 1024,    # per executor; least recently used sessions spill to disk beyond it
+    'SPILL_DIR': BASE_DIR / 'cache' / 'sessions',
+}
+
+# Thread pools behind the async execute views; requests beyond
+# MAX_WORKERS + MAX_QUEUE get 429 with Retry-After
+ENGINE_EXECUTORS = {
+    'sql': {'MAX_WORKERS': 8, 'MAX_QUEUE': 64, 'RETRY_AFTER': 1},
+    # One thread per executor process; each just waits on its worker
+    'python': {'MAX_WORKERS': PYTHON_WORKERS['PROCESSES'], 'MAX_QUEUE': 16, 'RETRY_AFTER': 2},
+}
+
+# Background jobs (dataset ingest, expected-output warming), stored in the
+# database and run by `python manage.py run_workers` (core/jobs.py)
+JOB_QUEUE = {
+    'POLL_SECONDS': 1,
+    'LEASE_SECONDS': 600,          # a running job older than this is requeued
+    'RETRY_BACKOFF_SECONDS': 10,
+    'MAX_ATTEMPTS': 3,
+    'RUN_INLINE': False,           # True runs jobs in the web process after commit, without workers
+}
@@ -1,13 +1,27 @@
 from django.contrib import admin
-from .models import UserProfile, Dataset, Case, Question, Submission, QuestionAttempt
+from .models import UserProfile, Dataset, Case, Question, Submission, QuestionAttempt, QueryLog, Job, DatasetVersion, DatasetBlob, LeaderboardEntry
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'level', 'xp')
 
+class DatasetVersionInline(admin.TabularInline):
+    model = DatasetVersion
+    fk_name = 'dataset'
+    extra = 0
+    can_delete = False
+    fields = ('number', 'key', 'original_name', 'created_at')
+    readonly_fields = fields
+
 @admin.register(Dataset)
 class DatasetAdmin(admin.ModelAdmin):
-    list_display = ('name', 'uploaded_at')
+    list_display = ('name', 'status', 'current_version', 'uploaded_at')
+    inlines = [DatasetVersionInline]
+
+@admin.register(DatasetBlob)
+class DatasetBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'ref_count', 'created_at')
+    readonly_fields = ('sha256', 'file', 'size', 'ref_count')
 
 class QuestionInline(admin.StackedInline):
     model = Question
@@ -25,3 +39,20 @@ class SubmissionAdmin(admin.ModelAdmin):
 @admin.register(QuestionAttempt)
 class QuestionAttemptAdmin(admin.ModelAdmin):
     list_display = ('user', 'question', 'is_correct', 'attempted_at')
+
+@admin.register(QueryLog)
+class QueryLogAdmin(admin.ModelAdmin):
+    list_display = ('dataset', 'query', 'executions', 'last_run_at')
+    list_filter = ('dataset',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'priority', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('locked_by', 'locked_at', 'last_error')
+
+@admin.register(LeaderboardEntry)
+class LeaderboardEntryAdmin(admin.ModelAdmin):
+    list_display = ('board', 'user', 'score', 'updated_at')
+    list_filter = ('board',)
+    search_fields = ('user__username',)
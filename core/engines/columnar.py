@@ -0,0 +1,83 @@
+"""
+Memory-mapped columnar copies of datasets for the Python executors.
+
+Each dataset version is published once into its own directory (see
+loader.write_columnar); executor processes attach to it read-only instead
+of parsing the CSV, so N concurrent runs share one copy of the data.
+"""
+import os
+import shutil
+import logging
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from .loader import COLUMNAR_FORMAT, MANIFEST_NAME, write_columnar
+from .parquet import load_dataset
+from .snapshot import snapshot_path, source_signature
+
+logger = logging.getLogger(__name__)
+
+_publish_lock = threading.Lock()
+
+
+def columnar_root():
+    return Path(getattr(settings, 'DATASET_COLUMNAR_ROOT', Path(settings.BASE_DIR) / 'cache' / 'columns'))
+
+
+def _prefix(dataset_path):
+    # Same per-source name as the SQLite snapshot, e.g. titanic-1a2b3c4d5e6f
+    return snapshot_path(dataset_path).stem
+
+
+def columnar_path(dataset_path, signature=None):
+    """One directory per source version and layout, e.g. titanic-1a2b3c4d5e6f-<size>-<mtime>-c2"""
+    signature = signature or source_signature(dataset_path)
+    return columnar_root() / f"{_prefix(dataset_path)}-{signature}-c{COLUMNAR_FORMAT}"
+
+
+def publish_columnar(dataset_path, schema=None):
+    """
+    Writes the columnar copy under a temporary name and renames it into
+    place, then removes older versions of the same dataset. Processes that
+    still have old files mapped keep reading them until they let go.
+    """
+    target = columnar_path(dataset_path)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    target.parent.mkdir(parents=True, exist_ok=True)
+
+    # From the Parquet copy when there is one, which is much faster than parsing the CSV
+    df = load_dataset(dataset_path, schema)
+    write_columnar(df, tmp_path)
+    try:
+        os.rename(tmp_path, target)
+    except OSError:
+        # Another process published the same version first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not (target / MANIFEST_NAME).exists():
+            raise
+
+    for old in target.parent.glob(f"{_prefix(dataset_path)}-*"):
+        if old != target and not old.name.endswith('.tmp'):
+            shutil.rmtree(old, ignore_errors=True)
+    logger.info("Published columnar dataset %s (%s rows)", target.name, len(df))
+    return target
+
+
+def ensure_columnar(dataset_path, schema=None):
+    """Returns the directory of the current version's columnar copy, publishing it if missing."""
+    target = columnar_path(dataset_path)
+    if (target / MANIFEST_NAME).exists():
+        return target
+
+    with _publish_lock:
+        if (target / MANIFEST_NAME).exists():
+            return target
+        return publish_columnar(dataset_path, schema)
+
+
+def discard_columnar(dataset_path):
+    """Deletes every columnar copy of a source that is gone for good."""
+    for old in columnar_root().glob(f"{_prefix(dataset_path)}-*"):
+        shutil.rmtree(old, ignore_errors=True)
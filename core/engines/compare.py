@@ -0,0 +1,174 @@
+"""
+Result fingerprints for grading SQL and Python answers.
+
+A fingerprint summarises a result set in O(n) time and O(1) space: its
+shape, a coarse kind per column and two digests of the per-row hashes,
+one order-sensitive and one order-insensitive (a multiset). Grading then
+compares two fingerprints, so only the expected fingerprint has to be
+stored and results are never diffed row by row. Column names are not part
+of the digests; SQL grading checks them (case aside) before hashing an answer.
+
+Values are normalized before hashing so equivalent answers agree:
+integral numbers hash the same whether they arrive as int or float,
+non-integral floats are rounded to FLOAT_SIGNIFICANT_DIGITS, and dates
+become ISO text as in the SQLite snapshots. Floats that differ beyond that
+precision compare equal, except right at a rounding boundary.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+FINGERPRINT_VERSION = 1
+FLOAT_SIGNIFICANT_DIGITS = 10
+
+_MASK64 = np.uint64(0xFFFFFFFFFFFFFFFF)
+_NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _round_significant(values):
+    """Rounds non-integral floats to FLOAT_SIGNIFICANT_DIGITS; integral values stay exact."""
+    values = values.copy()
+    fractional = np.isfinite(values) & (values != np.round(values))
+    if fractional.any():
+        x = values[fractional]
+        scale = 10.0 ** (FLOAT_SIGNIFICANT_DIGITS - 1 - np.floor(np.log10(np.abs(x))))
+        values[fractional] = np.round(x * scale) / scale
+    values[values == 0] = 0.0  # -0.0
+    return values
+
+
+def _column_hashes(series):
+    """
+    Returns (kind, uint64 hash per value) for one column; kind is 'number',
+    'text' or None (all null). Nulls hash the same in every kind of column.
+    """
+    nulls = series.isna().to_numpy()
+    if nulls.all():
+        kind, hashes = None, np.zeros(len(series), dtype=np.uint64)
+    elif pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        values = series.astype('float64').to_numpy(dtype='float64', na_value=np.nan)
+        kind, hashes = 'number', pd.util.hash_array(_round_significant(values))
+    elif isinstance(series.dtype, pd.CategoricalDtype):
+        # Hash each category once and gather by code
+        categories = series.cat.categories.astype(str).to_numpy(dtype=object)
+        kind, hashes = 'text', pd.util.hash_array(categories)[series.cat.codes.to_numpy()]
+    else:
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.dt.strftime('%Y-%m-%d %H:%M:%S').str.removesuffix(' 00:00:00')
+        if isinstance(series.dtype, pd.StringDtype):
+            values = series.fillna('').to_numpy(dtype=object)
+        else:
+            values = series.astype(object).where(~nulls, '').map(str).to_numpy(dtype=object)
+        kind, hashes = 'text', pd.util.hash_array(values)
+    hashes[nulls] = _NULL_HASH
+    return kind, hashes
+
+
+def _mix(hashes):
+    """splitmix64 finalizer, used to combine column hashes and as the multiset's second hash."""
+    with np.errstate(over='ignore'):
+        z = hashes ^ (hashes >> np.uint64(30))
+        z = z * np.uint64(0xBF58476D1CE4E5B9)
+        z = z ^ (z >> np.uint64(27))
+        z = z * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+class Fingerprinter:
+    """Incremental fingerprint: feed result chunks with update(), then call digest()."""
+
+    def __init__(self):
+        self.kinds = None
+        self.rows = 0
+        self._ordered = hashlib.blake2b(digest_size=16)
+        self._sum = np.uint64(0)
+        self._mixed_sum = np.uint64(0)
+
+    def update(self, frame):
+        if self.kinds is None:
+            self.kinds = [None] * frame.shape[1]
+        if not len(frame):
+            return
+
+        # Fold the column hashes left to right, so rows hash by position too
+        hashes = np.full(len(frame), np.uint64(frame.shape[1]), dtype=np.uint64)
+        for i in range(frame.shape[1]):
+            kind, column = _column_hashes(frame.iloc[:, i])
+            if self.kinds[i] is None:
+                self.kinds[i] = kind
+            elif kind is not None and kind != self.kinds[i]:
+                # SQLite columns can mix types; such a column is compared as text
+                self.kinds[i] = 'text'
+            hashes = _mix(hashes ^ column)
+        self.rows += len(hashes)
+        self._ordered.update(hashes.tobytes())
+        with np.errstate(over='ignore'):
+            self._sum = (self._sum + hashes.sum(dtype=np.uint64)) & _MASK64
+            self._mixed_sum = (self._mixed_sum + _mix(hashes).sum(dtype=np.uint64)) & _MASK64
+
+    def digest(self):
+        return {
+            'version': FINGERPRINT_VERSION,
+            'kinds': self.kinds or [],
+            'rows': self.rows,
+            'ordered': self._ordered.hexdigest(),
+            'unordered': f"{int(self._sum):016x}{int(self._mixed_sum):016x}",
+        }
+
+
+def fingerprint_frame(frame):
+    fingerprinter = Fingerprinter()
+    fingerprinter.update(frame)
+    return fingerprinter.digest()
+
+
+def result_frame(value):
+    """
+    DataFrame view of a Python answer: DataFrames as-is, Series as one
+    column, scalars as a 1x1 frame. Meaningful indexes (group keys, labels)
+    become columns; positional integer indexes are dropped. Returns None
+    for values that can't be graded this way (None, modules, functions...).
+    """
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    elif isinstance(value, dict):
+        value = pd.Series(value).to_frame()
+    elif isinstance(value, (list, tuple, np.ndarray, pd.Index)):
+        try:
+            value = pd.DataFrame(value)
+        except (ValueError, TypeError):
+            return None
+    elif isinstance(value, (str, bool, int, float, np.generic, pd.Timestamp)):
+        return pd.DataFrame([[value]])
+
+    if not isinstance(value, pd.DataFrame):
+        return None
+    index = value.index
+    positional = isinstance(index, pd.RangeIndex) or (
+        not isinstance(index, pd.MultiIndex) and index.name is None and pd.api.types.is_integer_dtype(index)
+    )
+    return value.reset_index(drop=positional)
+
+
+def fingerprint_value(value):
+    frame = result_frame(value)
+    return fingerprint_frame(frame) if frame is not None else None
+
+
+def compare_fingerprints(expected, actual, ordered=False):
+    """Returns (is_match, message) comparing an answer's fingerprint to the expected one."""
+    if expected.get('version') != actual.get('version'):
+        return False, "The expected result is out of date; please try again."
+    if len(expected['kinds']) != len(actual['kinds']):
+        return False, f"Expected {len(expected['kinds'])} columns, got {len(actual['kinds'])}."
+    for i, (want, got) in enumerate(zip(expected['kinds'], actual['kinds']), start=1):
+        if want and got and want != got:
+            return False, f"Column {i} should be {want}, not {got}."
+    if expected['rows'] != actual['rows']:
+        return False, f"Expected {expected['rows']} rows, got {actual['rows']}."
+    if expected['unordered'] != actual['unordered']:
+        return False, "Values don't match the expected result."
+    if ordered and expected['ordered'] != actual['ordered']:
+        return False, "Right rows, wrong order."
+    return True, "Correct! Task Completed."
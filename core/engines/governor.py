@@ -0,0 +1,163 @@
+import re
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .snapshot import META_TABLE
+
+logger = logging.getLogger(__name__)
+
+# SQLite calls the progress handler every N virtual machine instructions
+PROGRESS_INTERVAL = 1000
+
+DEFAULT_LIMITS = {
+    'TIME_LIMIT': 5.0,               # wall-clock seconds per query
+    'MAX_INSTRUCTIONS': 50_000_000,  # SQLite VM instructions per query
+    'MAX_ROWS_SCANNED': 10_000_000,  # estimated from EXPLAIN QUERY PLAN
+    'MAX_ROWS_RETURNED': 10_000,     # deepest row reachable through paging
+}
+
+# "SCAN t" is a full pass over a table; "SEARCH t USING ..." is an index lookup
+_FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)')
+_EXPLAIN = re.compile(r'^\s*EXPLAIN\b', re.IGNORECASE)
+
+
+class QueryLimitExceeded(Exception):
+    """Raised when a query is rejected or interrupted by the governor."""
+
+    def __init__(self, code, message, limit=None):
+        super().__init__(message)
+        self.code = code
+        self.limit = limit
+
+    def as_result(self):
+        return {
+            'success': False,
+            'columns': [],
+            'rows': [],
+            'error': str(self),
+            'error_code': self.code,
+            'limit': self.limit,
+        }
+
+
+class QueryLimits:
+    def __init__(self, time_limit=None, max_instructions=None, max_rows_scanned=None, max_rows_returned=None):
+        self.time_limit = time_limit if time_limit is not None else DEFAULT_LIMITS['TIME_LIMIT']
+        self.max_instructions = max_instructions if max_instructions is not None else DEFAULT_LIMITS['MAX_INSTRUCTIONS']
+        self.max_rows_scanned = max_rows_scanned if max_rows_scanned is not None else DEFAULT_LIMITS['MAX_ROWS_SCANNED']
+        self.max_rows_returned = max_rows_returned if max_rows_returned is not None else DEFAULT_LIMITS['MAX_ROWS_RETURNED']
+
+    def as_tuple(self):
+        return (self.time_limit, self.max_instructions, self.max_rows_scanned, self.max_rows_returned)
+
+    @classmethod
+    def for_difficulty(cls, difficulty):
+        """Limits from settings.SQL_QUERY_LIMITS[difficulty], falling back to 'default'."""
+        configured = getattr(settings, 'SQL_QUERY_LIMITS', {})
+        options = dict(configured.get('default', {}))
+        options.update(configured.get(difficulty, {}))
+        return cls(
+            time_limit=options.get('TIME_LIMIT'),
+            max_instructions=options.get('MAX_INSTRUCTIONS'),
+            max_rows_scanned=options.get('MAX_ROWS_SCANNED'),
+            max_rows_returned=options.get('MAX_ROWS_RETURNED'),
+        )
+
+
+class QueryGovernor:
+    """
+    Enforces QueryLimits on a pooled connection:
+    - before execution, rejects plans whose nested full scans would visit
+      more rows than max_rows_scanned (e.g. an unfiltered self cross join);
+    - during execution, interrupts the statement once the wall-clock or
+      VM instruction budget is spent.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self._deadline = None
+        self._instructions = 0
+        self._reason = None
+
+    def check_plan(self, conn, query):
+        if _EXPLAIN.match(query):
+            # Students inspecting plans themselves; nothing gets executed
+            return []
+        plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+        # Plan rows are (id, parent, _, detail); tables joined by nested loops
+        # are siblings under the same parent, compound/CTE parts are not
+        scans_by_parent = {}
+        for _id, parent, _unused, detail in plan:
+            if _FULL_SCAN.match(detail):
+                scans_by_parent[parent] = scans_by_parent.get(parent, 0) + 1
+        full_scans = max(scans_by_parent.values(), default=0)
+        if full_scans < 2:
+            # A single pass over the table is what the time budget is for
+            return plan
+
+        try:
+            row_count = int(conn.execute(
+                f"SELECT value FROM {META_TABLE} WHERE key = 'row_count'"
+            ).fetchone()[0])
+        except (sqlite3.Error, TypeError):
+            row_count = conn.execute("SELECT COUNT(*) FROM dataset").fetchone()[0]
+
+        # Nested loops over k full scans visit roughly N^k rows
+        estimated = row_count ** full_scans
+        if estimated > self.limits.max_rows_scanned:
+            raise QueryLimitExceeded(
+                'plan_too_expensive',
+                f"Query rejected: its plan does {full_scans} nested full scans "
+                f"(~{estimated:,} rows). Add a join condition or filter.",
+                limit=self.limits.max_rows_scanned,
+            )
+        return plan
+
+    def check_page(self, page, page_size):
+        if (page - 1) * page_size >= self.limits.max_rows_returned:
+            raise QueryLimitExceeded(
+                'row_limit',
+                f"Only the first {self.limits.max_rows_returned:,} rows of a result can be browsed.",
+                limit=self.limits.max_rows_returned,
+            )
+        return min(page_size, self.limits.max_rows_returned - (page - 1) * page_size)
+
+    def _on_progress(self):
+        self._instructions += PROGRESS_INTERVAL
+        if self._instructions > self.limits.max_instructions:
+            self._reason = 'instruction_limit'
+            return 1
+        if time.monotonic() > self._deadline:
+            self._reason = 'time_limit'
+            return 1
+        return 0
+
+    @contextmanager
+    def applied(self, conn):
+        """Installs the budget on `conn` for the duration of the block (pooled connections are reused)."""
+        self._deadline = time.monotonic() + self.limits.time_limit
+        self._instructions = 0
+        self._reason = None
+        conn.set_progress_handler(self._on_progress, PROGRESS_INTERVAL)
+        try:
+            yield self
+        except sqlite3.OperationalError as e:
+            if self._reason == 'time_limit':
+                raise QueryLimitExceeded(
+                    'time_limit',
+                    f"Query stopped after {self.limits.time_limit:g}s time limit.",
+                    limit=self.limits.time_limit,
+                ) from e
+            if self._reason == 'instruction_limit':
+                raise QueryLimitExceeded(
+                    'instruction_limit',
+                    "Query stopped: it did too much work. Try filtering or aggregating earlier.",
+                    limit=self.limits.max_instructions,
+                ) from e
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
@@ -0,0 +1,249 @@
+"""
+Server-side browsing of a dataset's snapshot for the case page grid.
+
+A GridQuery is one window of the `dataset` table: a column projection, an
+optional sort, simple per-column filters and a search term, and an
+offset/limit. It compiles to a parameterized SELECT in which only known
+columns (quoted) and operators from FILTER_OPS appear; values are always
+bound parameters.
+
+Windows are read from the snapshot file rather than the in-memory pool,
+so SQLite only touches the pages holding the requested rows: browsing a
+multi-million-row dataset doesn't load it whole. In particular:
+- unsorted, unfiltered windows are rowid ranges (snapshots are written
+  append-only, so rowid is the row number) and any offset is one seek;
+- sorting or filtering on an indexed column walks that index, anything
+  else scans, bounded by the query governor;
+- totals of filtered windows are counted once per dataset version and
+  kept in the result cache.
+"""
+import json
+
+from django.conf import settings
+
+from .governor import QueryGovernor, QueryLimits
+from .indexer import quote_identifier
+from .result_cache import get_result_cache
+from .snapshot import META_TABLE, TABLE_NAME, connect_snapshot, dataset_version, ensure_snapshot
+
+DEFAULT_GRID = {
+    'PAGE_ROWS': 100,    # rows per window unless the client asks for fewer/more
+    'MAX_ROWS': 500,     # largest window one request may return
+    'MAX_FILTERS': 8,
+    'TIME_LIMIT': 5.0,   # seconds per query, like SQL_QUERY_LIMITS
+}
+
+# op -> SQL following the column; ops with a '?' take one bound value
+FILTER_OPS = {
+    'eq': '= ?',
+    'ne': '<> ?',
+    'lt': '< ?',
+    'lte': '<= ?',
+    'gt': '> ?',
+    'gte': '>= ?',
+    'contains': "LIKE ? ESCAPE '\\'",
+    'startswith': "LIKE ? ESCAPE '\\'",
+    'isnull': 'IS NULL',
+    'notnull': 'IS NOT NULL',
+}
+
+_TEXT_DTYPES = ('category', 'object')
+
+
+class GridError(ValueError):
+    """A grid request naming an unknown column or operator, or with a malformed value."""
+
+
+def grid_options():
+    return dict(DEFAULT_GRID, **getattr(settings, 'DATASET_GRID', {}))
+
+
+def _like_pattern(value, op):
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%" if op == 'contains' else f"{escaped}%"
+
+
+def _int_param(params, name, default):
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise GridError(f"'{name}' must be an integer")
+
+
+class GridQuery:
+    def __init__(self, columns, schema=None, projection=None, sort=None, descending=False,
+                 filters=(), search='', offset=0, limit=None):
+        """
+        `columns` are the dataset's columns in table order and `schema` their
+        stored specs (dtype decides search columns and boolean filter values).
+        `filters` is a list of (column, op, value) triples, combined with AND.
+        """
+        options = grid_options()
+        self.schema = schema or {}
+        projection = list(projection or columns)
+        for col in projection + [sort] + [f[0] for f in filters]:
+            if col is not None and col not in columns:
+                raise GridError(f"Unknown column: {col}")
+        if len(filters) > options['MAX_FILTERS']:
+            raise GridError(f"At most {options['MAX_FILTERS']} filters")
+        for _col, op, value in filters:
+            if op not in FILTER_OPS:
+                raise GridError(f"Unknown filter operator: {op}")
+            if '?' in FILTER_OPS[op] and not isinstance(value, (str, int, float)):
+                raise GridError(f"Filter '{op}' needs a text or number value")
+
+        self.columns = list(columns)
+        self.projection = projection
+        self.sort = sort
+        self.descending = bool(descending)
+        self.filters = list(filters)
+        self.search = (search or '').strip()
+        self.offset = max(offset, 0)
+        limit = options['PAGE_ROWS'] if limit is None else limit
+        self.limit = min(max(limit, 1), options['MAX_ROWS'])
+
+    @classmethod
+    def from_params(cls, params, columns, schema=None):
+        """
+        From request.GET:
+            offset / limit, or page (from 1) / page_size
+            columns   repeated, the projection (default: all)
+            sort      a column; order=desc for descending
+            filters   JSON list of {"column", "op", "value"}
+            q         text searched in every text column
+        """
+        limit = _int_param(params, 'limit', None)
+        if limit is None:
+            limit = _int_param(params, 'page_size', None)
+        offset = _int_param(params, 'offset', None)
+        if offset is None:
+            page = max(_int_param(params, 'page', 1), 1)
+            offset = (page - 1) * (limit or grid_options()['PAGE_ROWS'])
+
+        try:
+            raw_filters = json.loads(params.get('filters') or '[]')
+            filters = [(f['column'], f['op'], f.get('value')) for f in raw_filters]
+        except (ValueError, TypeError, KeyError):
+            raise GridError("'filters' must be a JSON list of {column, op, value} objects")
+
+        return cls(
+            columns,
+            schema=schema,
+            projection=params.getlist('columns'),
+            sort=params.get('sort') or None,
+            descending=params.get('order') == 'desc',
+            filters=filters,
+            search=params.get('q', ''),
+            offset=offset,
+            limit=limit,
+        )
+
+    @property
+    def is_filtered(self):
+        return bool(self.filters or self.search)
+
+    def _bind(self, col, op, value):
+        if op in ('contains', 'startswith'):
+            return _like_pattern(str(value), op)
+        if self.schema.get(col, {}).get('dtype') == 'bool':
+            # Stored as 0/1
+            return int(str(value).lower() in ('1', 'true', 'yes'))
+        return value
+
+    def where(self):
+        """The WHERE clause (with a leading space) and its parameters."""
+        clauses, params = [], []
+        for col, op, value in self.filters:
+            clauses.append(f"{quote_identifier(col)} {FILTER_OPS[op]}")
+            if '?' in FILTER_OPS[op]:
+                params.append(self._bind(col, op, value))
+        if self.search:
+            searched = [
+                col for col in self.columns
+                if not self.schema or self.schema.get(col, {}).get('dtype') in _TEXT_DTYPES
+            ]
+            if searched:
+                pattern = _like_pattern(self.search, 'contains')
+                clauses.append('(' + ' OR '.join(f"{quote_identifier(col)} LIKE ? ESCAPE '\\'" for col in searched) + ')')
+                params.extend([pattern] * len(searched))
+            else:
+                clauses.append('0')
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def select(self):
+        """The window's SELECT (row number first) and its parameters."""
+        projection = ', '.join(quote_identifier(col) for col in self.projection)
+        where, params = self.where()
+        if self.sort is None and not where:
+            # rowid is the 1-based row number: seek straight to the window
+            return (
+                f"SELECT rowid, {projection} FROM {TABLE_NAME} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                [self.offset, self.limit],
+            )
+        order = 'rowid'
+        if self.sort is not None:
+            # rowid breaks ties, so windows of one sort never overlap
+            order = f"{quote_identifier(self.sort)} {'DESC' if self.descending else 'ASC'}, rowid"
+        return (
+            f"SELECT rowid, {projection} FROM {TABLE_NAME}{where} ORDER BY {order} LIMIT ? OFFSET ?",
+            params + [self.limit, self.offset],
+        )
+
+    def count(self):
+        where, params = self.where()
+        return f"SELECT COUNT(*) FROM {TABLE_NAME}{where}", params
+
+
+def _cell(value, dtype):
+    # Same text as the stored preview (loader.preview_rows)
+    if value is None:
+        return ''
+    if dtype == 'bool':
+        return str(bool(value))
+    return str(value)
+
+
+def fetch_window(dataset_path, query, dataset_key=None, schema=None):
+    """
+    Runs a GridQuery against the dataset's snapshot. Returns
+        columns, rows (display strings), row_numbers (1-based, in the file),
+        offset, limit, total (rows matching the filters), has_more.
+    Raises QueryLimitExceeded if a scan runs past the grid's time limit.
+    """
+    options = grid_options()
+    path = ensure_snapshot(dataset_path, schema)
+    dataset_key = dataset_key if dataset_key is not None else dataset_path
+    governor = QueryGovernor(QueryLimits(time_limit=options['TIME_LIMIT']))
+
+    conn = connect_snapshot(path)
+    try:
+        with governor.applied(conn):
+            sql, params = query.select()
+            records = conn.execute(sql, params).fetchall()
+
+            if query.is_filtered:
+                cache = get_result_cache()
+                count_sql, count_params = query.count()
+                cache_key = cache.make_key(dataset_key, dataset_version(dataset_path), count_sql) + ('grid_count', tuple(count_params))
+                total = cache.get(cache_key)
+                if total is None:
+                    total = conn.execute(count_sql, count_params).fetchone()[0]
+                    cache.set(cache_key, total)
+            else:
+                total = int(conn.execute(f"SELECT value FROM {META_TABLE} WHERE key = 'row_count'").fetchone()[0])
+    finally:
+        conn.close()
+
+    dtypes = [query.schema.get(col, {}).get('dtype') for col in query.projection]
+    return {
+        'columns': query.projection,
+        'rows': [[_cell(value, dtype) for value, dtype in zip(record[1:], dtypes)] for record in records],
+        'row_numbers': [record[0] for record in records],
+        'offset': query.offset,
+        'limit': query.limit,
+        'total': total,
+        'has_more': query.offset + len(records) < total,
+    }
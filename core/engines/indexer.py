@@ -0,0 +1,115 @@
+"""
+Index selection for dataset snapshots.
+
+Two sources decide which columns of the `dataset` table get an index:
+- the column profile at ingest (key-like and low-cardinality columns);
+- the recorded query workload (columns most often used in predicates).
+"""
+import re
+import hashlib
+from collections import Counter
+
+# Tables smaller than this are scanned faster than an index is maintained
+MIN_ROWS_FOR_INDEXES = 1000
+# Distinct values for a column to count as a low-cardinality filter column.
+# Two-valued columns (flags, sex) rarely filter out enough rows to help.
+LOW_CARDINALITY_MIN = 3
+LOW_CARDINALITY_MAX = 1000
+MAX_AUTO_INDEXES = 8
+
+# Share of logged executions a column must appear in to be worth an index
+MIN_PREDICATE_SHARE = 0.05
+
+_KEY_NAME = re.compile(r'(^id$|_id$|id$|_key$|^key$|_code$)', re.IGNORECASE)
+
+_IDENTIFIER = r'(?:[a-z_]\w*\.)?(?:"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\]|[a-z_]\w*)'
+_PREDICATE_LEFT = re.compile(
+    rf'({_IDENTIFIER})\s*(?:==|=|<>|!=|<=|>=|<|>|\bin\b|\blike\b|\bbetween\b|\bis\b|\bglob\b)',
+    re.IGNORECASE,
+)
+_PREDICATE_RIGHT = re.compile(rf'(?:==|=|<>|!=|<=|>=|<|>)\s*({_IDENTIFIER})', re.IGNORECASE)
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def index_name(column):
+    # The slug alone can collide ('Name'/'name', 'a b'/'a_b'), and CREATE INDEX
+    # IF NOT EXISTS would then skip the second index silently
+    slug = re.sub(r'\W+', '_', str(column)).strip('_').lower() or 'col'
+    digest = hashlib.sha1(str(column).encode('utf-8')).hexdigest()[:8]
+    return f"ix_dataset_{slug}_{digest}"
+
+
+def choose_indexes(profile, row_count):
+    """Columns worth indexing at ingest: key-like columns first, then low-cardinality filters."""
+    if row_count < MIN_ROWS_FOR_INDEXES:
+        return []
+
+    keys = [
+        col for col, stats in profile.items()
+        if _KEY_NAME.search(col) and stats['distinct'] > LOW_CARDINALITY_MAX
+    ]
+    filters = [
+        col for col, stats in profile.items()
+        if col not in keys and LOW_CARDINALITY_MIN <= stats['distinct'] <= LOW_CARDINALITY_MAX
+        # Mostly-null columns are rarely filtered on
+        and stats['nulls'] < row_count / 2
+    ]
+    # Fewer distinct values first: the most "categorical" columns are the likeliest filters
+    filters.sort(key=lambda col: profile[col]['distinct'])
+    return (keys + filters)[:MAX_AUTO_INDEXES]
+
+
+def create_indexes(conn, table, columns):
+    for column in columns:
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name(column))} "
+            f"ON {quote_identifier(table)} ({quote_identifier(column)})"
+        )
+
+
+def _unquote(identifier):
+    # Drop an "alias." qualifier, then the quotes
+    match = re.match(r'^[a-z_]\w*\.(.+)$', identifier, re.IGNORECASE)
+    name = match.group(1) if match else identifier
+    if name[:1] in ('"', '`', '['):
+        name = name[1:-1].replace('""', '"')
+    return name
+
+
+def predicate_columns(query, columns):
+    """Dataset columns the query filters or joins on (case-insensitive match)."""
+    by_lower = {str(col).lower(): str(col) for col in columns}
+    found = set()
+    for pattern in (_PREDICATE_LEFT, _PREDICATE_RIGHT):
+        for match in pattern.finditer(query):
+            column = by_lower.get(_unquote(match.group(1)).lower())
+            if column:
+                found.add(column)
+    return found
+
+
+def recommend_indexes(workload, columns, existing=(), limit=3, profile=None):
+    """
+    Ranks predicate columns across a workload of (query, executions) pairs and
+    returns up to `limit` unindexed columns used in at least MIN_PREDICATE_SHARE
+    of executions, most frequent first. With a column profile (distinct
+    counts from ingest), columns too unselective to gain from an index are
+    left out.
+    """
+    usage = Counter()
+    total = 0
+    for query, executions in workload:
+        total += executions
+        for column in predicate_columns(query, columns):
+            usage[column] += executions
+
+    skip = set(existing)
+    if profile:
+        skip |= {col for col, stats in profile.items() if stats['distinct'] < LOW_CARDINALITY_MIN}
+    return [
+        column for column, count in usage.most_common()
+        if column not in skip and total and count / total >= MIN_PREDICATE_SHARE
+    ][:limit]
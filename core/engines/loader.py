@@ -0,0 +1,359 @@
+"""
+Dtype-aware dataset loading shared by every engine and view.
+
+At ingest `infer_schema` picks the most compact lossless dtype per column
+(downcast numerics, categoricals for repetitive strings, parsed dates) and
+the SQLite affinity to materialize it with. The schema is stored in
+`Dataset.columns_metadata['schema']` so later loads skip inference.
+
+Large files are ingested in chunks (`read_dataset_chunks`), with
+`SchemaBuilder` reaching the same decisions as `infer_schema` one chunk at
+a time.
+"""
+import json
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Strings become categoricals when values repeat at least this much on average
+CATEGORY_MAX_RATIO = 0.5
+DATE_SAMPLE_SIZE = 100
+DATE_MIN_PARSED = 0.95
+_DATE_LIKE = re.compile(r'^\s*\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}')
+# Rows per chunk when streaming a CSV
+CHUNK_ROWS = 50_000
+# Distinct values SchemaBuilder counts per column; past this a text column is free text
+MAX_TRACKED_DISTINCT = 10_000
+
+
+def _float_dtype(series):
+    """float32 only when every value survives the round trip unchanged."""
+    values = series.dropna()
+    if len(values) and (values.astype('float32').astype('float64') != values).any():
+        return 'float64'
+    return 'float32'
+
+
+def _looks_like_dates(series):
+    sample = series.dropna().astype(str).head(DATE_SAMPLE_SIZE)
+    if sample.empty or not sample.str.match(_DATE_LIKE).all():
+        return False
+    parsed = pd.to_datetime(sample, errors='coerce', format='mixed')
+    return parsed.notna().mean() >= DATE_MIN_PARSED
+
+
+def infer_column(series):
+    """Returns {'dtype': ..., 'affinity': ...} for one column."""
+    if pd.api.types.is_bool_dtype(series):
+        return {'dtype': 'bool', 'affinity': 'INTEGER'}
+
+    if pd.api.types.is_integer_dtype(series):
+        return {'dtype': str(pd.to_numeric(series, downcast='integer').dtype), 'affinity': 'INTEGER'}
+
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna()
+        if len(values) and (values == values.round()).all() and values.abs().max() < 2 ** 31:
+            # Integers with gaps: CSV readers hand these over as float64
+            downcast = pd.to_numeric(values.astype('int64'), downcast='integer').dtype
+            return {'dtype': str(downcast).capitalize(), 'affinity': 'INTEGER'}
+        return {'dtype': _float_dtype(series), 'affinity': 'REAL'}
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return {'dtype': 'datetime64[ns]', 'affinity': 'TEXT'}
+
+    non_null = series.dropna()
+    if len(non_null) and _looks_like_dates(non_null):
+        return {'dtype': 'datetime64[ns]', 'affinity': 'TEXT'}
+    if len(non_null) and non_null.nunique() <= len(non_null) * CATEGORY_MAX_RATIO:
+        return {'dtype': 'category', 'affinity': 'TEXT'}
+    return {'dtype': 'object', 'affinity': 'TEXT'}
+
+
+def infer_schema(df):
+    return {str(col): infer_column(df[col]) for col in df.columns}
+
+
+def apply_schema(df, schema):
+    """Converts a raw DataFrame to the stored schema in place of default dtypes."""
+    for col, spec in schema.items():
+        if col not in df.columns:
+            continue
+        dtype = spec['dtype']
+        if dtype == 'datetime64[ns]':
+            df[col] = pd.to_datetime(df[col], errors='coerce', format='mixed')
+        elif dtype == 'object':
+            continue
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+# Converted after parsing: dates can't be given as a read_csv dtype, and
+# categoricals fail to combine when one of the parser's internal blocks is all null
+_AFTER_PARSE = ('datetime64[ns]', 'category')
+
+
+def _csv_dtypes(schema, usecols=None):
+    dtypes = {}
+    for col, spec in schema.items():
+        if usecols is not None and col not in usecols:
+            continue
+        if spec['dtype'] == 'category':
+            # Read as text, so an all-null block doesn't come out as floats either
+            dtypes[col] = 'str'
+        elif spec['dtype'] not in ('object', 'datetime64[ns]'):
+            dtypes[col] = spec['dtype']
+    return dtypes
+
+
+def _after_parse_schema(schema):
+    return {col: spec for col, spec in schema.items() if spec['dtype'] in _AFTER_PARSE}
+
+
+def read_dataset(path, schema=None, **kwargs):
+    """
+    Reads a dataset CSV with compact dtypes. With a stored schema the dtypes are
+    applied while parsing; without one they are inferred from the data.
+    Extra kwargs (usecols, nrows, ...) go to pd.read_csv.
+    """
+    if not schema:
+        df = pd.read_csv(path, **kwargs)
+        return apply_schema(df, infer_schema(df))
+
+    df = pd.read_csv(path, dtype=_csv_dtypes(schema, kwargs.get('usecols')), **kwargs)
+    return apply_schema(df, _after_parse_schema(schema))
+
+
+def read_dataset_chunks(path, schema=None, chunk_rows=CHUNK_ROWS):
+    """
+    Yields a dataset CSV as DataFrames of up to chunk_rows rows. With a
+    schema they have its dtypes; without one they keep pandas' defaults,
+    which can differ from chunk to chunk (feed them to SchemaBuilder).
+    A CSV with a header and no rows yields one empty chunk.
+    """
+    if not schema:
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+        return
+    for chunk in pd.read_csv(path, dtype=_csv_dtypes(schema), chunksize=chunk_rows):
+        yield apply_schema(chunk, _after_parse_schema(schema))
+
+
+def _int_dtype(low, high):
+    for dtype in ('int8', 'int16', 'int32'):
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return 'int64'
+
+
+def _chunk_kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'bool'
+    if pd.api.types.is_integer_dtype(series):
+        return 'int'
+    if pd.api.types.is_float_dtype(series):
+        return 'float'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    return 'object'
+
+
+class SchemaBuilder:
+    """
+    infer_schema over a stream of chunks, in memory bounded by the number of
+    columns. Reaches the same decisions as infer_column on the whole column,
+    except that dates are detected from the first chunk that has values, and
+    text columns with more than MAX_TRACKED_DISTINCT distinct values are
+    kept as free text rather than categoricals. Column statistics are
+    collected separately, by stats.StatsBuilder.
+    """
+
+    def __init__(self):
+        self.columns = None
+        self.row_count = 0
+        self._stats = {}
+
+    def update(self, chunk):
+        if self.columns is None:
+            self.columns = [str(col) for col in chunk.columns]
+            for col in chunk.columns:
+                self._stats[str(col)] = {
+                    'kind': None, 'empty': chunk[col].iloc[:0], 'non_null': 0,
+                    'min': None, 'max': None, 'integral': True, 'float32_safe': True,
+                    'dates': None, 'distinct': set(),
+                }
+        self.row_count += len(chunk)
+        for col in chunk.columns:
+            self._update_column(self._stats[str(col)], chunk[col])
+
+    def _update_column(self, stats, series):
+        values = series.dropna()
+        if values.empty:
+            # An all-null chunk reads as float64 whatever the column is
+            return
+        stats['non_null'] += len(values)
+
+        kind = _chunk_kind(values)
+        if stats['kind'] is None or stats['kind'] == kind:
+            stats['kind'] = kind
+        elif {stats['kind'], kind} == {'int', 'float'}:
+            stats['kind'] = 'float'
+        else:
+            stats['kind'] = 'object'
+
+        if kind in ('int', 'float'):
+            as_float = values.astype('float64')
+            low, high = as_float.min(), as_float.max()
+            stats['min'] = low if stats['min'] is None else min(stats['min'], low)
+            stats['max'] = high if stats['max'] is None else max(stats['max'], high)
+            stats['integral'] = stats['integral'] and bool((as_float == as_float.round()).all())
+            stats['float32_safe'] = stats['float32_safe'] and not (as_float.astype('float32').astype('float64') != as_float).any()
+            hashes = pd.util.hash_array(as_float.to_numpy())
+        else:
+            if kind == 'object' and stats['dates'] is None:
+                stats['dates'] = _looks_like_dates(values)
+            hashes = pd.util.hash_array(values.astype(str).to_numpy(dtype=object))
+
+        if stats['distinct'] is not None:
+            stats['distinct'].update(np.unique(hashes).tolist())
+            if len(stats['distinct']) > MAX_TRACKED_DISTINCT:
+                stats['distinct'] = None
+
+    def _column_schema(self, stats):
+        kind = stats['kind']
+        if kind is None:
+            return infer_column(stats['empty'])
+        if kind == 'bool':
+            return {'dtype': 'bool', 'affinity': 'INTEGER'}
+        if kind == 'int':
+            return {'dtype': _int_dtype(stats['min'], stats['max']), 'affinity': 'INTEGER'}
+        if kind == 'float':
+            if stats['integral'] and max(abs(stats['min']), abs(stats['max'])) < 2 ** 31:
+                return {'dtype': _int_dtype(stats['min'], stats['max']).capitalize(), 'affinity': 'INTEGER'}
+            return {'dtype': 'float32' if stats['float32_safe'] else 'float64', 'affinity': 'REAL'}
+        if kind == 'datetime' or stats['dates']:
+            return {'dtype': 'datetime64[ns]', 'affinity': 'TEXT'}
+        if stats['distinct'] is not None and len(stats['distinct']) <= stats['non_null'] * CATEGORY_MAX_RATIO:
+            return {'dtype': 'category', 'affinity': 'TEXT'}
+        return {'dtype': 'object', 'affinity': 'TEXT'}
+
+    def schema(self):
+        return {col: self._column_schema(self._stats[col]) for col in self.columns or []}
+
+def schema_affinities(schema):
+    return {col: spec['affinity'] for col, spec in schema.items()}
+
+
+def sql_frame(df):
+    """
+    Dates as ISO text for SQLite ('2000-01-31', or with the time when any is set),
+    so they compare and sort correctly as strings.
+    """
+    out = df.copy(deep=False)
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            values = out[col]
+            has_time = (values.dropna() != values.dropna().dt.normalize()).any()
+            out[col] = values.dt.strftime('%Y-%m-%d %H:%M:%S' if has_time else '%Y-%m-%d')
+    return out
+
+
+def display_frame(df):
+    """Object-typed copy with NaN/NaT as '' for rendering (categoricals reject fillna(''))."""
+    return df.astype(object).where(df.notna(), '')
+
+
+def preview_rows(df):
+    """Rows of `df` as lists of display strings, for storing as JSON."""
+    return display_frame(df).astype(str).values.tolist()
+
+
+# Layout version of write_columnar directories
+COLUMNAR_FORMAT = 2
+MANIFEST_NAME = 'manifest.json'
+
+
+def _widened(series):
+    """
+    The column as user code should see it. The narrow dtypes inferred at
+    ingest (int8/16/32, float32) suit storage, but arithmetic in student
+    code must not overflow or lose precision: int8 100 * 2 is -56.
+    Categoricals keep their compact codes.
+    """
+    dtype = series.dtype
+    if isinstance(series.array, pd.arrays.IntegerArray) and dtype != 'Int64':
+        return series.astype('Int64')
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iu' and dtype != np.int64:
+        return series.astype('int64')
+    if isinstance(dtype, np.dtype) and dtype.kind == 'f' and dtype != np.float64:
+        return series.astype('float64')
+    return series
+
+
+def write_columnar(df, directory):
+    """
+    Writes one .npy file per column plus a manifest, in a form read_columnar
+    can memory-map: numerics and dates as raw arrays, nullable integers as
+    values + mask, categoricals as codes. Free-text columns have no fixed-width
+    layout and are pickled instead. Numbers are stored as int64/float64 (see
+    _widened), since these copies are what user Python code works on.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True)
+    columns = []
+    for i, col in enumerate(df.columns):
+        series = _widened(df[col])
+        entry = {'name': str(col), 'dtype': str(series.dtype)}
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry.update(kind='category', categories=series.cat.categories.tolist())
+            np.save(directory / f'{i}.npy', series.cat.codes.to_numpy())
+        elif isinstance(series.array, pd.arrays.IntegerArray):
+            entry['kind'] = 'masked'
+            np.save(directory / f'{i}.npy', series.array._data)
+            np.save(directory / f'{i}.mask.npy', series.array._mask)
+        elif isinstance(series.dtype, np.dtype) and series.dtype.kind == 'M':
+            # Naive datetimes of any unit; tz-aware ones fall through to pickle
+            entry['kind'] = 'datetime'
+            np.save(directory / f'{i}.npy', series.to_numpy().view('int64'))
+        elif pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+            entry['kind'] = 'array'
+            np.save(directory / f'{i}.npy', series.to_numpy())
+        else:
+            entry['kind'] = 'pickle'
+            series.to_pickle(directory / f'{i}.pkl')
+        columns.append(entry)
+
+    manifest = {'format': COLUMNAR_FORMAT, 'row_count': len(df), 'columns': columns}
+    (directory / MANIFEST_NAME).write_text(json.dumps(manifest))
+
+
+def read_columnar(directory):
+    """
+    DataFrame over a write_columnar directory. Array-backed columns are
+    read-only memory maps, so every process attached to the same directory
+    shares one copy through the page cache; copy-on-write copies a column
+    only when a caller modifies it (callers on pandas 2.x must enable
+    mode.copy_on_write). Pickled free-text columns are loaded into each
+    process, not shared.
+    """
+    directory = Path(directory)
+    manifest = json.loads((directory / MANIFEST_NAME).read_text())
+    data = {}
+    for i, entry in enumerate(manifest['columns']):
+        kind = entry['kind']
+        if kind == 'pickle':
+            data[entry['name']] = pd.read_pickle(directory / f'{i}.pkl').array
+            continue
+        # Plain ndarray views keep the mapping but not the np.memmap subclass
+        values = np.asarray(np.load(directory / f'{i}.npy', mmap_mode='r'))
+        if kind == 'category':
+            data[entry['name']] = pd.Categorical.from_codes(values, categories=pd.Index(entry['categories']), validate=False)
+        elif kind == 'masked':
+            data[entry['name']] = pd.arrays.IntegerArray(values, np.asarray(np.load(directory / f'{i}.mask.npy', mmap_mode='r')))
+        elif kind == 'datetime':
+            data[entry['name']] = values.view(entry['dtype'])
+        else:
+            data[entry['name']] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(manifest['row_count']), copy=False)
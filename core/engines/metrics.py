@@ -0,0 +1,130 @@
+import bisect
+import threading
+from collections import Counter, OrderedDict
+
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open-ended
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+MAX_TRACKED_SHAPES = 500
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of observations."""
+        if not self.count:
+            return 0.0
+        threshold = fraction * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + [self.max_ms], self.counts):
+            seen += count
+            if seen >= threshold:
+                return float(min(bound, self.max_ms))
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'max_ms': self.max_ms,
+            'buckets': dict(zip([f"<={b}" for b in LATENCY_BUCKETS_MS] + ['>10000'], self.counts)),
+        }
+
+
+class QueryMetrics:
+    """
+    Per-process latency histograms of executed SQL, per dataset and per
+    query shape (normalized SQL fingerprint), for finding slow datasets
+    and slow query patterns.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datasets = {}
+        self._shapes = OrderedDict()  # fingerprint -> (sample query, histogram), LRU bounded
+
+    def observe(self, dataset_key, fingerprint, query, total_ms):
+        with self._lock:
+            self._datasets.setdefault(dataset_key, LatencyHistogram()).observe(total_ms)
+            shape = self._shapes.get(fingerprint)
+            if shape is None:
+                shape = self._shapes[fingerprint] = (query, LatencyHistogram())
+                if len(self._shapes) > MAX_TRACKED_SHAPES:
+                    self._shapes.popitem(last=False)
+            self._shapes.move_to_end(fingerprint)
+            shape[1].observe(total_ms)
+
+    def dataset_summaries(self):
+        with self._lock:
+            return {key: hist.summary() for key, hist in self._datasets.items()}
+
+    def slowest_shapes(self, limit=10):
+        with self._lock:
+            shapes = [
+                dict(hist.summary(), fingerprint=fingerprint, query=query)
+                for fingerprint, (query, hist) in self._shapes.items()
+            ]
+        shapes.sort(key=lambda shape: shape['p95_ms'], reverse=True)
+        return shapes[:limit]
+
+
+class PythonRunMetrics:
+    """
+    Per-process resource accounting of Python runs, per dataset: wall-time
+    histogram, CPU seconds consumed, peak memory and how often each limit
+    was hit. The basis for sizing the executor pool and its limits.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._datasets = {}
+
+    def observe(self, dataset_key, usage, error_code=None):
+        with self._lock:
+            stats = self._datasets.get(dataset_key)
+            if stats is None:
+                stats = self._datasets[dataset_key] = {
+                    'wall': LatencyHistogram(), 'cpu_seconds': 0.0, 'peak_rss_mb': 0.0, 'limits_hit': Counter(),
+                }
+            if usage:
+                stats['wall'].observe(usage['wall_seconds'] * 1000)
+                stats['cpu_seconds'] += usage['cpu_seconds'] or 0.0
+                stats['peak_rss_mb'] = max(stats['peak_rss_mb'], usage['peak_rss_mb'] or 0.0)
+            if error_code:
+                stats['limits_hit'][error_code] += 1
+
+    def dataset_summaries(self):
+        with self._lock:
+            return {
+                key: dict(
+                    stats['wall'].summary(),
+                    cpu_seconds=stats['cpu_seconds'],
+                    peak_rss_mb=stats['peak_rss_mb'],
+                    limits_hit=dict(stats['limits_hit']),
+                )
+                for key, stats in self._datasets.items()
+            }
+
+
+_metrics = QueryMetrics()
+_python_metrics = PythonRunMetrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def get_python_metrics():
+    return _python_metrics
@@ -0,0 +1,190 @@
+"""
+Compressed Parquet copies of datasets, written once per version at ingest.
+
+The copy is typed with the stored schema and split into row groups of
+CHUNK_ROWS rows, each with per-column min/max statistics. `load_dataset`
+and `dataset_chunks` read it instead of parsing the CSV: only the
+requested columns are decoded, and only the row groups overlapping the
+requested rows are read. Columnar copies for the Python executors and
+snapshot rebuilds start from it too.
+
+Parquet support needs pyarrow, which is optional: without it (or with
+DATASET_INGEST['PARQUET'] off, or before the copy exists) every reader
+falls back to the CSV.
+"""
+import os
+import logging
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from .loader import apply_schema, read_dataset, read_dataset_chunks
+from .snapshot import ingest_options, snapshot_path, source_signature
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
+
+_write_lock = threading.Lock()
+
+
+def parquet_enabled():
+    return pq is not None and ingest_options()['PARQUET']
+
+
+def parquet_root():
+    return Path(getattr(settings, 'DATASET_PARQUET_ROOT', Path(settings.BASE_DIR) / 'cache' / 'parquet'))
+
+
+def _prefix(dataset_path):
+    # Same per-source name as the SQLite snapshot, e.g. titanic-1a2b3c4d5e6f
+    return snapshot_path(dataset_path).stem
+
+
+def parquet_path(dataset_path):
+    """One file per source version, e.g. titanic-1a2b3c4d5e6f-<signature>.parquet"""
+    return parquet_root() / f"{_prefix(dataset_path)}-{source_signature(dataset_path)}.parquet"
+
+
+def _arrow_type(dtype):
+    if dtype in ('category', 'object'):
+        # Parquet dictionary-encodes repetitive strings on its own; categories are rebuilt on read
+        return pa.string()
+    if dtype == 'datetime64[ns]':
+        # The unit pandas parses date strings to, so both readers agree
+        return pa.timestamp('us')
+    if dtype == 'bool':
+        return pa.bool_()
+    # Nullable integers ('Int16') are plain integer columns with nulls
+    return pa.from_numpy_dtype(dtype.lower())
+
+
+def _arrow_frame(chunk, schema):
+    out = chunk.copy(deep=False)
+    for col, spec in schema.items():
+        if spec['dtype'] in ('category', 'object'):
+            # Also covers chunks where a text column is all empty and parsed as float NaN
+            out[col] = out[col].astype(object).where(out[col].notna(), None)
+    return out
+
+
+def write_parquet(dataset_path, schema):
+    """
+    Streams the CSV into a Parquet file under a temporary name and renames it
+    into place, then removes older versions of the same dataset.
+    """
+    target = parquet_path(dataset_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    options = ingest_options()
+    arrow_schema = pa.schema([(col, _arrow_type(spec['dtype'])) for col, spec in schema.items()])
+
+    rows = 0
+    writer = pq.ParquetWriter(tmp_path, arrow_schema, compression=options['PARQUET_COMPRESSION'])
+    try:
+        for chunk in read_dataset_chunks(dataset_path, schema, options['CHUNK_ROWS']):
+            table = pa.Table.from_pandas(_arrow_frame(chunk, schema), schema=arrow_schema, preserve_index=False)
+            writer.write_table(table, row_group_size=options['CHUNK_ROWS'])
+            rows += len(chunk)
+    except BaseException:
+        writer.close()
+        os.remove(tmp_path)
+        raise
+    writer.close()
+    os.replace(tmp_path, target)
+
+    for old in target.parent.glob(f"{_prefix(dataset_path)}-*.parquet"):
+        if old != target:
+            old.unlink(missing_ok=True)
+    logger.info(
+        "Wrote Parquet dataset %s (%s rows, %.1f MB from %.1f MB of CSV)",
+        target.name, rows, target.stat().st_size / 2 ** 20, os.path.getsize(dataset_path) / 2 ** 20,
+    )
+    return target
+
+
+def ensure_parquet(dataset_path, schema):
+    """Returns the current version's Parquet copy, writing it if missing, or None when disabled."""
+    if not parquet_enabled():
+        return None
+    target = parquet_path(dataset_path)
+    if target.exists():
+        return target
+    with _write_lock:
+        if target.exists():
+            return target
+        return write_parquet(dataset_path, schema)
+
+
+def discard_parquet(dataset_path):
+    """Deletes every Parquet copy of a source that is gone for good."""
+    for old in parquet_root().glob(f"{_prefix(dataset_path)}-*.parquet"):
+        old.unlink(missing_ok=True)
+
+
+def _existing_parquet(dataset_path, schema):
+    # Without a schema the copy's types can't be restored exactly; the CSV path infers them
+    if not schema or not parquet_enabled():
+        return None
+    target = parquet_path(dataset_path)
+    return target if target.exists() else None
+
+
+def load_dataset(dataset_path, schema=None, columns=None, rows=None):
+    """
+    The dataset as a DataFrame with its stored dtypes, restricted to
+    `columns` (a list) and `rows` (a (start, stop) range) when given.
+    Read from the Parquet copy when there is one, else from the CSV.
+    """
+    source = _existing_parquet(dataset_path, schema)
+    if source is None:
+        kwargs = {}
+        if columns is not None:
+            kwargs['usecols'] = columns
+        if rows is not None:
+            start, stop = rows
+            kwargs['nrows'] = max(stop - start, 0)
+            if start:
+                # Line 0 is the header
+                kwargs['skiprows'] = lambda line: 0 < line <= start
+        df = read_dataset(dataset_path, schema, **kwargs)
+        return df[columns] if columns is not None else df
+
+    parquet = pq.ParquetFile(source)
+    if rows is None:
+        table = parquet.read(columns=columns)
+    else:
+        start, stop = rows
+        # Only the row groups overlapping [start, stop)
+        groups, first_row, offset = [], None, 0
+        for i in range(parquet.metadata.num_row_groups):
+            count = parquet.metadata.row_group(i).num_rows
+            if offset < stop and offset + count > start:
+                groups.append(i)
+                first_row = offset if first_row is None else first_row
+            offset += count
+        table = parquet.read_row_groups(groups, columns=columns)
+        if groups:
+            table = table.slice(start - first_row, max(stop - start, 0))
+    df = table.to_pandas()
+    return apply_schema(df, {col: spec for col, spec in schema.items() if col in df.columns})
+
+
+def dataset_chunks(dataset_path, schema=None, chunk_rows=None):
+    """Like loader.read_dataset_chunks, from the Parquet copy when there is one."""
+    chunk_rows = chunk_rows or ingest_options()['CHUNK_ROWS']
+    source = _existing_parquet(dataset_path, schema)
+    if source is None:
+        yield from read_dataset_chunks(dataset_path, schema, chunk_rows)
+        return
+    parquet = pq.ParquetFile(source)
+    if parquet.metadata.num_rows == 0:
+        yield apply_schema(parquet.schema_arrow.empty_table().to_pandas(), schema)
+        return
+    for batch in parquet.iter_batches(batch_size=chunk_rows):
+        yield apply_schema(batch.to_pandas(), schema)
@@ -0,0 +1,218 @@
+import sqlite3
+import logging
+import threading
+import itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .snapshot import ensure_snapshot, connect_snapshot, dataset_version
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024  # 256 MB per worker process
+
+_uri_counter = itertools.count(1)
+
+# Authorizer actions a read-only query needs; anything else (PRAGMA, ATTACH,
+# INSERT/UPDATE/DELETE, CREATE/DROP, transactions) is refused at prepare time
+_READ_ACTIONS = frozenset({
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+})
+
+
+class ReadOnlyConnection(sqlite3.Connection):
+    """
+    A pooled reader. All readers of a dataset share one in-memory database,
+    so a write through any of them would be seen by every user served by
+    this worker: statements are checked by an authorizer rather than by
+    PRAGMA query_only, which user SQL could switch off.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refused = False
+        self.set_authorizer(self._authorize)
+
+    def _authorize(self, action, *args):
+        if action in _READ_ACTIONS:
+            return sqlite3.SQLITE_OK
+        self.refused = True
+        return sqlite3.SQLITE_DENY
+
+    @property
+    def read_only(self):
+        """False once a statement other than a read was attempted: don't reuse the connection or cache its results."""
+        return not self.refused and not self.in_transaction
+
+
+class _PoolEntry:
+    """
+    One dataset version held in a shared-cache in-memory database.
+    The anchor connection keeps the database alive; readers are opened
+    against the same URI on demand and recycled through `idle`.
+    """
+
+    def __init__(self, key, uri, anchor, size_bytes):
+        self.key = key
+        self.uri = uri
+        self.anchor = anchor
+        self.size_bytes = size_bytes
+        self.idle = []
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return sqlite3.connect(self.uri, uri=True, check_same_thread=False, factory=ReadOnlyConnection)
+
+    def release(self, conn):
+        with self.lock:
+            if not self.closed and conn.read_only:
+                self.idle.append(conn)
+                return
+        # Entry was evicted while this connection was checked out, or the
+        # connection ran something other than a read
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+        self.anchor.close()
+
+
+class ConnectionPool:
+    """
+    Per-process LRU pool of datasets preloaded into memory.
+
+    Entries are keyed by (dataset key, version) so a changed file is
+    loaded fresh instead of serving stale data. When the estimated size of
+    all loaded datasets exceeds `memory_budget`, the least recently used
+    datasets are dropped.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @contextmanager
+    def connection(self, dataset_key, dataset_path):
+        """Yields a read-only connection with the dataset loaded as table 'dataset'."""
+        key = (dataset_key, dataset_version(dataset_path))
+        entry = self._checkout_entry(key, dataset_path)
+        conn = entry.acquire()
+        try:
+            yield conn
+        finally:
+            entry.release(conn)
+
+    def _checkout_entry(self, key, dataset_path):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # Building or refreshing the snapshot changes the version; key on the result
+        ensure_snapshot(dataset_path)
+        key = (key[0], dataset_version(dataset_path))
+
+        # Load outside the pool lock so hits on other datasets aren't blocked
+        loaded = self._load(key, dataset_path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                # Another thread loaded it first (or the version was already warm); keep theirs
+                self._entries.move_to_end(key)
+                discard = loaded
+            else:
+                entry = loaded
+                discard = None
+                # Older versions of the same dataset are never served again
+                stale = [k for k in self._entries if k[0] == key[0]]
+                self._entries[key] = entry
+                evicted = [self._entries.pop(k) for k in stale]
+                evicted.extend(self._evict_over_budget())
+        if discard is not None:
+            discard.close()
+        else:
+            for old in evicted:
+                old.close()
+        return entry
+
+    def _load(self, key, dataset_path):
+        uri = f"file:dataset-pool-{next(_uri_counter)}?mode=memory&cache=shared"
+        anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        source = connect_snapshot(ensure_snapshot(dataset_path))
+        try:
+            source.backup(anchor)
+        finally:
+            source.close()
+        page_count = anchor.execute("PRAGMA page_count").fetchone()[0]
+        page_size = anchor.execute("PRAGMA page_size").fetchone()[0]
+        logger.info("Loaded dataset %s into pool (%s bytes)", key, page_count * page_size)
+        return _PoolEntry(key, uri, anchor, page_count * page_size)
+
+    def _evict_over_budget(self):
+        """Pops LRU entries until under budget. Caller holds the lock and closes them."""
+        evicted = []
+        # Always keep the most recent entry, even if it alone exceeds the budget
+        while len(self._entries) > 1 and self.memory_usage() > self.memory_budget:
+            key, entry = self._entries.popitem(last=False)
+            self.evictions += 1
+            logger.info("Evicted dataset %s from pool", key)
+            evicted.append(entry)
+        return evicted
+
+    def memory_usage(self):
+        return sum(entry.size_bytes for entry in self._entries.values())
+
+    def clear(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            entry.close()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'datasets': len(self._entries),
+                'memory_bytes': self.memory_usage(),
+                'memory_budget': self.memory_budget,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool, sized from settings.SQL_POOL_MEMORY_BUDGET."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(getattr(settings, 'SQL_POOL_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET))
+    return _pool
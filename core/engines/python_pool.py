@@ -0,0 +1,474 @@
+"""
+Pool of warm executor processes for user Python code.
+
+Workers are spawned once with pandas imported and keep recently used
+datasets loaded, so a run costs only the user's code. Jobs are routed to
+a worker that already holds the job's dataset when one is idle. Workers
+retire after MAX_JOBS_PER_WORKER jobs or once their RSS passes
+MAX_RSS_MB, and are replaced in the background.
+
+Runs are bounded by PythonLimits: the worker enforces CPU, memory and
+output limits itself (see python_worker.py); the pool enforces wall-clock
+time by killing a worker that doesn't answer in time.
+
+Runs are PythonRun objects: iterating one yields the stdout the code
+prints as it goes (for jobs with `stream` set) and then the result, and
+cancel() stops it early. run() is the blocking form.
+
+Jobs with a session (see python_sessions.py) always go to the worker
+holding that session in memory, waiting for it if it's busy. Sessions a
+worker spilled to disk can be picked up by any worker. The owner map is
+per pool, so with several web processes a session only stays warm if the
+same process serves the user; otherwise it round-trips through disk.
+"""
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import get_python_metrics
+from .python_worker import worker_main
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'PROCESSES': min(4, os.cpu_count() or 1),
+    'MAX_JOBS_PER_WORKER': 200,
+    'MAX_DATASETS': 4,  # datasets kept loaded per worker
+    'MAX_RSS_MB': 1024,
+}
+
+DEFAULT_LIMITS = {
+    'CPU_SECONDS': 10,           # CPU time per code block
+    'WALL_SECONDS': 15,          # wall-clock time per code block, incl. waiting on I/O
+    'MEMORY_MB': 1024,           # address space a code block may add to the worker
+    'MAX_OUTPUT_CHARS': 100_000, # captured stdout per code block
+}
+
+DEFAULT_SESSIONS = {
+    'IDLE_SECONDS': 1800,   # sessions unused for this long are dropped
+    'MAX_SESSION_MB': 512,  # a session growing past this is cleared
+    'MAX_TOTAL_MB': 1024,   # per worker; least recently used sessions spill to disk beyond it
+    'SPILL_DIR': None,      # defaults to <BASE_DIR>/cache/sessions
+}
+
+POLL_SECONDS = 0.25           # how often a waiting run checks for cancellation
+PROGRESS_SECONDS = 1          # silence before a streaming run reports progress
+CANCEL_GRACE_SECONDS = 1      # time a cancelled run gets to stop before its worker is killed
+
+# Forking a threaded web worker is unsafe; spawn starts from a clean interpreter
+_mp = multiprocessing.get_context('spawn')
+
+
+class PythonLimits:
+    def __init__(self, cpu_seconds=None, wall_seconds=None, memory_mb=None, max_output_chars=None):
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else DEFAULT_LIMITS['CPU_SECONDS']
+        self.wall_seconds = wall_seconds if wall_seconds is not None else DEFAULT_LIMITS['WALL_SECONDS']
+        self.memory_mb = memory_mb if memory_mb is not None else DEFAULT_LIMITS['MEMORY_MB']
+        self.max_output_chars = max_output_chars if max_output_chars is not None else DEFAULT_LIMITS['MAX_OUTPUT_CHARS']
+
+    @classmethod
+    def for_difficulty(cls, difficulty):
+        """Limits from settings.PYTHON_RUN_LIMITS[difficulty], falling back to 'default'."""
+        configured = getattr(settings, 'PYTHON_RUN_LIMITS', {})
+        options = dict(configured.get('default', {}))
+        options.update(configured.get(difficulty, {}))
+        return cls(
+            cpu_seconds=options.get('CPU_SECONDS'),
+            wall_seconds=options.get('WALL_SECONDS'),
+            memory_mb=options.get('MEMORY_MB'),
+            max_output_chars=options.get('MAX_OUTPUT_CHARS'),
+        )
+
+    def as_job(self):
+        """The worker-side limits, as plain data for the pipe."""
+        return {
+            'cpu_seconds': self.cpu_seconds,
+            'memory_mb': self.memory_mb,
+            'max_output_chars': self.max_output_chars,
+        }
+
+
+def session_options(key, reset=False):
+    """Worker-side session options for `key`, configured by settings.PYTHON_SESSIONS."""
+    options = dict(DEFAULT_SESSIONS, **getattr(settings, 'PYTHON_SESSIONS', {}))
+    spill_dir = options['SPILL_DIR'] or os.path.join(settings.BASE_DIR, 'cache', 'sessions')
+    return {
+        'key': key,
+        'reset': reset,
+        'idle_seconds': options['IDLE_SECONDS'],
+        'max_session_mb': options['MAX_SESSION_MB'],
+        'max_total_mb': options['MAX_TOTAL_MB'],
+        'spill_dir': str(spill_dir),
+    }
+
+
+def _failed(error, error_code=None, limit=None, usage=None, session=None):
+    return {
+        'success': False, 'output': '', 'error': error, 'fingerprint': None,
+        'expected_output': None, 'expected_fingerprint': None,
+        'error_code': error_code, 'limit': limit, 'usage': usage, 'session': session,
+        'grading_error': None,
+    }
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.ready = False
+        self.jobs = 0
+        self.datasets = set()
+
+    def wait_ready(self):
+        if not self.ready:
+            self.conn.recv()
+            self.ready = True
+
+    def stop(self, timeout=1):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class PythonRun:
+    """
+    One job on the pool, consumed as events: ('stdout', text) as the code
+    prints (streaming jobs only), ('progress', {'elapsed_seconds'}) after
+    PROGRESS_SECONDS without output, and finally ('result', result).
+
+    cancel() asks the worker to stop the code (SIGUSR1) and kills it if it
+    doesn't within CANCEL_GRACE_SECONDS. cancel() and close() can be called
+    from any thread, including while another thread is iterating.
+    """
+
+    def __init__(self, pool, job, limits, run_id=None, owner=None):
+        self.pool = pool
+        self.limits = limits
+        self.job = dict(job, limits=limits.as_job())
+        self.run_id = run_id
+        self.owner = owner
+        self.session_key = job['session']['key'] if job.get('session') else None
+        self.result = None
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._started = False
+        self._events = self._run()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            self._started = True
+            return next(self._events)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def close(self):
+        """Cancels the run if it's still going and waits for the worker to be released."""
+        self.cancel()
+        with self._lock:
+            if not self._started:
+                self._events.close()
+                self._done(None)
+                return
+            for _ in self._events:
+                pass
+
+    def wait(self):
+        for _ in self:
+            pass
+        return self.result
+
+    def _done(self, result):
+        self.result = result
+        if self.run_id:
+            with self.pool._cond:
+                self.pool._runs.pop(self.run_id, None)
+        if result is not None:
+            self.pool._record(self.job, result)
+        return result
+
+    def _lost_session(self, message):
+        return {'status': 'dropped', 'message': message} if self.session_key else None
+
+    def _run(self):
+        pool, job, limits = self.pool, self.job, self.limits
+        # Each code block gets the full wall-clock budget
+        timeout = limits.wall_seconds * (2 if job.get('validation_code') else 1)
+
+        worker = pool._checkout(job['dataset_key'], self.session_key)
+        if self._cancelled.is_set():
+            pool._checkin(worker)
+            yield 'result', self._done(_failed("Run cancelled.", 'cancelled'))
+            return
+        try:
+            worker.wait_ready()
+            started = last_event = time.perf_counter()
+            deadline, cancel_deadline = started + timeout, None
+            worker.conn.send(job)
+            while True:
+                now = time.perf_counter()
+                if self._cancelled.is_set() and cancel_deadline is None:
+                    os.kill(worker.process.pid, signal.SIGUSR1)
+                    cancel_deadline = now + CANCEL_GRACE_SECONDS
+                wake = min(deadline, cancel_deadline or deadline, last_event + PROGRESS_SECONDS, now + POLL_SECONDS)
+                if worker.conn.poll(max(wake - now, 0)):
+                    message = worker.conn.recv()
+                    if 'stdout' not in message:
+                        break
+                    last_event = time.perf_counter()
+                    yield 'stdout', message['stdout']
+                    continue
+
+                now = time.perf_counter()
+                if now >= deadline or (cancel_deadline and now >= cancel_deadline):
+                    cancelled = cancel_deadline is not None
+                    pool._discard(worker, 'cancelled' if cancelled else 'timed_out')
+                    usage = {'cpu_seconds': None, 'wall_seconds': round(now - started, 3), 'peak_rss_mb': None}
+                    if cancelled:
+                        result = _failed("Run cancelled.", 'cancelled', None, usage, self._lost_session(
+                            "The session was lost when the run was stopped."))
+                    else:
+                        result = _failed(
+                            f"Time limit exceeded ({limits.wall_seconds}s).", 'wall_limit', limits.wall_seconds, usage,
+                            self._lost_session("The session was lost when the run was stopped."),
+                        )
+                    yield 'result', self._done(result)
+                    return
+                if now - last_event >= PROGRESS_SECONDS:
+                    last_event = now
+                    yield 'progress', {'elapsed_seconds': round(now - started, 1)}
+        except (EOFError, OSError):
+            logger.warning("Python executor %s exited mid-job", worker.process.pid)
+            pool._discard(worker, 'crashed')
+            result = _failed(
+                'The Python executor crashed while running this code.',
+                session=self._lost_session("The session was lost when the executor crashed."),
+            )
+            yield 'result', self._done(result)
+            return
+        except GeneratorExit:
+            # Abandoned mid-run without close(): the worker may still be busy
+            pool._discard(worker, 'cancelled')
+            self._done(None)
+            raise
+
+        pool._finish(worker, message)
+        yield 'result', self._done(message)
+
+
+class PythonWorkerPool:
+    def __init__(self, processes, max_jobs, max_datasets, max_rss_mb):
+        self.processes = processes
+        self.max_jobs = max_jobs
+        self.max_datasets = max_datasets
+        self.max_rss_mb = max_rss_mb
+        self._idle = []
+        self._session_owner = {}  # session key -> worker holding it in memory
+        self._runs = {}  # run id -> PythonRun, for cancellation
+        self._cond = threading.Condition()
+        self._started = False
+        self._closed = False
+        self.jobs = 0
+        self.warm_hits = 0
+        self.session_hits = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    def _spawn(self):
+        parent_conn, child_conn = _mp.Pipe()
+        process = _mp.Process(
+            target=worker_main,
+            args=(child_conn, self.max_jobs, self.max_datasets, self.max_rss_mb),
+            name='python-executor',
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn)
+
+    def start(self):
+        """Spawns every worker; they import pandas in parallel while the pool is used."""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+            self._idle.extend(self._spawn() for _ in range(self.processes))
+
+    def _checkout(self, dataset_key, session_key=None):
+        self.start()
+        with self._cond:
+            while True:
+                owner = self._session_owner.get(session_key) if session_key else None
+                if owner is not None:
+                    # Only the owner has the session's latest state
+                    if owner in self._idle:
+                        self._idle.remove(owner)
+                        self.session_hits += 1
+                        return owner
+                elif self._idle:
+                    break
+                self._cond.wait()
+            for i in range(len(self._idle) - 1, -1, -1):
+                if dataset_key in self._idle[i].datasets:
+                    self.warm_hits += 1
+                    return self._idle.pop(i)
+            # Least recently used worker; its datasets are the coldest
+            return self._idle.pop(0)
+
+    def _checkin(self, worker):
+        with self._cond:
+            if self._closed:
+                worker.stop()
+                return
+            self._idle.append(worker)
+            # Wake everyone: a waiter may need this particular worker
+            self._cond.notify_all()
+
+    def _forget(self, worker):
+        """Drops the session ownership of a worker that is going away."""
+        with self._cond:
+            for key in [key for key, owner in self._session_owner.items() if owner is worker]:
+                del self._session_owner[key]
+            self._cond.notify_all()
+
+    def stream(self, job, limits=None, run_id=None, owner=None):
+        """
+        Starts one job ({dataset_key, version, columnar, code,
+        validation_code, session, stream}) under `limits` and returns its
+        PythonRun. With run_id, the run can be cancelled through cancel()
+        by the same `owner`.
+        """
+        run = PythonRun(self, job, limits or PythonLimits(), run_id, owner)
+        if run_id:
+            with self._cond:
+                self._runs[run_id] = run
+        return run
+
+    def run(self, job, limits=None):
+        """
+        Runs one job to completion and returns {success, output, error,
+        fingerprint, expected_output, expected_fingerprint, error_code,
+        limit, usage, session, grading_error}. grading_error is the
+        validation code's error, if it failed.
+        """
+        return self.stream(job, limits).wait()
+
+    def cancel(self, run_id, owner=None):
+        """
+        Cancels a run started by this process for `owner`; returns False if
+        there's no such run, or it belongs to someone else.
+        """
+        with self._cond:
+            run = self._runs.get(run_id)
+        if run is None or run.owner is None or run.owner != owner:
+            return False
+        run.cancel()
+        return True
+
+    def _discard(self, worker, counter):
+        """Replaces a worker that was killed or died mid-job; its in-memory sessions are lost."""
+        worker.kill()
+        self._forget(worker)
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+        self._checkin(self._spawn())
+
+    def _finish(self, worker, result):
+        """Books a worker's reply and returns the worker to the pool, or replaces it if it retired."""
+        worker.jobs += 1
+        worker.datasets = set(result.pop('datasets'))
+        sessions = set(result.pop('sessions'))
+        with self._cond:
+            self.jobs += 1
+            if result['error_code'] == 'cancelled':
+                self.cancelled += 1
+            for key in [key for key, owner in self._session_owner.items() if owner is worker and key not in sessions]:
+                del self._session_owner[key]
+            self._session_owner.update((key, worker) for key in sessions)
+        if result.pop('retire'):
+            with self._cond:
+                self.recycled += 1
+            # A retiring worker has spilled its sessions, so none are owned any more
+            self._forget(worker)
+            worker.stop()
+            worker = self._spawn()
+        self._checkin(worker)
+
+    def _record(self, job, result):
+        """Sends one run's resource usage to the structured log and the per-dataset metrics."""
+        stats = {
+            'dataset': job['dataset_key'],
+            'success': result['success'],
+            'error_code': result['error_code'],
+            'validated': bool(job.get('validation_code')),
+            'usage': result['usage'],
+        }
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("python_run %s", json.dumps(stats))
+        # A cancelled run didn't hit a limit
+        error_code = result['error_code'] if result['error_code'] != 'cancelled' else None
+        get_python_metrics().observe(job['dataset_key'], result['usage'], error_code)
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            worker.stop()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'processes': self.processes,
+                'idle': len(self._idle),
+                'jobs': self.jobs,
+                'warm_hits': self.warm_hits,
+                'sessions': len(self._session_owner),
+                'session_hits': self.session_hits,
+                'recycled': self.recycled,
+                'crashed': self.crashed,
+                'timed_out': self.timed_out,
+                'cancelled': self.cancelled,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_python_pool():
+    """Process-wide worker pool configured by settings.PYTHON_WORKERS."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                options = dict(DEFAULT_OPTIONS, **getattr(settings, 'PYTHON_WORKERS', {}))
+                _pool = PythonWorkerPool(
+                    processes=options['PROCESSES'],
+                    max_jobs=options['MAX_JOBS_PER_WORKER'],
+                    max_datasets=options['MAX_DATASETS'],
+                    max_rss_mb=options['MAX_RSS_MB'],
+                )
+                atexit.register(_pool.shutdown)
+    return _pool
@@ -0,0 +1,172 @@
+"""
+Notebook-style Python sessions, held inside executor processes.
+
+A session is the variable scope of one user on one case, kept between runs
+so expensive cleaning steps aren't recomputed on every click. It lives
+either in exactly one worker's memory or pickled in the spill directory,
+never both: loading a spilled session deletes its file. Workers spill their
+least recently used sessions when their sessions outgrow the memory budget,
+and spill everything when they retire, so a replacement worker can pick up
+where they left off. Sessions idle for longer than the idle timeout are
+dropped in either place.
+
+Like python_worker.py this runs in spawned children and must not import Django.
+"""
+import os
+import sys
+import time
+import pickle
+import types
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def _value_bytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=False))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return sys.getsizeof(value)
+
+
+class Session:
+    def __init__(self, key, version, scope):
+        self.key = key
+        self.version = version  # dataset version the scope was started from
+        self.scope = scope
+        self.last_used = time.time()
+        self.size_bytes = 0
+
+    def measure(self):
+        """Shallow estimate: object columns count their pointers, not their strings."""
+        self.size_bytes = sum(
+            _value_bytes(value) for name, value in self.scope.items()
+            if not name.startswith('__') and not isinstance(value, types.ModuleType)
+        )
+        return self.size_bytes
+
+    def variables(self):
+        return sorted(
+            name for name, value in self.scope.items()
+            if not name.startswith('_') and not isinstance(value, types.ModuleType)
+        )
+
+
+class SessionStore:
+    def __init__(self):
+        self._sessions = OrderedDict()  # key -> Session, LRU order
+
+    def _spill_path(self, options, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return Path(options['spill_dir']) / f"session-{digest}.pkl"
+
+    def open(self, options, version, df):
+        """
+        Returns (session, status) for options['key']; status is 'new',
+        'memory', 'restored' (from disk) or 'expired' (idle too long or the
+        dataset changed, so it was started over).
+        """
+        key = options['key']
+        session = self._sessions.pop(key, None)
+        status = 'memory'
+        if session is None:
+            session, status = self._load(options, key), 'restored'
+        if session is None:
+            status = 'new'
+        elif options.get('reset'):
+            session, status = None, 'new'
+        elif session.version != version or time.time() - session.last_used > options['idle_seconds']:
+            session, status = None, 'expired'
+
+        if session is None:
+            session = Session(key, version, {'pd': pd, 'df': df.copy(deep=False)})
+        self._sessions[key] = session
+        session.last_used = time.time()
+        return session, status
+
+    def _load(self, options, key):
+        path = self._spill_path(options, key)
+        try:
+            with open(path, 'rb') as spilled:
+                version, last_used, variables = pickle.load(spilled)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        finally:
+            # The in-memory copy is now the only copy
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        scope = {'pd': pd}
+        for name, data in variables.items():
+            try:
+                scope[name] = pickle.loads(data)
+            except Exception:
+                # e.g. an instance of a class the session defined; it's gone with the class
+                continue
+        session = Session(key, version, scope)
+        session.last_used = last_used
+        return session
+
+    def spill(self, options, session):
+        """
+        Pickles the session's variables one by one, dropping values that
+        can't be pickled (generators, open files, lambdas...).
+        """
+        variables = {}
+        for name, value in session.scope.items():
+            if name.startswith('__') or isinstance(value, types.ModuleType):
+                continue
+            try:
+                variables[name] = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                continue
+        path = self._spill_path(options, session.key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as spilled:
+            pickle.dump((session.version, session.last_used, variables), spilled, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def discard(self, key):
+        self._sessions.pop(key, None)
+
+    def enforce(self, options):
+        """
+        After a run: drops idle sessions, then spills the least recently used
+        ones while the worker's sessions exceed options['max_total_mb'].
+        """
+        now = time.time()
+        for key, session in list(self._sessions.items()):
+            if now - session.last_used > options['idle_seconds']:
+                del self._sessions[key]
+
+        budget = options['max_total_mb'] * 1024 * 1024
+        # Keep the most recent session in memory even if it alone is over budget
+        while len(self._sessions) > 1 and sum(s.size_bytes for s in self._sessions.values()) > budget:
+            _, session = self._sessions.popitem(last=False)
+            self.spill(options, session)
+
+        self._expire_spilled(options, now)
+
+    def _expire_spilled(self, options, now):
+        for path in Path(options['spill_dir']).glob('session-*.pkl'):
+            try:
+                if now - path.stat().st_mtime > options['idle_seconds']:
+                    path.unlink()
+            except OSError:
+                continue
+
+    def spill_all(self, options):
+        while self._sessions:
+            _, session = self._sessions.popitem(last=False)
+            self.spill(options, session)
+
+    def keys(self):
+        return list(self._sessions)
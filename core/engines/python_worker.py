@@ -0,0 +1,366 @@
+"""
+Entry point of the Python executor processes (see python_pool.py).
+
+Runs in a spawned child, so it must not import Django: it only needs pandas
+and the dataset loader. Datasets are attached from their memory-mapped
+columnar copy (see columnar.py), so workers share the pages instead of
+each holding the data; free-text columns are pickled there and so are
+copied into each worker rather than shared. Every job gets a shallow
+copy-on-write `df`: user code that mutates it copies just the touched
+columns and can't leak into the next run. Copy-on-write is always on
+from pandas 3 and is switched on at startup on pandas 2.x; without it,
+`df.loc[0, 'a'] = 1` would write into the read-only mapping and fail.
+
+Each code block runs under the job's limits: CPU time (RLIMIT_CPU, raised
+as an exception from SIGXCPU), address space (RLIMIT_AS, as headroom above
+what the worker already maps) and captured output size. Wall-clock time is
+enforced by the parent, which kills the process if no reply arrives.
+
+With `stream` set on the job, stdout is also sent to the parent in small
+batches while the code runs, and SIGUSR1 cancels the run in progress.
+
+Jobs with `session` options run in that user's persistent scope instead
+(see python_sessions.py); the validation code still gets a fresh one.
+"""
+import ast
+import io
+import math
+import resource
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager, redirect_stdout
+
+import pandas as pd
+
+from .compare import fingerprint_value
+from .loader import read_columnar
+from .python_sessions import SessionStore
+
+
+class ResourceLimitExceeded(BaseException):
+    # BaseException, like KeyboardInterrupt, so `except Exception` in user code can't swallow it
+    def __init__(self, code, message, limit=None):
+        super().__init__(message)
+        self.code = code
+        self.limit = limit
+
+
+class _DatasetCache:
+    def __init__(self, max_datasets):
+        self.max_datasets = max_datasets
+        self._frames = OrderedDict()  # dataset key -> (version, DataFrame)
+
+    def get(self, key, version, directory):
+        cached = self._frames.get(key)
+        if cached is not None and cached[0] == version:
+            self._frames.move_to_end(key)
+            return cached[1]
+        frame = read_columnar(directory)
+        self._frames[key] = (version, frame)
+        self._frames.move_to_end(key)
+        while len(self._frames) > self.max_datasets:
+            self._frames.popitem(last=False)
+        return frame
+
+    def keys(self):
+        return list(self._frames)
+
+
+STREAM_FLUSH_CHARS = 4096
+STREAM_FLUSH_SECONDS = 0.1
+
+# Set while user code runs, so a late cancel signal can't hit the job loop
+_running = False
+
+
+class _CappedOutput(io.StringIO):
+    """
+    stdout buffer that keeps the first max_chars and then stops the run.
+    With `send`, text is also forwarded as it's written: once
+    STREAM_FLUSH_CHARS are pending, and by a helper thread every
+    STREAM_FLUSH_SECONDS, so a print before a long computation shows up
+    right away. Call close_stream() when the code is done.
+    """
+
+    def __init__(self, max_chars, send=None):
+        super().__init__()
+        self.max_chars = max_chars
+        self.size = 0
+        self.send = send
+        self._pending = []
+        self._pending_size = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = None
+        if send is not None:
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def write(self, text):
+        room = self.max_chars - self.size
+        if len(text) > room:
+            self._forward(text[:max(room, 0)])
+            super().write(text[:max(room, 0)])
+            self.size = self.max_chars
+            raise ResourceLimitExceeded('output_limit', f"Output exceeded {self.max_chars} characters.", self.max_chars)
+        self.size += len(text)
+        self._forward(text)
+        return super().write(text)
+
+    def _forward(self, text):
+        if self.send is None or not text:
+            return
+        with self._lock:
+            self._pending.append(text)
+            self._pending_size += len(text)
+            if self._pending_size >= STREAM_FLUSH_CHARS:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        # A limit or cancel signal mid-send would leave half a message in the pipe
+        blocked = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGUSR1, signal.SIGXCPU})
+        try:
+            self.send({'stdout': ''.join(self._pending)})
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+        self._pending, self._pending_size = [], 0
+
+    def _flush_periodically(self):
+        while not self._stopped.wait(STREAM_FLUSH_SECONDS):
+            with self._lock:
+                self._flush()
+
+    def close_stream(self):
+        if self._flusher is None:
+            return
+        self._stopped.set()
+        self._flusher.join()
+        with self._lock:
+            self._flush()
+
+
+def _on_cpu_limit(signum, frame):
+    raise ResourceLimitExceeded('cpu_limit', "CPU time limit exceeded.")
+
+
+def _on_cancel(signum, frame):
+    if _running:
+        raise ResourceLimitExceeded('cancelled', "Run cancelled.")
+
+
+def _cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _proc_status_kb(field):
+    """A kB value from /proc/self/status (Linux), or None."""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    # Linux resets VmHWM to the current RSS on "5"; elsewhere peaks are per process
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    peak = _proc_status_kb('VmHWM')
+    if peak is None:
+        # ru_maxrss is KB on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024
+
+
+@contextmanager
+def _limited(limits):
+    """Applies the CPU and address-space limits of one code block, then lifts them."""
+    cpu_soft, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+    as_soft, as_hard = resource.getrlimit(resource.RLIMIT_AS)
+
+    cpu_limit = math.ceil(_cpu_seconds() + limits['cpu_seconds'])
+    if cpu_hard != resource.RLIM_INFINITY:
+        cpu_limit = min(cpu_limit, cpu_hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_hard))
+
+    mapped_kb = _proc_status_kb('VmSize')
+    if mapped_kb is not None:
+        as_limit = (mapped_kb + limits['memory_mb'] * 1024) * 1024
+        if as_hard != resource.RLIM_INFINITY:
+            as_limit = min(as_limit, as_hard)
+        resource.setrlimit(resource.RLIMIT_AS, (as_limit, as_hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, cpu_hard))
+        resource.setrlimit(resource.RLIMIT_AS, (as_soft, as_hard))
+
+
+def _run_code(code, df, limits, session=None, send=None):
+    """
+    Runs one code block and returns {success, output, error, fingerprint,
+    error_code, limit}. As in a notebook, a trailing expression is the
+    code's result value; its fingerprint is computed here so only the
+    digest leaves the process. With a session the code runs in, and
+    updates, the session's scope instead of a fresh one. With `send`,
+    stdout is streamed through it as well.
+    """
+    global _running
+    output = _CappedOutput(limits['max_output_chars'], send)
+    if session is not None:
+        # Session scope doubles as globals so functions the user defines see earlier variables
+        global_scope = scope = session.scope
+    else:
+        global_scope, scope = {}, {'pd': pd, 'df': df.copy(deep=False)}
+    result = {'success': False, 'error': None, 'fingerprint': None, 'error_code': None, 'limit': None}
+    _running = True
+    try:
+        with _limited(limits), redirect_stdout(output):
+            tree = ast.parse(code)
+            last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+            exec(compile(tree, '<string>', 'exec'), global_scope, scope)
+            value = eval(compile(ast.Expression(last.value), '<string>', 'eval'), global_scope, scope) if last else None
+            result['fingerprint'] = fingerprint_value(value) if value is not None else None
+        result['success'] = True
+    except ResourceLimitExceeded as e:
+        limit = limits['cpu_seconds'] if e.code == 'cpu_limit' else e.limit
+        result.update(error=str(e), error_code=e.code, limit=limit)
+    except MemoryError:
+        result.update(
+            error=f"Memory limit exceeded ({limits['memory_mb']} MB).",
+            error_code='memory_limit', limit=limits['memory_mb'],
+        )
+    except Exception:
+        result['error'] = traceback.format_exc()
+    finally:
+        _running = False
+    # Keep partially printed lines alongside any error
+    result['output'] = output.getvalue()
+    output.close_stream()
+    return result
+
+
+def _close_session(job, sessions, session, status, result):
+    """Applies the per-session memory cap after a run and returns the session info for the reply."""
+    options = job['session']
+    if result['error_code'] == 'memory_limit':
+        sessions.discard(session.key)
+        info = {'status': 'dropped', 'message': "The session ran out of memory and was cleared."}
+    elif session.measure() > options['max_session_mb'] * 1024 * 1024:
+        sessions.discard(session.key)
+        info = {'status': 'dropped', 'message': f"The session grew past {options['max_session_mb']} MB and was cleared."}
+    else:
+        info = {'status': status, 'variables': session.variables(), 'size_mb': round(session.size_bytes / 2 ** 20, 1)}
+    sessions.enforce(options)
+    return info
+
+
+def run_job(job, datasets, sessions, send=None):
+    result = {
+        'success': False, 'output': '', 'error': None, 'fingerprint': None,
+        'expected_output': None, 'expected_fingerprint': None,
+        'error_code': None, 'limit': None, 'usage': None, 'session': None,
+        'grading_error': None,
+    }
+    try:
+        df = datasets.get(job['dataset_key'], job['version'], job['columnar'])
+    except Exception as e:
+        return dict(result, error=f'Failed to load CSV: {str(e)}')
+
+    limits = job['limits']
+    started, cpu_started = time.perf_counter(), _cpu_seconds()
+    _reset_peak_rss()
+
+    session = None
+    if job.get('session'):
+        session, status = sessions.open(job['session'], job['version'], df)
+    # Only the user's code streams; validation output is never shown
+    result.update(_run_code(job['code'], df, limits, session, send if job.get('stream') else None))
+    if session is not None:
+        result['session'] = _close_session(job, sessions, session, status, result)
+
+    # Validation always starts from a fresh scope
+    if result['success'] and job.get('validation_code'):
+        expected = _run_code(job['validation_code'], df, limits)
+        if expected['success']:
+            result.update(expected_output=expected['output'], expected_fingerprint=expected['fingerprint'])
+        else:
+            # A broken validation query isn't the user's fault: their run
+            # stands and only the grading fails
+            result['grading_error'] = expected['error']
+
+    result['usage'] = {
+        'cpu_seconds': round(_cpu_seconds() - cpu_started, 3),
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+    return result
+
+
+def _enable_copy_on_write():
+    # The default from pandas 3, where the option is deprecated
+    if int(pd.__version__.split('.')[0]) < 3:
+        pd.set_option('mode.copy_on_write', True)
+
+
+def worker_main(conn, max_jobs, max_datasets, max_rss_mb):
+    """
+    Serves jobs from `conn` until the parent closes it or a recycle limit
+    is hit. Every reply carries `retire` so the parent knows to replace
+    this process after reading it.
+    """
+    signal.signal(signal.SIGXCPU, _on_cpu_limit)
+    signal.signal(signal.SIGUSR1, _on_cancel)
+    _enable_copy_on_write()
+    datasets = _DatasetCache(max_datasets)
+    sessions = SessionStore()
+    session_options = None  # where to spill sessions on exit
+    conn.send({'ready': True})
+    jobs = 0
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None:
+            break
+
+        session_options = job.get('session') or session_options
+        result = run_job(job, datasets, sessions, conn.send)
+        jobs += 1
+        result['datasets'] = datasets.keys()
+        result['sessions'] = sessions.keys()
+        result['retire'] = bool(
+            jobs >= max_jobs
+            or (max_rss_mb and result['usage'] and result['usage']['peak_rss_mb'] > max_rss_mb)
+            # The heap may be fragmented or half-freed after running out of memory
+            or result['error_code'] == 'memory_limit'
+        )
+        if result['retire']:
+            # Spill before replying, so the replacement worker can load them
+            if session_options:
+                sessions.spill_all(session_options)
+            result['sessions'] = []
+        conn.send(result)
+        if result['retire']:
+            break
+    if session_options:
+        sessions.spill_all(session_options)
+    conn.close()
+    sys.exit(0)
@@ -0,0 +1,134 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_TTL = 300  # seconds
+
+_SQL_TOKEN = re.compile(
+    r"""
+    (?P<literal>'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])  # strings and quoted identifiers
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<space>\s+)
+    | (?P<other>[^'"`\[\s\-/]+|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def normalize_sql(query):
+    """
+    Canonical form of a query for fingerprints (workload and latency
+    stats): comments removed and whitespace collapsed. Everything else is
+    kept as typed, case included.
+    """
+    parts = []
+    pending_space = False
+    for match in _SQL_TOKEN.finditer(query):
+        kind = match.lastgroup
+        if kind in ('space', 'comment'):
+            pending_space = True
+            continue
+        if pending_space and parts:
+            parts.append(' ')
+        pending_space = False
+        parts.append(match.group())
+    return ''.join(parts).rstrip(';').strip()
+
+
+def sql_fingerprint(query):
+    return hashlib.sha1(normalize_sql(query).encode('utf-8')).hexdigest()
+
+
+class QueryResultCache:
+    """
+    In-process LRU of SQLEngine results keyed by
+    (dataset key, dataset version, hash of the SQL statement).
+    Entries expire after `ttl` seconds; the oldest are dropped past `max_entries`.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def make_key(self, dataset_key, version, query):
+        # The statement as typed, not normalize_sql: SQLite names result
+        # columns after the text of each expression, whitespace and comments
+        # included ('a IS NULL' vs 'a  is null'), and cached results carry them
+        statement = query.strip().rstrip(';').rstrip()
+        return (dataset_key, version, hashlib.sha1(statement.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                expires_at, result = item
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def set(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, dataset_key):
+        """Drops every cached result for a dataset, whatever its version."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == dataset_key]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Process-wide cache, configured by settings.SQL_RESULT_CACHE."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                options = getattr(settings, 'SQL_RESULT_CACHE', {})
+                _cache = QueryResultCache(
+                    max_entries=options.get('MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+                    ttl=options.get('TTL', DEFAULT_TTL),
+                )
+    return _cache
@@ -0,0 +1,277 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+from django.conf import settings
+
+from .indexer import choose_indexes, create_indexes, quote_identifier
+from .stats import StatsBuilder, index_profile
+from .loader import SchemaBuilder, apply_schema, preview_rows, schema_affinities, sql_frame
+
+logger = logging.getLogger(__name__)
+
+# Bump when the snapshot layout changes so old files get rebuilt.
+SNAPSHOT_FORMAT = 6
+TABLE_NAME = 'dataset'
+META_TABLE = '_snapshot_meta'
+
+DEFAULT_INGEST = {
+    'CHUNK_ROWS': 50_000,
+    'PREVIEW_ROWS': 100,
+    'EAGER_COLUMNAR_MAX_MB': 256,
+    'PARQUET': True,                # compressed copy read instead of the CSV (needs pyarrow)
+    'PARQUET_COMPRESSION': 'zstd',
+}
+
+_build_lock = threading.Lock()
+_CONTENT_HASH = re.compile(r'[0-9a-f]{64}')
+
+
+def snapshot_root():
+    return Path(getattr(settings, 'DATASET_SNAPSHOT_ROOT', Path(settings.BASE_DIR) / 'cache' / 'snapshots'))
+
+
+def source_signature(dataset_path):
+    """
+    Cheap change detector for the source CSV (size + mtime). Content-addressed
+    files (see core/storage.py) are named after their hash, which is used instead.
+    """
+    stem = Path(dataset_path).stem
+    if _CONTENT_HASH.fullmatch(stem):
+        return stem
+    stat = os.stat(dataset_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def dataset_version(dataset_path):
+    """
+    Version key for pools and caches: changes when the CSV changes and when the
+    snapshot is rebuilt or re-indexed, since indexes are versioned with the data.
+    """
+    signature = source_signature(dataset_path)
+    try:
+        return f"{signature}-{os.stat(snapshot_path(dataset_path)).st_mtime_ns}"
+    except FileNotFoundError:
+        return signature
+
+
+def snapshot_path(dataset_path):
+    """One snapshot file per source path, e.g. titanic-1a2b3c4d5e6f.sqlite3"""
+    source = Path(dataset_path).resolve()
+    digest = hashlib.sha1(str(source).encode('utf-8')).hexdigest()[:12]
+    return snapshot_root() / f"{source.stem}-{digest}.sqlite3"
+
+
+def connect_snapshot(path):
+    """Opens a snapshot read-only. Writes from user queries fail at the SQLite level."""
+    uri = Path(path).resolve().as_uri() + '?mode=ro'
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+def read_meta(path):
+    try:
+        conn = connect_snapshot(path)
+    except sqlite3.Error:
+        return {}
+    try:
+        return dict(conn.execute(f"SELECT key, value FROM {META_TABLE}").fetchall())
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+
+
+def is_fresh(path, signature):
+    if not os.path.exists(path):
+        return False
+    meta = read_meta(path)
+    return meta.get('format') == str(SNAPSHOT_FORMAT) and meta.get('source_signature') == signature
+
+
+def ingest_options():
+    return dict(DEFAULT_INGEST, **getattr(settings, 'DATASET_INGEST', {}))
+
+
+def _create_table(conn, columns, affinities, name=TABLE_NAME):
+    definitions = ', '.join(f"{quote_identifier(col)} {affinities[col]}" for col in columns)
+    conn.execute(f"CREATE TABLE {quote_identifier(name)} ({definitions})")
+
+
+def _retype_table(conn, columns, affinities):
+    """
+    Copies the table into one declared with the final affinities, for when
+    later chunks changed a column's type (e.g. text after numbers). SQLite
+    converts the values on insert.
+    """
+    _create_table(conn, columns, affinities, name=f"{TABLE_NAME}_retyped")
+    conn.execute(f"INSERT INTO {TABLE_NAME}_retyped SELECT * FROM {TABLE_NAME}")
+    conn.execute(f"DROP TABLE {TABLE_NAME}")
+    conn.execute(f"ALTER TABLE {TABLE_NAME}_retyped RENAME TO {TABLE_NAME}")
+
+
+def _align_date_formats(conn, date_columns):
+    """
+    Chunks format dates without a time of day as 'YYYY-MM-DD'. When any
+    chunk had times, give the others ' 00:00:00' so the column sorts and
+    compares as one format, as sql_frame does for a whole frame.
+    """
+    for col in date_columns:
+        quoted = quote_identifier(col)
+        if conn.execute(f"SELECT 1 FROM {TABLE_NAME} WHERE length({quoted}) > 10 LIMIT 1").fetchone():
+            conn.execute(f"UPDATE {TABLE_NAME} SET {quoted} = {quoted} || ' 00:00:00' WHERE length({quoted}) = 10")
+
+
+def build_snapshot(dataset_path, schema=None):
+    """
+    Streams the CSV into a typed SQLite file next to the other snapshots,
+    CHUNK_ROWS at a time, so memory use doesn't grow with the file. The same
+    pass infers the schema (unless given), collects column statistics (see
+    stats.py), which also pick the indexes, and keeps a preview of the
+    first rows; all of it is stored in the meta table (see snapshot_summary). The file is written under a
+    temporary name and swapped in atomically so readers never see a
+    half-built snapshot.
+    """
+    target = snapshot_path(dataset_path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    signature = source_signature(dataset_path)
+    tmp_path = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    options = ingest_options()
+
+    # parquet.py imports this module
+    from .parquet import dataset_chunks
+
+    builder = SchemaBuilder()
+    stats = StatsBuilder()
+    preview = None
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # With a schema (a rebuild), from the Parquet copy when there is one
+        for chunk in dataset_chunks(dataset_path, schema, options['CHUNK_ROWS']):
+            builder.update(chunk)
+            if preview is None:
+                # Types are decided on the first chunk; later chunks can only widen them
+                preview = chunk.head(options['PREVIEW_ROWS'])
+                initial = schema or builder.schema()
+                _create_table(conn, builder.columns, schema_affinities(initial))
+                date_columns = [col for col, spec in initial.items() if spec['dtype'] == 'datetime64[ns]']
+            if not schema:
+                chunk = apply_schema(chunk, {col: initial[col] for col in date_columns})
+            stats.update(chunk)
+            sql_frame(chunk).to_sql(TABLE_NAME, conn, index=False, if_exists='append')
+        if preview is None:
+            # A header-only CSV still yields one empty chunk; no chunk means no columns
+            raise ValueError(f"Empty dataset, no columns to snapshot: {dataset_path}")
+
+        final = schema or builder.schema()
+        if schema_affinities(final) != schema_affinities(initial):
+            _retype_table(conn, builder.columns, schema_affinities(final))
+        _align_date_formats(conn, date_columns)
+        column_stats = stats.summary()
+        indexes = choose_indexes(index_profile(column_stats), builder.row_count)
+        create_indexes(conn, TABLE_NAME, indexes)
+        conn.execute(f"CREATE TABLE {META_TABLE} (key TEXT PRIMARY KEY, value TEXT)")
+        conn.executemany(
+            f"INSERT INTO {META_TABLE} (key, value) VALUES (?, ?)",
+            [
+                ('format', str(SNAPSHOT_FORMAT)),
+                ('source_signature', signature),
+                ('row_count', str(builder.row_count)),
+                ('indexes', json.dumps(indexes)),
+                ('index_version', '1'),
+                ('columns', json.dumps(builder.columns)),
+                ('schema', json.dumps(final)),
+                ('stats', json.dumps(column_stats)),
+                # Dates formatted as in the table, so the preview matches rows read from it
+                ('preview', json.dumps(preview_rows(sql_frame(apply_schema(preview, final))))),
+            ],
+        )
+        conn.commit()
+    except Exception:
+        conn.close()
+        tmp_path.unlink(missing_ok=True)
+        raise
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, target)
+    logger.info("Built snapshot %s (%s rows, indexes %s) from %s", target.name, builder.row_count, indexes, dataset_path)
+    return target
+
+
+def snapshot_summary(path):
+    """What ingest learned about the CSV: {columns, row_count, schema, stats, indexes, preview}."""
+    meta = read_meta(path)
+    return {
+        'columns': json.loads(meta['columns']),
+        'row_count': int(meta['row_count']),
+        'schema': json.loads(meta['schema']),
+        'stats': json.loads(meta['stats']),
+        'indexes': json.loads(meta['indexes']),
+        'preview': json.loads(meta['preview']),
+    }
+
+
+def snapshot_indexes(path):
+    return json.loads(read_meta(path).get('indexes', '[]'))
+
+
+def add_indexes(dataset_path, columns):
+    """
+    Adds indexes to an existing snapshot and bumps its index_version.
+    Works on a copy that is swapped in, so pooled readers keep a consistent file.
+    """
+    target = ensure_snapshot(dataset_path)
+    with _build_lock:
+        existing = snapshot_indexes(target)
+        new = [col for col in columns if col not in existing]
+        if not new:
+            return existing
+
+        tmp_path = target.with_name(f"{target.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+        shutil.copyfile(target, tmp_path)
+        conn = sqlite3.connect(tmp_path)
+        try:
+            create_indexes(conn, TABLE_NAME, new)
+            meta = dict(conn.execute(f"SELECT key, value FROM {META_TABLE}").fetchall())
+            conn.executemany(
+                f"UPDATE {META_TABLE} SET value = ? WHERE key = ?",
+                [
+                    (json.dumps(existing + new), 'indexes'),
+                    (str(int(meta.get('index_version', '1')) + 1), 'index_version'),
+                ],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, target)
+
+    logger.info("Added indexes %s to snapshot %s", new, target.name)
+    return existing + new
+
+
+def discard_snapshot(dataset_path):
+    """Deletes the snapshot of a source that is gone for good."""
+    try:
+        os.remove(snapshot_path(dataset_path))
+    except FileNotFoundError:
+        pass
+
+
+def ensure_snapshot(dataset_path, schema=None):
+    """Returns the path of an up-to-date snapshot, (re)building it if the CSV changed."""
+    target = snapshot_path(dataset_path)
+    signature = source_signature(dataset_path)
+    if is_fresh(target, signature):
+        return target
+
+    with _build_lock:
+        # Another thread may have finished the build while we waited
+        if is_fresh(target, signature):
+            return target
+        return build_snapshot(dataset_path, schema)
@@ -1,60 +1,277 @@
-import sqlite3
-import pandas as pd
+import json
+import time
 import logging
+from contextlib import nullcontext
+
+import pandas as pd
+
+from .pool import get_pool
+from .result_cache import get_result_cache, normalize_sql, sql_fingerprint
+from .metrics import get_metrics
+from .snapshot import dataset_version, ensure_snapshot
+from .governor import QueryGovernor, QueryLimits, QueryLimitExceeded
+from .compare import Fingerprinter
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Rows skipped per fetchmany() call when seeking to a page offset
+SKIP_CHUNK = 1000
+# Rows hashed per fetchmany() call when fingerprinting a full result
+FINGERPRINT_CHUNK = 10000
+
+
+def _lap(timings, stage, started):
+    """Records the ms since `started` under `stage` and returns the new start."""
+    now = time.perf_counter()
+    timings[stage] = (now - started) * 1000
+    return now
+
+
 class SQLEngine:
-    def __init__(self, dataset_path):
+    def __init__(self, dataset_path, dataset_id=None, pool=None, result_cache=None, limits=None):
         self.dataset_path = dataset_path
+        # Pool/cache key; datasets without an id are keyed by path
+        self.dataset_key = dataset_id if dataset_id is not None else dataset_path
+        self.pool = pool or get_pool()
+        self.result_cache = result_cache or get_result_cache()
+        self.limits = limits or QueryLimits()
+
+    def _cache_key(self, query, *parts):
+        # Building the snapshot changes the version: key on the one queries will run against
+        ensure_snapshot(self.dataset_path)
+        # The limits decide what a query returns (e.g. the returned-rows cap),
+        # so engines for different difficulties don't share entries
+        key = self.result_cache.make_key(self.dataset_key, dataset_version(self.dataset_path), query)
+        return key + (self.limits.as_tuple(),) + parts
 
-    def execute_query(self, query):
+    def execute_query(self, query, page=1, page_size=DEFAULT_PAGE_SIZE, debug=False):
         """
-        Loads CSV into in-memory SQLite and runs the query.
+        Runs the query on a warm pooled connection holding the dataset in memory
+        and returns one page of the result. Rows are pulled from the cursor, so only
+        the rows up to the end of the requested page are ever materialized.
+        Successful pages are cached per dataset version and normalized SQL.
+        Execution is bounded by self.limits (see QueryGovernor).
         Returns:
             - success (bool)
-            - data (list of dicts or None)
-            - columns (list or None)
+            - columns (list)
+            - rows (list of lists, at most page_size)
+            - page / page_size / has_more (pagination state)
             - error (str or None)
+            - error_code / limit (only when a resource limit was hit)
+            - debug (only with debug=True): timings in ms, query plan, row counts
         """
-        conn = None
+        return self._execute(query, page, page_size, debug)
+
+    def execute_batch(self, queries, stop_on_error=False, page_size=DEFAULT_PAGE_SIZE, debug=False):
+        """
+        Runs several queries in order on one pooled connection (one checkout,
+        one dataset load) and returns the first page of each.
+        With stop_on_error, queries after the first failure are skipped.
+        Returns:
+            - success (bool, True if every query ran and succeeded)
+            - results (list of execute_query results, each with elapsed_ms)
+            - total_ms
+        """
+        started = time.perf_counter()
+        results = []
+        failed = False
+        with self.pool.connection(self.dataset_key, self.dataset_path) as conn:
+            for query in queries:
+                if failed and stop_on_error:
+                    results.append({
+                        'success': False,
+                        'skipped': True,
+                        'columns': [],
+                        'rows': [],
+                        'error': 'Skipped: an earlier query failed.',
+                    })
+                    continue
+                query_started = time.perf_counter()
+                result = self._execute(query, 1, page_size, debug, conn=conn)
+                result['elapsed_ms'] = round((time.perf_counter() - query_started) * 1000, 3)
+                results.append(result)
+                failed = failed or not result['success']
+
+        return {
+            'success': not failed,
+            'results': results,
+            'total_ms': round((time.perf_counter() - started) * 1000, 3),
+        }
+
+    def _execute(self, query, page, page_size, debug, conn=None):
+        """execute_query, optionally on an already checked-out connection (batches)."""
+        started = time.perf_counter()
+        timings = {}
+        plan = []
+        rows_skipped = 0
+        fingerprint = sql_fingerprint(query)
+        result = None
         try:
-            # 1. Create In-Memory DB
-            conn = sqlite3.connect(':memory:')
-            
-            # 2. Load CSV
-            # Optimization: In production, we might want to cache this DB or use a real DB
-            df = pd.read_csv(self.dataset_path)
-            
-            # Sanitize column names if needed (simple approach for now)
-            # df.columns = [c.replace(' ', '_') for c in df.columns] 
-            
-            df.to_sql('dataset', conn, index=False, if_exists='replace')
-
-            # 3. Execute Query
-            # Using pandas read_sql to easily get result as DataFrame
-            result_df = pd.read_sql_query(query, conn)
-            
-            # 4. Format Output
-            columns = result_df.columns.tolist()
-            # Convert to list of lists for lighter transport, or dict records
-            data = result_df.head(50).values.tolist() # Limit to 50 rows for preview
-            
-            return {
+            page = max(int(page), 1)
+            page_size = min(max(int(page_size), 1), MAX_PAGE_SIZE)
+            governor = QueryGovernor(self.limits)
+            # The last reachable page may be cut short by the returned-rows cap
+            fetch_size = governor.check_page(page, page_size)
+
+            cache_key = self._cache_key(query, 'page', page, page_size)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                result = dict(cached, cached=True)
+                return result
+
+            # 1. Borrow a warm connection (typed 'dataset' table already in memory)
+            stage = time.perf_counter()
+            checkout = nullcontext(conn) if conn is not None else self.pool.connection(self.dataset_key, self.dataset_path)
+            with checkout as conn:
+                stage = _lap(timings, 'load', stage)
+                with governor.applied(conn):
+                    # 2. Reject obviously quadratic plans, then Execute Query
+                    plan = governor.check_plan(conn, query)
+                    stage = _lap(timings, 'prepare', stage)
+                    cursor = conn.execute(query)
+                    columns = [col[0] for col in cursor.description] if cursor.description else []
+                    stage = _lap(timings, 'execute', stage)
+
+                    # 3. Seek to the page offset without keeping skipped rows
+                    to_skip = (page - 1) * page_size
+                    while to_skip > 0 and cursor.description:
+                        skipped = cursor.fetchmany(min(to_skip, SKIP_CHUNK))
+                        if not skipped:
+                            break
+                        to_skip -= len(skipped)
+                        rows_skipped += len(skipped)
+
+                    # 4. Fetch one extra row to know whether another page exists
+                    fetched = cursor.fetchmany(fetch_size + 1) if cursor.description else []
+                    cursor.close()
+                    stage = _lap(timings, 'fetch', stage)
+                    cacheable = conn.read_only
+
+            # 5. Format Output
+            result = {
                 'success': True,
                 'columns': columns,
-                'rows': data,
-                'row_count': len(result_df),
+                'rows': [list(row) for row in fetched[:fetch_size]],
+                'page': page,
+                'page_size': page_size,
+                'has_more': len(fetched) > fetch_size and fetch_size == page_size,
                 'error': None
             }
+            _lap(timings, 'serialize', stage)
+            # Cache a copy: the debug block below is added to this response only
+            if cacheable:
+                self.result_cache.set(cache_key, dict(result))
+            return result
 
+        except QueryLimitExceeded as e:
+            logger.warning("Query limit hit on dataset %s (%s): %s", self.dataset_key, e.code, query)
+            result = e.as_result()
+            return result
         except Exception as e:
-            return {
+            result = {
                 'success': False,
                 'columns': [],
                 'rows': [],
                 'error': str(e)
             }
+            return result
         finally:
-            if conn:
-                conn.close()
+            if result is not None:
+                total_ms = (time.perf_counter() - started) * 1000
+                stats = self._record(fingerprint, query, page, timings, total_ms, plan, rows_skipped, result)
+                if debug:
+                    result['debug'] = stats
+
+    def _record(self, fingerprint, query, page, timings, total_ms, plan, rows_skipped, result):
+        """Sends one execution to the structured log and the per-dataset histograms."""
+        stats = {
+            'dataset': self.dataset_key,
+            'fingerprint': fingerprint,
+            'page': page,
+            'cached': bool(result.get('cached')),
+            'success': result['success'],
+            'error_code': result.get('error_code'),
+            'timings_ms': {stage: round(ms, 3) for stage, ms in timings.items()},
+            'total_ms': round(total_ms, 3),
+            'rows_skipped': rows_skipped,
+            'rows_returned': len(result['rows']),
+            'plan': [{'id': row[0], 'parent': row[1], 'detail': row[3]} for row in plan],
+        }
+        # One record per execution: DEBUG, so it's off unless the logger is turned up
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("sql_query %s", json.dumps(stats, default=str))
+        # Cache hits (and requests rejected before touching the pool) say
+        # nothing about how expensive the query is
+        if timings:
+            get_metrics().observe(self.dataset_key, fingerprint, normalize_sql(query), total_ms)
+        return stats
+
+    def count_rows(self, query):
+        """
+        Total number of rows the query returns, computed separately from paging
+        (SQLite counts without handing rows back) and cached like results.
+        Returns None if the query can't be counted, e.g. it isn't a SELECT.
+        """
+        try:
+            cache_key = self._cache_key(query, 'count')
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            inner = query.strip().rstrip(';')
+            governor = QueryGovernor(self.limits)
+            with self.pool.connection(self.dataset_key, self.dataset_path) as conn, governor.applied(conn):
+                governor.check_plan(conn, query)
+                row_count = conn.execute(f"SELECT COUNT(*) FROM (\n{inner}\n)").fetchone()[0]
+                cacheable = conn.read_only
+
+            if cacheable:
+                self.result_cache.set(cache_key, row_count)
+            return row_count
+        except Exception as e:
+            logger.debug("Could not count rows for query: %s", e)
+            return None
+
+    def result_fingerprint(self, query):
+        """
+        Fingerprint of the query's full result (see compare.py) for grading,
+        hashed chunk by chunk as rows stream off the cursor so memory stays
+        flat. Cached like results. Returns None if the query fails or hits a limit.
+        """
+        try:
+            cache_key = self._cache_key(query, 'fingerprint')
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            fingerprinter = Fingerprinter()
+            governor = QueryGovernor(self.limits)
+            with self.pool.connection(self.dataset_key, self.dataset_path) as conn, governor.applied(conn):
+                governor.check_plan(conn, query)
+                cursor = conn.execute(query)
+                if not cursor.description:
+                    return None
+                columns = [d[0] for d in cursor.description]
+                width = len(columns)
+                while True:
+                    rows = cursor.fetchmany(FINGERPRINT_CHUNK)
+                    if not rows:
+                        break
+                    fingerprinter.update(pd.DataFrame.from_records(rows, columns=range(width)))
+                cursor.close()
+                cacheable = conn.read_only
+            fingerprint = fingerprinter.digest()
+            if fingerprint['kinds'] == []:
+                # No rows: the width still comes from the cursor
+                fingerprint['kinds'] = [None] * width
+            # Lets grading reject a different shape before hashing anything
+            fingerprint['columns'] = columns
+
+            if cacheable:
+                self.result_cache.set(cache_key, fingerprint)
+            return fingerprint
+        except Exception as e:
+            logger.debug("Could not fingerprint query: %s", e)
+            return None
@@ -0,0 +1,282 @@
+"""
+Per-column statistics computed in the same streaming pass as the snapshot.
+
+`StatsBuilder` takes the typed chunks build_snapshot writes and keeps, per
+column, state bounded by a constant: null and value counts, min/max, a
+HyperLogLog sketch of distinct values, a Misra-Gries summary of the most
+frequent values and, for numeric columns, a histogram whose bins widen as
+the range grows. `summary()` reduces all of it to a few hundred bytes of
+JSON per column, stored in `Dataset.columns_metadata['stats']` so the case
+page and the index picker don't scan the data again.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+
+# 2**12 registers: about 1.6% standard error on distinct counts
+HLL_PRECISION = 12
+# Below this many distinct values the exact count is kept instead of the estimate
+EXACT_DISTINCT_MAX = 1000
+TOP_K = 10
+# Counters kept by the frequent-values summary; counts are exact while a
+# column has no more distinct values than this
+TOP_K_CAPACITY = 100
+HISTOGRAM_BINS = 32
+
+
+def _leading_zeros(values):
+    """Leading zero bits of each uint64, by binary search over the bit width."""
+    values = values.copy()
+    zeros = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        narrow = values < np.uint64(1 << (64 - shift))
+        zeros[narrow] += shift
+        values[narrow] <<= np.uint64(shift)
+    zeros[values == 0] += 1
+    return zeros
+
+
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        """Adds uint64 hashes (e.g. from pd.util.hash_array)."""
+        if not len(hashes):
+            return
+        p = np.uint64(self.precision)
+        buckets = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        # Rank of the first set bit in the remaining 64 - p bits
+        rest = hashes << p
+        ranks = np.minimum(_leading_zeros(rest) + 1, 64 - self.precision + 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        empty = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and empty:
+            # Linear counting is more accurate while many registers are unset
+            return int(round(m * math.log(m / empty)))
+        return int(round(raw))
+
+
+class FrequentValues:
+    """
+    Misra-Gries summary: at most `capacity` counters, each an undercount
+    of its value's frequency by at most rows / capacity. Values more
+    frequent than that are guaranteed to be present.
+    """
+
+    def __init__(self, capacity=TOP_K_CAPACITY):
+        self.capacity = capacity
+        self.counts = {}
+        self.truncated = False
+
+    def update(self, value_counts):
+        """Merges one chunk's value counts (a Series indexed by value)."""
+        counts = value_counts[value_counts > 0]
+        # Summaries merge: reducing the chunk first keeps the Python loop below short
+        counts = self._reduce(counts.sort_values(ascending=False))
+        for value, count in counts.items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > self.capacity:
+            reduced = self._reduce(pd.Series(self.counts, dtype='int64').sort_values(ascending=False))
+            self.counts = dict(zip(reduced.index.tolist(), reduced.tolist()))
+
+    def _reduce(self, counts):
+        """Subtracts the (capacity + 1)-th largest count from all and drops what reaches zero."""
+        if len(counts) <= self.capacity:
+            return counts
+        self.truncated = True
+        threshold = counts.iloc[self.capacity]
+        return counts[counts > threshold] - threshold
+
+    def top(self, k=TOP_K):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+class StreamingHistogram:
+    """
+    Fixed number of equal-width bins over [start, start + width * bins).
+    Values outside the range double the bin width, merging bins pairwise
+    (extending to the left or right), so earlier counts are never re-read.
+    """
+
+    def __init__(self, bins=HISTOGRAM_BINS):
+        self.bins = bins
+        self.start = None
+        self.width = None
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values, integers=False):
+        """Adds float64 values; with `integers`, bins are at least 1 wide so each holds whole numbers."""
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        low, high = float(values.min()), float(values.max())
+        if self.start is None:
+            self.start = low
+            # Slightly wider than needed, so the maximum falls inside the last bin
+            self.width = (high - low) / self.bins * (1 + 1e-9) or 1.0 / self.bins
+            if integers:
+                self.width = float(2 ** math.ceil(math.log2(self.width))) if self.width > 1 else 1.0
+        while low < self.start or high >= self.start + self.width * self.bins:
+            self._widen(extend_left=low < self.start)
+        index = np.clip(((values - self.start) // self.width).astype(np.int64), 0, self.bins - 1)
+        self.counts += np.bincount(index, minlength=self.bins)
+
+    def _widen(self, extend_left):
+        # Shifting the start by a whole number of new bins keeps old bins aligned with new ones
+        shift = self.bins if extend_left else 0
+        merged = np.zeros(self.bins, dtype=np.int64)
+        np.add.at(merged, (np.arange(self.bins) + shift) // 2, self.counts)
+        self.counts = merged
+        self.start -= shift * self.width
+        self.width *= 2
+
+    def summary(self):
+        if self.start is None:
+            return None
+        used = np.flatnonzero(self.counts)
+        first, last = used[0], used[-1]
+        return {
+            'start': float(self.start + first * self.width),
+            'width': self.width,
+            'counts': self.counts[first:last + 1].tolist(),
+        }
+
+
+def _kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'bool'
+    if pd.api.types.is_numeric_dtype(series):
+        return 'number'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    return 'text'
+
+
+def _json_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            return str(value)
+        if value.is_integer():
+            return int(value)
+    if isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat(sep=' ') if value != value.normalize() else value.date().isoformat()
+    return str(value)
+
+
+class _ColumnStats:
+    def __init__(self):
+        self.nulls = 0
+        self.count = 0
+        self.kind = None  # None until a non-null value is seen; 'mixed' if chunks disagree
+        self.min = None
+        self.max = None
+        self.distinct = HyperLogLog()
+        self.exact = set()  # distinct hashes while there are at most EXACT_DISTINCT_MAX
+        self.frequent = FrequentValues()
+        self.histogram = StreamingHistogram()
+
+    def update(self, series):
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        self.count += len(values)
+
+        kind = _kind(values)
+        if self.kind not in (None, kind):
+            # e.g. an all-numeric first chunk in a text column: min/max and the histogram mean nothing
+            self.kind = 'mixed'
+        elif self.kind is None:
+            self.kind = kind
+
+        # Text is compared and hashed as strings, numbers as floats so 1 and 1.0 agree
+        numbers = values.to_numpy(dtype='float64') if kind == 'number' else None
+        text = values.astype(str) if kind == 'text' else None
+        if self.kind != 'mixed':
+            ordered = text if text is not None else values
+            low, high = ordered.min(), ordered.max()
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+            if numbers is not None:
+                self.histogram.update(numbers, integers=pd.api.types.is_integer_dtype(values))
+
+        if numbers is not None:
+            hashes = pd.util.hash_array(numbers)
+        else:
+            hashes = pd.util.hash_array((text if text is not None else values.astype(str)).to_numpy(dtype=object))
+        self.distinct.add_hashes(hashes)
+        if self.exact is not None:
+            self.exact.update(np.unique(hashes).tolist())
+            if len(self.exact) > EXACT_DISTINCT_MAX:
+                self.exact = None
+        self.frequent.update(values.value_counts(sort=False))
+
+    def summary(self):
+        distinct = len(self.exact) if self.exact is not None else self.distinct.estimate()
+        summary = {
+            'nulls': self.nulls,
+            'distinct': distinct,
+            'distinct_exact': self.exact is not None,
+        }
+        if self.kind not in (None, 'mixed'):
+            summary['min'] = _json_value(self.min)
+            summary['max'] = _json_value(self.max)
+        top = self.frequent.top()
+        if self.frequent.truncated:
+            # Past capacity only heavy hitters are meaningful; the rest are leftovers of the summary
+            top = [(value, count) for value, count in top if count * self.frequent.capacity >= self.count]
+        if top and distinct < self.count:
+            summary['top'] = [[_json_value(value), count] for value, count in top]
+            # Otherwise counts are lower bounds, short by at most count / capacity
+            summary['top_exact'] = not self.frequent.truncated
+        if self.kind == 'number':
+            summary['histogram'] = self.histogram.summary()
+        return summary
+
+
+class StatsBuilder:
+    """Accumulates column statistics over typed chunks of one dataset."""
+
+    def __init__(self):
+        self._columns = {}
+        self.row_count = 0
+
+    def update(self, chunk):
+        self.row_count += len(chunk)
+        for col in chunk.columns:
+            self._columns.setdefault(str(col), _ColumnStats()).update(chunk[col])
+
+    def summary(self):
+        return {col: stats.summary() for col, stats in self._columns.items()}
+
+
+def index_profile(stats):
+    """The {'distinct', 'nulls'} per column that indexer.choose_indexes works from."""
+    return {col: {'distinct': column['distinct'], 'nulls': column['nulls']} for col, column in stats.items()}
+
+
+def describe_column(spec, stats):
+    """One-line summary of a column for tooltips, e.g. 'int16 · 177 nulls · 88 distinct · 0.42 – 80'."""
+    parts = [spec['dtype']] if spec else []
+    if stats:
+        if stats['nulls']:
+            parts.append(f"{stats['nulls']} nulls")
+        parts.append(f"{'' if stats['distinct_exact'] else '~'}{stats['distinct']} distinct")
+        if 'min' in stats:
+            parts.append(f"{stats['min']} – {stats['max']}")
+        if stats.get('top') and stats['top'][0][1] > 1:
+            value, count = stats['top'][0]
+            parts.append(f"most common: {value} ({count})")
+    return ' · '.join(parts)
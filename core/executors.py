@@ -0,0 +1,147 @@
+"""
+Bounded thread pools for running engine work from async views.
+
+Each pool has a fixed number of worker threads plus a bounded queue. When
+both are full, `run` raises ExecutorSaturated immediately instead of
+queueing without limit, and the view answers 429 with Retry-After. This
+lets one ASGI process hold many idle editor sessions while only a fixed
+number of queries execute at once.
+
+`stream` does the same for a streaming response: each step of a sync
+iterator runs on a worker thread, and the slot is held until it's done.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+DEFAULT_OPTIONS = {
+    'MAX_WORKERS': 4,
+    'MAX_QUEUE': 32,
+    'RETRY_AFTER': 1,  # seconds, sent back with 429 responses
+}
+
+
+_DONE = object()
+
+
+class ExecutorSaturated(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"The {name} executor is at capacity.")
+        self.retry_after = retry_after
+
+
+def _with_fresh_db_connections(fn, *args, **kwargs):
+    # Worker threads outlive requests; drop connections Django would have closed
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class BoundedExecutor:
+    def __init__(self, name, max_workers, max_queue, retry_after):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-executor")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+
+    def _acquire(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise ExecutorSaturated(self.name, self.retry_after)
+        with self._lock:
+            self.in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """Runs fn(*args, **kwargs) on a worker thread, or raises ExecutorSaturated."""
+        self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, functools.partial(_with_fresh_db_connections, fn, *args, **kwargs)
+            )
+        finally:
+            self._release()
+
+    def stream(self, iterator):
+        """
+        Async iterator over the sync `iterator`, stepping it on worker threads,
+        for StreamingHttpResponse. Takes a slot now (or raises
+        ExecutorSaturated) and keeps it until the stream ends. If the client
+        goes away mid-stream, iterator.close() runs once the step in flight
+        has returned.
+        """
+        self._acquire()
+        return self._iterate(iterator)
+
+    async def _iterate(self, iterator):
+        step = functools.partial(_with_fresh_db_connections, next, iterator, _DONE)
+        pending = None
+        try:
+            while True:
+                pending = self._executor.submit(step)
+                item = await asyncio.wrap_future(pending)
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            def finish():
+                try:
+                    close = getattr(iterator, 'close', None)
+                    if close is not None:
+                        _with_fresh_db_connections(close)
+                finally:
+                    self._release()
+
+            # A step can't be interrupted, and a generator can't be closed while it runs
+            if pending is not None and not pending.done():
+                pending.add_done_callback(lambda _: self._executor.submit(finish))
+            else:
+                self._executor.submit(finish)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'name': self.name,
+                'max_workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'in_flight': self.in_flight,
+                'rejected': self.rejected,
+            }
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name):
+    """Process-wide executor configured by settings.ENGINE_EXECUTORS[name]."""
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                options = dict(DEFAULT_OPTIONS, **getattr(settings, 'ENGINE_EXECUTORS', {}).get(name, {}))
+                executor = _executors[name] = BoundedExecutor(
+                    name,
+                    max_workers=options['MAX_WORKERS'],
+                    max_queue=options['MAX_QUEUE'],
+                    retry_after=options['RETRY_AFTER'],
+                )
+    return executor
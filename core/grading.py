@@ -0,0 +1,139 @@
+"""
+Expected answers for auto-graded questions.
+
+A question's validation_query only depends on the question and the dataset,
+so its result is computed once per dataset version and stored on the
+Question: the stdout, plus a fingerprint of the result value (see
+engines/compare.py) when there is one. The cache key combines the dataset
+version (CSV signature) with a hash of the validation code, so editing
+either one regenerates it.
+
+Answers are graded by fingerprint when both sides produced a result value
+(a SQL result set, or a Python trailing expression) and by stdout otherwise.
+"""
+import re
+import hashlib
+
+from .models import Question
+from .engines.columnar import ensure_columnar, columnar_path
+from .engines.compare import compare_fingerprints
+from .engines.governor import QueryLimits
+from .engines.python_pool import get_python_pool
+from .engines.result_cache import normalize_sql
+from .engines.sql_engine import SQLEngine
+
+_PYTHON_ORDERING = re.compile(r'\b(sort_values|sort_index|nlargest|nsmallest)\b')
+
+
+def python_job(dataset, columnar, code, validation_code=None, session=None):
+    return {
+        'dataset_key': dataset.id,
+        'version': columnar.name,
+        'columnar': str(columnar),
+        'code': code,
+        'validation_code': validation_code,
+        'session': session,
+    }
+
+
+def case_sql_engine(case):
+    """SQL engine for a case's dataset, bounded by the limits for its difficulty."""
+    return SQLEngine(case.dataset.file.path, dataset_id=case.dataset.id, limits=QueryLimits.for_difficulty(case.difficulty))
+
+
+def expected_output_key(question, columnar):
+    digest = hashlib.sha1(question.validation_query.encode('utf-8')).hexdigest()[:16]
+    return f"{columnar.name}:{digest}"
+
+
+def cached_expected(question, columnar):
+    """The stored (output, fingerprint), or None when missing or stale."""
+    if question.expected_output_key and question.expected_output_key == expected_output_key(question, columnar):
+        return question.expected_output, question.expected_fingerprint
+    return None
+
+
+def store_expected(question, columnar, output, fingerprint):
+    key = expected_output_key(question, columnar)
+    # update() skips signals and doesn't overwrite concurrent edits to other fields
+    Question.objects.filter(pk=question.pk).update(
+        expected_output=output, expected_fingerprint=fingerprint, expected_output_key=key,
+    )
+    question.expected_output, question.expected_fingerprint, question.expected_output_key = output, fingerprint, key
+
+
+def order_matters(question):
+    """Row order is only graded when the validation query sorts its result."""
+    if question.question_type == 'SQL':
+        return 'order by' in normalize_sql(question.validation_query).lower()
+    return bool(_PYTHON_ORDERING.search(question.validation_query))
+
+
+def grade_python(question, result, expected_output, expected_fingerprint):
+    """Returns (is_correct, message) for a successful Python run."""
+    if expected_fingerprint and result['fingerprint']:
+        return compare_fingerprints(expected_fingerprint, result['fingerprint'], ordered=order_matters(question))
+    # No result value on one side: fall back to comparing STDOUT
+    if result['output'].strip() == expected_output.strip():
+        return True, "Correct! Task Completed."
+    return False, "Incorrect output."
+
+
+def grade_sql(question, engine, query, columns=None):
+    """
+    Returns (is_correct, message) for a SQL answer, computing the expected
+    fingerprint if stale. `columns` are the answer's column names (from the
+    first page already run): a different count or different names (case
+    aside) fail without hashing the answer's full result.
+    """
+    columnar = columnar_path(engine.dataset_path)
+    cached = cached_expected(question, columnar)
+    if cached is not None and cached[1]:
+        expected = cached[1]
+    else:
+        expected = engine.result_fingerprint(question.validation_query)
+        if expected is None:
+            return False, "This question's reference query failed; please tell an admin."
+        store_expected(question, columnar, '', expected)
+
+    if columns is not None:
+        if len(columns) != len(expected['kinds']):
+            return False, f"Expected {len(expected['kinds'])} columns, got {len(columns)}."
+        wanted = expected.get('columns')
+        if wanted and [str(c).lower() for c in wanted] != [str(c).lower() for c in columns]:
+            return False, f"Expected columns {', '.join(map(str, wanted))}; got {', '.join(map(str, columns))}."
+
+    actual = engine.result_fingerprint(query)
+    if actual is None:
+        return False, "Your query's full result couldn't be checked."
+    return compare_fingerprints(expected, actual, ordered=order_matters(question))
+
+
+def ensure_expected(question):
+    """
+    Returns (fingerprint or stdout, error) for a question's validation query,
+    running it only when the stored result is stale.
+    """
+    dataset = question.case.dataset
+    if question.question_type == 'SQL':
+        columnar = columnar_path(dataset.file.path)
+        cached = cached_expected(question, columnar)
+        if cached is not None and cached[1]:
+            return cached[1], None
+        expected = case_sql_engine(question.case).result_fingerprint(question.validation_query)
+        if expected is None:
+            return None, "Validation query failed or hit a resource limit."
+        store_expected(question, columnar, '', expected)
+        return expected, None
+
+    columnar = ensure_columnar(dataset.file.path, dataset.columns_metadata.get('schema'))
+    cached = cached_expected(question, columnar)
+    if cached is not None:
+        return cached[1] or cached[0], None
+
+    # Empty user code: the job only runs the validation code
+    result = get_python_pool().run(python_job(dataset, columnar, '', question.validation_query))
+    if not result['success'] or result['grading_error']:
+        return None, result['error'] or result['grading_error']
+    store_expected(question, columnar, result['expected_output'], result['expected_fingerprint'])
+    return result['expected_fingerprint'] or result['expected_output'], None
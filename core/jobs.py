@@ -0,0 +1,196 @@
+"""
+Background jobs on the existing database, without an external broker.
+
+Jobs are rows of the Job model, run by `manage.py run_workers`. A worker
+claims the highest-priority due job with a conditional UPDATE that only
+matches while the job is still queued, so two workers can never both
+claim it, on SQLite included. A failing job is retried with exponential
+backoff until max_attempts; a running job whose lease expires (its worker
+died) is put back in the queue.
+
+Handlers are registered per kind with @task (see core/tasks.py) and are
+called with the job's payload as keyword arguments. They may run more
+than once, so they must be idempotent.
+"""
+import logging
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'POLL_SECONDS': 1,             # idle workers check for new jobs this often
+    'LEASE_SECONDS': 600,          # a job running longer than this is presumed orphaned
+    'RETRY_BACKOFF_SECONDS': 10,   # doubled after each failed attempt
+    'MAX_ATTEMPTS': 3,
+    'RUN_INLINE': False,           # run jobs in the enqueuing process, after commit (no workers needed)
+}
+
+# Due jobs a worker tries to claim per poll before giving up to its rivals
+CLAIM_BATCH = 10
+
+_handlers = {}
+
+
+def job_options():
+    return dict(DEFAULT_OPTIONS, **getattr(settings, 'JOB_QUEUE', {}))
+
+
+def task(kind, on_failure=None):
+    """
+    Registers a handler for jobs of `kind`. on_failure(error, **payload) is
+    called once the job has failed for the last time.
+    """
+    def register(fn):
+        _handlers[kind] = (fn, on_failure)
+        return fn
+    return register
+
+
+def enqueue(kind, payload=None, priority=0, max_attempts=None, unique=False):
+    """
+    Queues a job in the current transaction, so it's only visible to
+    workers if the caller commits. With `unique`, an identical job that is
+    still queued is returned instead of adding another.
+    """
+    options = job_options()
+    payload = payload or {}
+    if unique:
+        existing = Job.objects.filter(kind=kind, status='queued', payload=payload).first()
+        if existing is not None:
+            return existing
+
+    job = Job.objects.create(
+        kind=kind, payload=payload, priority=priority,
+        max_attempts=max_attempts or options['MAX_ATTEMPTS'],
+    )
+    if options['RUN_INLINE']:
+        transaction.on_commit(lambda: _run_inline(job.pk))
+    return job
+
+
+def _claim(pk, worker_name):
+    """Marks a queued job as running for worker_name; returns it, or None if someone else got it."""
+    claimed = Job.objects.filter(pk=pk, status='queued').update(
+        status='running', locked_by=worker_name, locked_at=timezone.now(), attempts=F('attempts') + 1,
+    )
+    return Job.objects.get(pk=pk) if claimed else None
+
+
+def claim_next(worker_name, kinds=None):
+    """Claims the highest-priority job that is due, or returns None."""
+    due = Job.objects.filter(status='queued', run_after__lte=timezone.now())
+    if kinds:
+        due = due.filter(kind__in=kinds)
+    for pk in due.order_by('-priority', 'run_after', 'pk').values_list('pk', flat=True)[:CLAIM_BATCH]:
+        job = _claim(pk, worker_name)
+        if job is not None:
+            return job
+    return None
+
+
+def _update_claimed(job, **fields):
+    # Guarded by the lock, so a job requeued and reclaimed after its lease ran out isn't overwritten
+    Job.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by).update(**fields)
+
+
+def run_job(job):
+    """Runs a claimed job and records the outcome; returns True on success."""
+    handler, on_failure = _handlers.get(job.kind, (None, None))
+    started = time.perf_counter()
+    try:
+        if handler is None:
+            raise LookupError(f"No handler registered for job kind '{job.kind}'")
+        handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        now = timezone.now()
+        if handler is not None and job.attempts < job.max_attempts:
+            delay = job_options()['RETRY_BACKOFF_SECONDS'] * 2 ** (job.attempts - 1)
+            _update_claimed(
+                job, status='queued', locked_by='', locked_at=None, last_error=error,
+                run_after=now + timedelta(seconds=delay),
+            )
+            logger.warning("Job %s #%s failed (attempt %s/%s), retrying in %ss", job.kind, job.pk, job.attempts, job.max_attempts, delay)
+        else:
+            _update_claimed(job, status='failed', last_error=error, finished_at=now)
+            logger.error("Job %s #%s failed for good:\n%s", job.kind, job.pk, error)
+            if on_failure is not None:
+                on_failure(error, **job.payload)
+        return False
+
+    _update_claimed(job, status='succeeded', finished_at=timezone.now())
+    logger.info("Job %s #%s succeeded in %.2fs", job.kind, job.pk, time.perf_counter() - started)
+    return True
+
+
+def _run_inline(pk):
+    job = _claim(pk, f"inline:{os.getpid()}")
+    if job is not None:
+        run_job(job)
+
+
+def requeue_expired():
+    """Puts back running jobs whose lease ran out, or fails them if they have no attempts left."""
+    cutoff = timezone.now() - timedelta(seconds=job_options()['LEASE_SECONDS'])
+    expired = Job.objects.filter(status='running', locked_at__lt=cutoff)
+    message = "The worker running this job stopped before finishing it."
+    failed = expired.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', last_error=message, finished_at=timezone.now(),
+    )
+    requeued = expired.update(status='queued', locked_by='', locked_at=None, last_error=message)
+    if failed or requeued:
+        logger.warning("Lease expired on %s jobs: %s requeued, %s failed", failed + requeued, requeued, failed)
+    return requeued
+
+
+def queue_stats():
+    """Number of jobs per status, e.g. {'queued': 3, 'running': 1, ...}."""
+    counts = dict(Job.objects.values_list('status').annotate(count=Count('pk')))
+    return {status: counts.get(status, 0) for status, _ in Job.STATUS_CHOICES}
+
+
+class Worker:
+    """Claims and runs jobs in a loop; stop() lets the current job finish, then returns."""
+
+    def __init__(self, name=None, kinds=None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.kinds = kinds
+        self.stopping = False
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def run(self, burst=False):
+        """Runs jobs until stopped, or with `burst` until none are due. Returns how many ran."""
+        poll_seconds = job_options()['POLL_SECONDS']
+        processed = 0
+        while not self.stopping:
+            # Long-lived process: drop connections Django would have closed after a request
+            close_old_connections()
+            try:
+                job = claim_next(self.name, self.kinds)
+                if job is None:
+                    requeue_expired()
+            except OperationalError as e:
+                # e.g. SQLite busy while another worker writes
+                logger.warning("Worker %s couldn't poll the queue: %s", self.name, e)
+                job = None
+            if job is None:
+                if burst:
+                    break
+                time.sleep(poll_seconds)
+                continue
+            run_job(job)
+            processed += 1
+        return processed
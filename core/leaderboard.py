@@ -0,0 +1,354 @@
+"""
+Leaderboards ranked in memory and kept current incrementally.
+
+Scores are LeaderboardEntry rows, one per (board, user):
+- GLOBAL mirrors UserProfile.xp;
+- week_board() is the XP of the cases completed in an ISO week;
+- case_board(id) is each user's best Submission.score on a case.
+The XP and submission signals change them through set_score and
+raise_score; no board is ever recomputed to apply one change. A weekly
+score is re-summed from that user's week of submissions (week_xp) rather
+than added to, so saving a completed submission again is harmless.
+
+Each worker keeps a Ranking per board it serves: the entries sorted by
+(-score, updated_at, user id) in an indexable skiplist plus every user's
+current key. Moving a user, a rank, and finding the top N or a user's
+neighbours are O(log n) walks down the skiplist (plus the rows returned)
+rather than a sort of all profiles or a shift of a sorted array. A board
+is loaded once, then synced at most every SYNC_INTERVAL seconds by reading
+only the entries updated since the last sync (an index range on (board,
+updated_at)). The worker making a
+change applies it right away. Full reloads every RELOAD_INTERVAL seconds
+also drop users that were deleted.
+"""
+import time
+import random
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import LeaderboardEntry, Submission
+
+DEFAULT_LEADERBOARD = {
+    'TOP_N': 10,
+    'NEIGHBOURS': 2,         # users shown above and below the viewer
+    'SYNC_INTERVAL': 2.0,    # seconds between checks for other workers' changes
+    'RELOAD_INTERVAL': 600,  # seconds between full reloads of a board
+    'MAX_BOARDS': 64,        # boards each worker keeps in memory (LRU)
+    'WEEKS_KEPT': 8,         # older weekly boards are deleted by rebuild_leaderboards
+}
+
+GLOBAL = 'global'
+# Re-read this far back on each sync, for changes committed after a later one
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def leaderboard_options():
+    return dict(DEFAULT_LEADERBOARD, **getattr(settings, 'LEADERBOARD', {}))
+
+
+def week_board(when=None):
+    year, week, _ = timezone.localdate(when).isocalendar()
+    return f"week:{year}-W{week:02d}"
+
+
+def week_start(when=None):
+    """The Monday (local date) of the ISO week `when` falls in."""
+    day = timezone.localdate(when)
+    return day - timedelta(days=day.weekday())
+
+
+def week_xp(user_id, when=None):
+    """The XP rewards of the cases a user completed in the week of `when`."""
+    start = week_start(when)
+    completed = Submission.objects.filter(
+        user_id=user_id, completed=True, case__isnull=False,
+        submitted_at__date__gte=start, submitted_at__date__lt=start + timedelta(weeks=1),
+    )
+    return completed.aggregate(xp=Sum('case__xp_reward'))['xp'] or 0
+
+
+def case_board(case_id):
+    return f"case:{case_id}"
+
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, height, width=0):
+        self.key = key
+        self.next = [None] * height
+        # width[i]: positions from this node to next[i] (or to one past the end)
+        self.width = [width] * height
+
+
+class _SkipList:
+    """
+    Sorted keys with O(log n) insert, remove, bisect_left and lookup by
+    index: each link also records how many positions it skips, so walking
+    down the levels counts the keys passed.
+    """
+    MAX_HEIGHT = 24  # comfortably above log2 of any board's size
+
+    def __init__(self, keys=()):
+        """`keys` must already be sorted and unique."""
+        self._head = _Node(None, self.MAX_HEIGHT, width=1)
+        self._size = 0
+        last = [self._head] * self.MAX_HEIGHT
+        last_pos = [0] * self.MAX_HEIGHT
+        for pos, key in enumerate(keys, 1):
+            node = _Node(key, self._random_height())
+            for i in range(len(node.next)):
+                last[i].next[i] = node
+                last[i].width[i] = pos - last_pos[i]
+                last[i], last_pos[i] = node, pos
+            self._size = pos
+        for i in range(self.MAX_HEIGHT):
+            last[i].width[i] = self._size + 1 - last_pos[i]
+
+    def __len__(self):
+        return self._size
+
+    def _random_height(self):
+        height = 1
+        while height < self.MAX_HEIGHT and random.getrandbits(1):
+            height += 1
+        return height
+
+    def _path(self, key):
+        """The last node before `key` on each level and its position (the head is 0)."""
+        node, pos = self._head, 0
+        chain = [None] * self.MAX_HEIGHT
+        positions = [0] * self.MAX_HEIGHT
+        for i in reversed(range(self.MAX_HEIGHT)):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+            chain[i], positions[i] = node, pos
+        return chain, positions
+
+    def bisect_left(self, key):
+        """How many keys are less than `key`."""
+        node, pos = self._head, 0
+        for i in reversed(range(self.MAX_HEIGHT)):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+        return pos
+
+    def insert(self, key):
+        chain, positions = self._path(key)
+        pos = positions[0] + 1
+        node = _Node(key, self._random_height())
+        for i in range(len(node.next)):
+            prev = chain[i]
+            node.next[i] = prev.next[i]
+            node.width[i] = prev.width[i] - (pos - positions[i]) + 1
+            prev.next[i] = node
+            prev.width[i] = pos - positions[i]
+        for i in range(len(node.next), self.MAX_HEIGHT):
+            chain[i].width[i] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _positions = self._path(key)
+        node = chain[0].next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        for i in range(self.MAX_HEIGHT):
+            prev = chain[i]
+            if prev.next[i] is node:
+                prev.width[i] += node.width[i] - 1
+                prev.next[i] = node.next[i]
+            else:
+                prev.width[i] -= 1
+        self._size -= 1
+
+    def slice(self, start, stop):
+        """The keys at indexes start to stop - 1, both clamped to the list (no negative indexing)."""
+        start, stop = max(start, 0), min(stop, self._size)
+        if start >= stop:
+            return []
+        node, remaining = self._head, start + 1
+        for i in reversed(range(self.MAX_HEIGHT)):
+            while node.next[i] is not None and node.width[i] <= remaining:
+                remaining -= node.width[i]
+                node = node.next[i]
+        keys = []
+        for _ in range(stop - start):
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class Ranking:
+    """Users sorted by (-score, reached_at, user id): equal scores rank by who reached them first."""
+
+    def __init__(self):
+        self._keys = _SkipList()
+        self._by_user = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, rows):
+        """Replaces the contents with (user_id, score, reached_at) rows, sorting once."""
+        self._by_user = {user_id: (-score, reached_at, user_id) for user_id, score, reached_at in rows}
+        self._keys = _SkipList(sorted(self._by_user.values()))
+
+    def update(self, user_id, score, reached_at):
+        key = (-score, reached_at, user_id)
+        old = self._by_user.get(user_id)
+        if old == key:
+            return
+        if old is not None:
+            self._keys.remove(old)
+        self._keys.insert(key)
+        self._by_user[user_id] = key
+
+    def _row(self, key):
+        # Competition ranking (1, 2, 2, 4): one more than the users with a higher score
+        return {'rank': self._keys.bisect_left((key[0],)) + 1, 'user_id': key[2], 'score': -key[0]}
+
+    def top(self, n):
+        return [self._row(key) for key in self._keys.slice(0, n)]
+
+    def position(self, user_id):
+        key = self._by_user.get(user_id)
+        return self._row(key) if key is not None else None
+
+    def around(self, user_id, neighbours):
+        """The user's row with up to `neighbours` rows either side, in rank order."""
+        key = self._by_user.get(user_id)
+        if key is None:
+            return []
+        i = self._keys.bisect_left(key)
+        return [self._row(k) for k in self._keys.slice(i - neighbours, i + neighbours + 1)]
+
+
+class _Board:
+    def __init__(self, name):
+        self.name = name
+        self.ranking = Ranking()
+        self.lock = threading.Lock()
+        self.loaded_at = None   # monotonic time of the last full load
+        self.checked_at = None  # monotonic time of the last sync
+        self.synced_to = None   # database time the last sync started at
+
+    def refresh(self):
+        options = leaderboard_options()
+        now = time.monotonic()
+        with self.lock:
+            if self.loaded_at is None or now - self.loaded_at >= options['RELOAD_INTERVAL']:
+                started = timezone.now()
+                entries = LeaderboardEntry.objects.filter(board=self.name)
+                self.ranking.load(
+                    (user_id, score, updated_at.timestamp())
+                    for user_id, score, updated_at in entries.values_list('user_id', 'score', 'updated_at').iterator()
+                )
+                self.loaded_at = self.checked_at = now
+                self.synced_to = started
+            elif now - self.checked_at >= options['SYNC_INTERVAL']:
+                started = timezone.now()
+                changed = LeaderboardEntry.objects.filter(board=self.name, updated_at__gte=self.synced_to - SYNC_OVERLAP)
+                for user_id, score, updated_at in changed.values_list('user_id', 'score', 'updated_at'):
+                    self.ranking.update(user_id, score, updated_at.timestamp())
+                self.checked_at = now
+                self.synced_to = started
+
+
+_boards = OrderedDict()
+_boards_lock = threading.Lock()
+
+
+def get_board(name):
+    """This worker's ranking of a board, loaded on first use and synced with the database."""
+    with _boards_lock:
+        board = _boards.get(name)
+        if board is None:
+            board = _boards[name] = _Board(name)
+            while len(_boards) > leaderboard_options()['MAX_BOARDS']:
+                _boards.popitem(last=False)
+        else:
+            _boards.move_to_end(name)
+    board.refresh()
+    return board
+
+
+def _apply_local(name, user_id, score, updated_at):
+    # Boards this worker hasn't loaded get the change when they load
+    board = _boards.get(name)
+    if board is not None:
+        with board.lock:
+            board.ranking.update(user_id, score, updated_at.timestamp())
+
+
+def _changed(name, user_id, score, updated_at):
+    transaction.on_commit(lambda: _apply_local(name, user_id, score, updated_at))
+
+
+def set_score(name, user_id, score):
+    """Sets a user's score on a board, e.g. their total XP."""
+    now = timezone.now()
+    updated = LeaderboardEntry.objects.filter(board=name, user_id=user_id).exclude(score=score).update(
+        score=score, updated_at=now
+    )
+    if not updated:
+        # Unchanged, or the user's first entry on this board
+        _entry, created = LeaderboardEntry.objects.get_or_create(
+            board=name, user_id=user_id, defaults={'score': score, 'updated_at': now}
+        )
+        if not created:
+            return
+    _changed(name, user_id, score, now)
+
+
+def raise_score(name, user_id, score):
+    """Keeps the higher of a user's score on a board and `score`, e.g. their best result on a case."""
+    now = timezone.now()
+    if not LeaderboardEntry.objects.filter(board=name, user_id=user_id, score__lt=score).update(score=score, updated_at=now):
+        _entry, created = LeaderboardEntry.objects.get_or_create(
+            board=name, user_id=user_id, defaults={'score': score, 'updated_at': now}
+        )
+        if not created:
+            return
+    _changed(name, user_id, score, now)
+
+
+def standings(name, user=None, top=None, neighbours=None):
+    """
+    A board as shown on the leaderboard page:
+        total   users on the board
+        top     the first `top` rows
+        me      the viewer's row, or None if they aren't on the board
+        around  the viewer's row with `neighbours` rows either side
+    Rows are dicts of rank, user_id, score and user (with its profile).
+    """
+    options = leaderboard_options()
+    top = options['TOP_N'] if top is None else top
+    neighbours = options['NEIGHBOURS'] if neighbours is None else neighbours
+    user_id = user.pk if user is not None and user.is_authenticated else None
+
+    board = get_board(name)
+    with board.lock:
+        top_rows = board.ranking.top(top)
+        me = board.ranking.position(user_id) if user_id else None
+        around = board.ranking.around(user_id, neighbours) if user_id else []
+        total = len(board.ranking)
+
+    users = User.objects.select_related('profile').in_bulk({row['user_id'] for row in top_rows + around})
+    for row in top_rows + around:
+        row['user'] = users.get(row['user_id'])
+    return {
+        'total': total,
+        # Users deleted since the board was loaded are skipped
+        'top': [row for row in top_rows if row['user'] is not None],
+        'me': me,
+        'around': [row for row in around if row['user'] is not None],
+    }
@@ -0,0 +1,60 @@
+import os
+
+from django.core.management.base import BaseCommand
+from core.models import Dataset
+from core.engines.indexer import recommend_indexes
+from core.engines.stats import index_profile
+from core.engines.snapshot import ensure_snapshot, snapshot_indexes, add_indexes, connect_snapshot, TABLE_NAME
+
+class Command(BaseCommand):
+    help = 'Adds snapshot indexes for the columns most often filtered on in the recorded query workload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, help='Only advise this dataset id')
+        parser.add_argument('--limit', type=int, default=3, help='Max new indexes per dataset')
+        parser.add_argument('--dry-run', action='store_true', help='Print recommendations without applying them')
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.all()
+        if options['dataset']:
+            datasets = datasets.filter(id=options['dataset'])
+
+        for dataset in datasets:
+            if not dataset.file or not os.path.exists(dataset.file.path):
+                self.stdout.write(self.style.WARNING(f"Skipping {dataset.name}: file not found"))
+                continue
+
+            workload = list(dataset.query_logs.values_list('query', 'executions'))
+            if not workload:
+                self.stdout.write(f"{dataset.name}: no recorded queries")
+                continue
+
+            snapshot = ensure_snapshot(dataset.file.path)
+            existing = snapshot_indexes(snapshot)
+            columns = dataset.columns_metadata.get('columns') or self._snapshot_columns(snapshot)
+            stats = dataset.columns_metadata.get('stats')
+            recommended = recommend_indexes(
+                workload, columns, existing=existing, limit=options['limit'],
+                profile=index_profile(stats) if stats else None,
+            )
+
+            if not recommended:
+                self.stdout.write(f"{dataset.name}: current indexes {existing} cover the workload")
+                continue
+
+            if options['dry_run']:
+                self.stdout.write(f"{dataset.name}: would index {recommended}")
+                continue
+
+            indexes = add_indexes(dataset.file.path, recommended)
+            # Record the index set with the dataset; the save also drops cached results
+            dataset.columns_metadata = dict(dataset.columns_metadata, indexes=indexes)
+            dataset.save(update_fields=['columns_metadata'])
+            self.stdout.write(self.style.SUCCESS(f"{dataset.name}: indexed {recommended}"))
+
+    def _snapshot_columns(self, snapshot):
+        conn = connect_snapshot(snapshot)
+        try:
+            return [row[1] for row in conn.execute(f"PRAGMA table_info({TABLE_NAME})")]
+        finally:
+            conn.close()
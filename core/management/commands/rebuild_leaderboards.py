@@ -0,0 +1,44 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+from core.models import LeaderboardEntry, Submission, UserProfile
+from core.leaderboard import GLOBAL, case_board, leaderboard_options, week_board, week_start
+
+class Command(BaseCommand):
+    help = 'Recomputes the leaderboards from profiles and submissions (e.g. after upgrading) and prunes old weekly boards'
+
+    def _replace(self, board, scores):
+        with transaction.atomic():
+            LeaderboardEntry.objects.filter(board=board).delete()
+            LeaderboardEntry.objects.bulk_create(
+                [LeaderboardEntry(board=board, user_id=user_id, score=score or 0) for user_id, score in scores],
+                batch_size=1000,
+            )
+        self.stdout.write(f"{board}: {len(scores)} entries")
+
+    def handle(self, *args, **options):
+        self._replace(GLOBAL, list(UserProfile.objects.values_list('user_id', 'xp')))
+
+        completed = Submission.objects.filter(completed=True, case__isnull=False)
+        best = completed.values_list('case_id', 'user_id').annotate(best=Max('score'))
+        by_case = {}
+        for case_id, user_id, score in best:
+            by_case.setdefault(case_id, []).append((user_id, score))
+        stale = LeaderboardEntry.objects.filter(board__startswith='case:').exclude(
+            board__in=[case_board(case_id) for case_id in by_case]
+        )
+        stale.delete()
+        for case_id, scores in by_case.items():
+            self._replace(case_board(case_id), scores)
+
+        # This week's XP, from the rewards of cases completed since Monday
+        this_week = completed.filter(submitted_at__date__gte=week_start())
+        self._replace(week_board(), list(this_week.values_list('user_id').annotate(xp=Sum('case__xp_reward'))))
+
+        oldest = week_board(timezone.now() - timedelta(weeks=leaderboard_options()['WEEKS_KEPT']))
+        pruned, _ = LeaderboardEntry.objects.filter(board__startswith='week:', board__lt=oldest).delete()
+        self.stdout.write(self.style.SUCCESS(f"Leaderboards rebuilt; {pruned} old weekly entries pruned."))
+        self.stdout.write("Running workers pick the new boards up within LEADERBOARD['RELOAD_INTERVAL'] seconds.")
@@ -0,0 +1,27 @@
+import os
+
+from django.core.management.base import BaseCommand
+from core.models import Dataset
+from core.tasks import queue_ingest
+
+class Command(BaseCommand):
+    help = 'Queues datasets for ingest again, e.g. to give datasets uploaded earlier column statistics and versioned storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', type=int, help='Only this dataset id')
+        parser.add_argument('--missing-stats', action='store_true', help='Only datasets without column statistics')
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.all()
+        if options['dataset']:
+            datasets = datasets.filter(id=options['dataset'])
+
+        for dataset in datasets:
+            if not dataset.file or not os.path.exists(dataset.file.path):
+                self.stdout.write(self.style.WARNING(f"Skipping {dataset.name}: file not found"))
+                continue
+            if options['missing_stats'] and dataset.columns_metadata.get('stats'):
+                continue
+            job = queue_ingest(dataset, generate_case=False)
+            self.stdout.write(self.style.SUCCESS(f"{dataset.name}: queued as job #{job.pk}"))
+        self.stdout.write("Run `python manage.py run_workers` (or --burst) to process the queue.")
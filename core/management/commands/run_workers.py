@@ -0,0 +1,59 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+
+
+def _worker_process(kinds, burst):
+    # Spawned child: a fresh interpreter that has to set Django up itself
+    import django
+    django.setup()
+    from core.jobs import Worker
+
+    worker = Worker(kinds=kinds)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run(burst=burst)
+
+
+class Command(BaseCommand):
+    help = 'Runs background job workers (dataset ingest, expected-output warming) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--burst', action='store_true', help='Exit once no jobs are due')
+        parser.add_argument('--kind', action='append', dest='kinds', help='Only run jobs of this kind (repeatable)')
+
+    def handle(self, *args, **options):
+        kinds, burst = options['kinds'], options['burst']
+        if options['processes'] <= 1:
+            from core.jobs import Worker
+
+            worker = Worker(kinds=kinds)
+            signal.signal(signal.SIGTERM, worker.stop)
+            signal.signal(signal.SIGINT, worker.stop)
+            self.stdout.write(f"Worker {worker.name} waiting for jobs (Ctrl+C to stop)")
+            processed = worker.run(burst=burst)
+            self.stdout.write(self.style.SUCCESS(f"Worker stopped after {processed} jobs"))
+            return
+
+        # Spawn rather than fork: forked children would share the parent's database connection
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=_worker_process, args=(kinds, burst), daemon=False)
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} worker processes (Ctrl+C to stop)")
+
+        def stop(*args):
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+        signal.signal(signal.SIGTERM, stop)
+        # Ctrl+C reaches the children through the process group; the parent just waits
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped"))
@@ -4,7 +4,7 @@ from django.core.files.base import ContentFile
 import os
 
 class Command(BaseCommand):
-    help = 'Simulates a file upload to trigger the auto-case signal'
+    help = 'Simulates a file upload to trigger the auto-case ingest job'
 
     def handle(self, *args, **kwargs):
         self.stdout.write("Simulating CSV Upload...")
@@ -19,6 +19,15 @@ class Command(BaseCommand):
         ds.save()
         
         self.stdout.write(self.style.SUCCESS(f"Dataset '{ds.name}' created!"))
+        self.stdout.write(f" Status after upload: {ds.status}")
+
+        # The ingest runs in the background; process the queue here instead of waiting for run_workers
+        from core.jobs import Worker
+        Worker(name='test_auto_case').run(burst=True)
+        ds.refresh_from_db()
+        self.stdout.write(f" Status after ingest: {ds.status}")
+        if ds.current_version:
+            self.stdout.write(f" Stored as version {ds.current_version.number} ({ds.version_key[:12]}), file {ds.file.name}")
         
         # Check if Case was created
         from core.models import Case
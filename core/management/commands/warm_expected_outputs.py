@@ -0,0 +1,35 @@
+import os
+
+from django.core.management.base import BaseCommand
+from core.models import Question
+from core.grading import ensure_expected
+
+class Command(BaseCommand):
+    help = 'Computes and stores the expected result of every SQL/Python question whose cached result is missing or stale'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', type=int, help='Only warm questions of this case id')
+
+    def handle(self, *args, **options):
+        questions = (
+            Question.objects.filter(question_type__in=['SQL', 'PYTHON'], case__dataset__isnull=False)
+            .exclude(validation_query='')
+            .select_related('case__dataset')
+        )
+        if options['case']:
+            questions = questions.filter(case_id=options['case'])
+
+        for question in questions:
+            dataset = question.case.dataset
+            if not dataset.file or not os.path.exists(dataset.file.path):
+                self.stdout.write(self.style.WARNING(f"Skipping {question}: dataset file not found"))
+                continue
+
+            previous_key = question.expected_output_key
+            expected, error = ensure_expected(question)
+            if error:
+                self.stdout.write(self.style.ERROR(f"{question}: validation query failed\n{error}"))
+            elif question.expected_output_key == previous_key:
+                self.stdout.write(f"{question}: up to date")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"{question}: stored expected result"))
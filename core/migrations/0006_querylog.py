@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-18 15:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_alter_question_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('query', models.TextField(help_text='Normalized SQL (comments/whitespace stripped)')),
+                ('executions', models.IntegerField(default=0)),
+                ('last_run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='query_logs', to='core.dataset')),
+            ],
+            options={
+                'unique_together': {('dataset', 'fingerprint')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.1 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_querylog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='expected_output',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='expected_output_key',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
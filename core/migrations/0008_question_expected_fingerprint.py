@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_question_expected_output'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='expected_fingerprint',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 6.0.1 on 2026-10-18 19:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_job_dataset_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DatasetBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to='datasets/blobs/')),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.IntegerField(default=0, help_text='Dataset versions using this file; deleted at zero')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DatasetVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('key', models.CharField(max_length=64)),
+                ('original_name', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='versions', to='core.datasetblob')),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='core.dataset')),
+            ],
+            options={
+                'ordering': ['dataset', '-number'],
+                'unique_together': {('dataset', 'number')},
+            },
+        ),
+        migrations.AddField(
+            model_name='dataset',
+            name='current_version',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.datasetversion'),
+        ),
+    ]
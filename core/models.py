@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import json
 
 class UserProfile(models.Model):
@@ -28,6 +29,12 @@ class UserProfile(models.Model):
         return ((self.xp - current_level_base) / 100) * 100
 
 class Dataset(models.Model):
+    STATUS_CHOICES = [
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
     name = models.CharField(max_length=200)
     file = models.FileField(upload_to='datasets/')
     description = models.TextField(blank=True)
@@ -35,10 +42,89 @@ class Dataset(models.Model):
     
     # Store CSV columns metadata (names, types) for validation/UI
     columns_metadata = models.JSONField(default=dict, blank=True)
+    # Set by the background ingest job (see core/tasks.py)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ready', editable=False)
+    # Content `file` points at once ingested (see core/storage.py)
+    current_version = models.ForeignKey('DatasetVersion', on_delete=models.SET_NULL, null=True, blank=True, editable=False, related_name='+')
 
     def __str__(self):
         return self.name
 
+    @property
+    def version_key(self):
+        """Content hash of the current version, or None before the first ingest"""
+        return self.current_version.key if self.current_version_id else None
+
+class DatasetBlob(models.Model):
+    """One stored copy of a dataset file, shared by every version with the same content"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to='datasets/blobs/')
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0, help_text="Dataset versions using this file; deleted at zero")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.ref_count} refs)"
+
+class DatasetVersion(models.Model):
+    """An uploaded revision of a Dataset; never modified once created"""
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='versions')
+    blob = models.ForeignKey(DatasetBlob, on_delete=models.PROTECT, related_name='versions')
+    number = models.IntegerField()
+    # Immutable version key for engines and caches: the content hash
+    key = models.CharField(max_length=64)
+    original_name = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('dataset', 'number')
+        ordering = ['dataset', '-number']
+
+    def __str__(self):
+        return f"{self.dataset.name} v{self.number}"
+
+class QueryLog(models.Model):
+    """Aggregated SQL workload per dataset, read by the index advisor"""
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='query_logs')
+    fingerprint = models.CharField(max_length=40)
+    query = models.TextField(help_text="Normalized SQL (comments/whitespace stripped)")
+    executions = models.IntegerField(default=0)
+    last_run_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('dataset', 'fingerprint')
+
+    def __str__(self):
+        return f"{self.dataset.name} x{self.executions}: {self.query[:50]}"
+
+class Job(models.Model):
+    """Background work queued in the database and run by `manage.py run_workers` (see core/jobs.py)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    priority = models.IntegerField(default=0, help_text="Higher runs first")
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, help_text="Not claimed before this time (retry backoff)")
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', '-priority', 'run_after'], name='job_claim_idx')]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
 class Case(models.Model):
     DIFFICULTY_CHOICES = [
         ('Easy', 'Easy'),
@@ -85,6 +171,10 @@ class Question(models.Model):
     # Validation
     correct_answer = models.TextField(blank=True, help_text="Exact answer for MCQ/Insight")
     validation_query = models.TextField(blank=True, help_text="SQL/Python code to generate the correct result")
+    # Output of validation_query, cached per dataset version (see core/grading.py)
+    expected_output = models.TextField(blank=True, editable=False)
+    expected_fingerprint = models.JSONField(null=True, blank=True, editable=False)
+    expected_output_key = models.CharField(max_length=255, blank=True, editable=False)
     
     points = models.IntegerField(default=10)
 
@@ -112,3 +202,22 @@ class QuestionAttempt(models.Model):
 
     def __str__(self):
         return f"{self.user.username} - {self.question}"
+
+class LeaderboardEntry(models.Model):
+    """
+    A user's score on one board: 'global' (total XP), 'week:2026-W42' (XP
+    gained that ISO week) or 'case:<id>' (best score on the case). Workers
+    rank these in memory and pick up changes by updated_at (see core/leaderboard.py).
+    """
+    board = models.CharField(max_length=50)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='leaderboard_entries')
+    score = models.IntegerField(default=0)
+    # Set when the score changes; among equal scores, whoever got there first ranks higher
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('board', 'user')
+        indexes = [models.Index(fields=['board', 'updated_at'], name='leaderboard_sync_idx')]
+
+    def __str__(self):
+        return f"{self.board}: {self.user.username} {self.score}"
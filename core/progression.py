@@ -0,0 +1,118 @@
+"""
+Per-user progression through the case map, kept in the Django cache.
+
+The dashboard's mission map and case list show the active cases in
+learning-path order (Case.order, then id), each solved, active or locked.
+A user's map is built once from the shared case catalog and the cases
+they solved, then updated in place: a completed Submission marks its case
+solved in the cached map (see signals.py) instead of rebuilding it.
+Adding, editing or removing a case changes the catalog version, which
+retires every cached map at once; each is rebuilt on its user's next visit.
+
+Rendering the dashboard is one get_many of the catalog version and the
+user's map.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Case, Submission
+
+DEFAULT_PROGRESSION = {
+    'TIMEOUT': 24 * 60 * 60,  # seconds a map is kept without being read or updated
+}
+
+CATALOG_VERSION_KEY = 'progression:catalog-version'
+# What the dashboard templates read of each case
+CASE_FIELDS = ('id', 'title', 'description', 'difficulty', 'xp_reward')
+
+
+def progression_options():
+    return dict(DEFAULT_PROGRESSION, **getattr(settings, 'PROGRESSION', {}))
+
+
+def _map_key(user_id):
+    return f"progression:user:{user_id}"
+
+
+def _catalog_key(version):
+    return f"progression:catalog:{version}"
+
+
+def catalog_version():
+    # A timestamp rather than a counter: if the key is evicted, the new
+    # version can't collide with the one older maps were built on
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog():
+    """Cases changed: maps built on the old catalog are rebuilt when next read."""
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def _catalog(version):
+    key = _catalog_key(version)
+    cases = cache.get(key)
+    if cases is None:
+        cases = list(Case.objects.filter(is_active=True).order_by('order', 'id').values(*CASE_FIELDS))
+        cache.set(key, cases, progression_options()['TIMEOUT'])
+    return cases
+
+
+def case_catalog():
+    """Active cases in map order as dicts of CASE_FIELDS, shared by all users."""
+    return _catalog(catalog_version())
+
+
+def _with_statuses(cases, solved):
+    """
+    Solved cases stay open; the first unsolved case after a solved one (or
+    at the start) is active, and the unsolved cases after it are locked.
+    """
+    mapped = []
+    is_next_active = True
+    for case in cases:
+        if case['id'] in solved:
+            status = 'solved'
+            is_next_active = True
+        elif is_next_active:
+            status = 'active'
+            is_next_active = False
+        else:
+            status = 'locked'
+        mapped.append(dict(case, status=status))
+    return mapped
+
+
+def progression_map(user):
+    """The user's active cases in map order: dicts of CASE_FIELDS plus 'status'."""
+    key = _map_key(user.pk)
+    cached = cache.get_many([CATALOG_VERSION_KEY, key])
+    version = cached.get(CATALOG_VERSION_KEY) or catalog_version()
+    entry = cached.get(key)
+    if entry is None or entry['version'] != version:
+        solved = set(Submission.objects.filter(user=user, completed=True).values_list('case_id', flat=True))
+        entry = {'version': version, 'solved': sorted(solved), 'cases': _with_statuses(_catalog(version), solved)}
+        cache.set(key, entry, progression_options()['TIMEOUT'])
+    return entry['cases']
+
+
+def mark_solved(user_id, case_id):
+    """Applies a newly completed case to the user's cached map. Uncached maps are built on the next visit."""
+    key = _map_key(user_id)
+    entry = cache.get(key)
+    if entry is None or case_id in entry['solved']:
+        return
+    solved = set(entry['solved']) | {case_id}
+    entry = dict(entry, solved=sorted(solved), cases=_with_statuses(entry['cases'], solved))
+    cache.set(key, entry, progression_options()['TIMEOUT'])
+
+
+def forget_user(user_id):
+    """Drops a user's cached map, e.g. when a submission is deleted or un-completed."""
+    cache.delete(_map_key(user_id))
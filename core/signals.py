@@ -1,71 +1,50 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Dataset, Case, Question
-import pandas as pd
+from .models import Case, Dataset, DatasetVersion, UserProfile
+from .engines.snapshot import snapshot_path, source_signature, is_fresh
+from .engines.result_cache import get_result_cache
+from .tasks import queue_ingest
+from .storage import release_blob
+from .progression import bump_catalog, mark_solved, forget_user
+from .leaderboard import GLOBAL, week_board, week_xp, case_board, set_score, raise_score
 import os
 
 @receiver(post_save, sender=Dataset)
 def auto_generate_case(sender, instance, created, **kwargs):
     """
-    When a Dataset is uploaded:
-    1. Parse CSV key metadata (columns, rows).
-    2. Create a generic Case wrapper if one doesn't exist.
-    3. Generate 2-3 standard 'Observation' questions.
+    When a Dataset is uploaded, queue its ingest (see core/tasks.py): the
+    snapshot, metadata and a generic Case with starter questions are built
+    by a background worker, so the upload returns right away.
     """
     if created and instance.file:
-        try:
-            # 1. Parse CSV
-            file_path = instance.file.path
-            if os.path.exists(file_path):
-                df = pd.read_csv(file_path)
-                
-                # Save Metadata
-                columns = df.columns.tolist()
-                row_count = len(df)
-                instance.columns_metadata = {
-                    "columns": columns,
-                    "row_count": row_count,
-                    "dtypes": {col: str(dtype) for col, dtype in df.dtypes.items()}
-                }
-                instance.save(update_fields=['columns_metadata'])
+        queue_ingest(instance)
 
-                # 2. Create Case
-                # Check if case exists for this dataset to avoid dupes on re-save
-                if not Case.objects.filter(dataset=instance).exists():
-                    case = Case.objects.create(
-                        title=f"Investigation: {instance.name}",
-                        dataset=instance,
-                        description=f"A new dataset has been secured from {instance.name}. Your mission is to explore the data, verify its integrity, and report initial findings.\n\n**Data Overview**:\n- Rows: {row_count}\n- Columns: {', '.join(columns[:5])}...",
-                        difficulty='Easy',
-                        xp_reward=100,
-                        order=Case.objects.count() + 1
-                    )
+@receiver(post_save, sender=Dataset)
+def build_dataset_snapshot(sender, instance, created, **kwargs):
+    """
+    A re-saved dataset whose file changed (e.g. a new upload in the admin)
+    is ingested again in the background. Other re-saves cost nothing.
+    """
+    if created or not instance.file:
+        return
+    try:
+        file_path = instance.file.path
+        if os.path.exists(file_path) and not is_fresh(snapshot_path(file_path), source_signature(file_path)):
+            queue_ingest(instance, generate_case=False)
+    except Exception as e:
+        print(f"Error queueing dataset ingest: {e}")
 
-                    # 3. Create Default Questions
-                    
-                    # Q1: Row Count Check (SQL)
-                    Question.objects.create(
-                        case=case,
-                        text=f"How many records are in the dataset?",
-                        question_type='SQL',
-                        points=20,
-                        validation_query=f"SELECT COUNT(*) FROM dataset",
-                        order=1
-                    )
-                    
-                    # Q2: First Column Check (Python)
-                    first_col = columns[0]
-                    Question.objects.create(
-                        case=case,
-                        text=f"What is the name of the first column?",
-                        question_type='INSIGHT', # Insight map be better for simple string match
-                        correct_answer=first_col,
-                        points=30,
-                        order=2
-                    )
+@receiver(post_delete, sender=DatasetVersion)
+def release_dataset_blob(sender, instance, **kwargs):
+    """Deleting a dataset (or one of its versions) frees its file once no other version shares it."""
+    release_blob(instance.blob_id)
 
-        except Exception as e:
-            print(f"Error auto-generating case: {e}")
+@receiver(post_save, sender=Dataset)
+def invalidate_query_results(sender, instance, created, **kwargs):
+    """Re-saving a dataset (e.g. a new file in the admin) drops its cached query results."""
+    if not created:
+        get_result_cache().invalidate(instance.id)
 
 from .models import Submission
 @receiver(post_save, sender=Submission)
@@ -98,3 +77,38 @@ def award_xp_on_submission(sender, instance, created, **kwargs):
              profile.badges.append('Veteran')
 
         profile.save()
+
+@receiver(post_save, sender=Submission)
+def update_progression(sender, instance, created, **kwargs):
+    """
+    A completed case is marked solved in the user's cached progression map
+    (see core/progression.py); a submission un-completed in the admin drops
+    the map so it's rebuilt.
+    """
+    if instance.completed:
+        transaction.on_commit(lambda: mark_solved(instance.user_id, instance.case_id))
+    elif not created:
+        transaction.on_commit(lambda: forget_user(instance.user_id))
+
+@receiver(post_delete, sender=Submission)
+def forget_progression(sender, instance, **kwargs):
+    transaction.on_commit(lambda: forget_user(instance.user_id))
+
+@receiver(post_save, sender=Case)
+@receiver(post_delete, sender=Case)
+def invalidate_progression_maps(sender, instance, **kwargs):
+    """Any case change (order, is_active, title...) retires every cached progression map."""
+    transaction.on_commit(bump_catalog)
+
+@receiver(post_save, sender=UserProfile)
+def rank_xp(sender, instance, **kwargs):
+    """Keeps the global leaderboard (see core/leaderboard.py) in step with the user's XP."""
+    set_score(GLOBAL, instance.user_id, instance.xp)
+
+@receiver(post_save, sender=Submission)
+def update_leaderboards(sender, instance, created, **kwargs):
+    """A completed case's XP counts on its week's board, and its score on the case's board."""
+    if instance.completed and instance.case:
+        # Re-summed rather than added to, so re-saving a submission doesn't count it twice
+        set_score(week_board(instance.submitted_at), instance.user_id, week_xp(instance.user_id, instance.submitted_at))
+        raise_score(case_board(instance.case_id), instance.user_id, instance.score)
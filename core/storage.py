@@ -0,0 +1,116 @@
+"""
+Content-addressed, versioned dataset files.
+
+An upload lands wherever Dataset.file's upload_to puts it. Ingest then
+hashes it and moves it to datasets/blobs/<aa>/<sha256><ext> (see
+commit_version), so identical files uploaded for any number of datasets
+are stored once. Each distinct content a dataset has pointed at is a
+DatasetVersion; the blobs count the versions using them and are deleted,
+together with their snapshot, columnar and Parquet copies, when the last
+one goes.
+
+Blob files never change, so everything derived from their path (snapshot,
+columnar copy, pool and cache keys) is keyed on the content hash; that
+hash is the version key (Dataset.version_key).
+"""
+import os
+import hashlib
+import logging
+
+from django.db import transaction
+from django.db.models import F, Max
+
+from .models import Dataset, DatasetBlob, DatasetVersion
+from .engines.snapshot import discard_snapshot
+from .engines.columnar import discard_columnar
+from .engines.parquet import discard_parquet
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = 'datasets/blobs'
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_sha256(field_file):
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def blob_name(sha256, original_name):
+    suffix = os.path.splitext(original_name)[1].lower()
+    return f"{BLOB_DIR}/{sha256[:2]}/{sha256}{suffix}"
+
+
+def is_blob(name):
+    return name.startswith(BLOB_DIR + '/')
+
+
+def _store_blob(sha256, field_file):
+    """The blob holding this content, copying the file into blob storage if it's new."""
+    blob = DatasetBlob.objects.filter(sha256=sha256).first()
+    if blob is not None:
+        return blob
+    storage = field_file.storage
+    name = blob_name(sha256, field_file.name)
+    # Left behind by an ingest that failed before its commit; same name, same content
+    if storage.exists(name):
+        storage.delete(name)
+    with field_file.open('rb') as content:
+        stored = storage.save(name, content)
+    return DatasetBlob.objects.create(sha256=sha256, file=stored, size=storage.size(stored))
+
+
+@transaction.atomic
+def commit_version(dataset):
+    """
+    Moves `dataset.file` into blob storage and records it as a new version
+    unless it has the current version's content. Returns the current
+    version; `dataset` is updated in place (without post_save).
+    """
+    if dataset.current_version_id and dataset.file.name == dataset.current_version.blob.file.name:
+        return dataset.current_version
+
+    upload = dataset.file.name
+    sha256 = file_sha256(dataset.file)
+    blob = _store_blob(sha256, dataset.file)
+
+    version = dataset.current_version
+    if version is None or version.key != sha256:
+        number = (dataset.versions.aggregate(Max('number'))['number__max'] or 0) + 1
+        version = DatasetVersion.objects.create(
+            dataset=dataset, blob=blob, number=number, key=sha256, original_name=os.path.basename(upload),
+        )
+        DatasetBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        logger.info("Dataset %s is now v%s (%s)", dataset.pk, number, sha256[:12])
+
+    Dataset.objects.filter(pk=dataset.pk).update(file=blob.file.name, current_version=version)
+    dataset.file.name = blob.file.name
+    dataset.current_version = version
+
+    if not is_blob(upload) and not Dataset.objects.filter(file=upload).exists():
+        # The blob is the only copy now; drop the upload once that's committed
+        transaction.on_commit(lambda: _remove_files(blob.file.storage, upload))
+    return version
+
+
+def _remove_files(storage, name):
+    path = storage.path(name)
+    discard_snapshot(path)
+    discard_columnar(path)
+    discard_parquet(path)
+    storage.delete(name)
+
+
+def release_blob(blob_id):
+    """Drops one reference to a blob, deleting it and its derived copies at zero."""
+    DatasetBlob.objects.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+    blob = DatasetBlob.objects.filter(pk=blob_id, ref_count__lte=0).first()
+    if blob is None or blob.versions.exists():
+        return
+    name, storage = blob.file.name, blob.file.storage
+    blob.delete()
+    transaction.on_commit(lambda: _remove_files(storage, name))
+    logger.info("Deleting unreferenced dataset blob %s", name)
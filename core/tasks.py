@@ -0,0 +1,143 @@
+"""
+Background job handlers (see core/jobs.py).
+
+Dataset ingest used to run inside the admin upload request; now the
+upload only queues `ingest_dataset` and the dataset reads "processing"
+until a worker has built its snapshot and case.
+"""
+import logging
+import os
+
+from .jobs import enqueue, task
+from .models import Dataset, Case, Question
+from .engines.snapshot import ensure_snapshot, snapshot_summary, source_signature, ingest_options
+from .engines.columnar import ensure_columnar
+from .engines.parquet import ensure_parquet
+from .engines.result_cache import get_result_cache
+from .grading import ensure_expected
+from .storage import commit_version
+
+logger = logging.getLogger(__name__)
+
+# Uploads go before expected-output warming, which nobody is waiting on
+INGEST_PRIORITY = 10
+WARM_PRIORITY = 0
+
+
+def _ingest_failed(error, dataset_id, **payload):
+    Dataset.objects.filter(pk=dataset_id).update(status='failed')
+
+
+@task('ingest_dataset', on_failure=_ingest_failed)
+def ingest_dataset(dataset_id, generate_case=True):
+    """
+    0. Store the file by content hash, as a new version if it changed.
+    1. Stream the CSV into its snapshot, collecting metadata (columns, rows) on the way.
+    2. Create a generic Case wrapper if one doesn't exist.
+    3. Generate 2-3 standard 'Observation' questions.
+    """
+    dataset = Dataset.objects.filter(pk=dataset_id).first()
+    if dataset is None or not dataset.file:
+        # Deleted or emptied since the job was queued
+        return
+    if not os.path.exists(dataset.file.path):
+        raise FileNotFoundError(f"Dataset file not found: {dataset.file.path}")
+    # Deduplicated into blob storage; from here on the file is immutable
+    commit_version(dataset)
+    file_path = dataset.file.path
+
+    # One chunked pass over the file infers compact dtypes (later loads
+    # reuse the stored schema), indexes key and low-cardinality columns and
+    # keeps a preview, in memory independent of file size
+    summary = snapshot_summary(ensure_snapshot(file_path))
+    columns = summary['columns']
+    row_count = summary['row_count']
+    metadata = {
+        "columns": columns,
+        "row_count": row_count,
+        "dtypes": {col: spec['dtype'] for col, spec in summary['schema'].items()},
+        "schema": summary['schema'],
+        # Nulls, distinct counts, min/max, frequent values and histograms per column
+        "stats": summary['stats'],
+        "indexes": summary['indexes'],
+        # First rows for the case page, valid while the file is unchanged
+        "preview": summary['preview'],
+        "preview_signature": source_signature(file_path),
+    }
+    # Compressed copy that later reads use instead of parsing the CSV
+    ensure_parquet(file_path, summary['schema'])
+    # The columnar copy needs the whole frame in memory, so for big files
+    # it's left to the first Python run
+    if os.path.getsize(file_path) <= ingest_options()['EAGER_COLUMNAR_MAX_MB'] * 1024 * 1024:
+        ensure_columnar(file_path, summary['schema'])
+
+    # update() rather than save(): no post_save, so no second ingest
+    Dataset.objects.filter(pk=dataset_id).update(columns_metadata=metadata, status='ready')
+    get_result_cache().invalidate(dataset_id)
+
+    # Check if case exists for this dataset to avoid dupes on re-save and retries
+    if generate_case and not Case.objects.filter(dataset=dataset).exists():
+        case = Case.objects.create(
+            title=f"Investigation: {dataset.name}",
+            dataset=dataset,
+            description=f"A new dataset has been secured from {dataset.name}. Your mission is to explore the data, verify its integrity, and report initial findings.\n\n**Data Overview**:\n- Rows: {row_count}\n- Columns: {', '.join(columns[:5])}...",
+            difficulty='Easy',
+            xp_reward=100,
+            order=Case.objects.count() + 1
+        )
+
+        # Q1: Row Count Check (SQL)
+        Question.objects.create(
+            case=case,
+            text=f"How many records are in the dataset?",
+            question_type='SQL',
+            points=20,
+            validation_query=f"SELECT COUNT(*) FROM dataset",
+            order=1
+        )
+
+        # Q2: First Column Check (Python)
+        first_col = columns[0]
+        Question.objects.create(
+            case=case,
+            text=f"What is the name of the first column?",
+            question_type='INSIGHT', # Insight map be better for simple string match
+            correct_answer=first_col,
+            points=30,
+            order=2
+        )
+
+    # The new data changes every expected answer on it
+    enqueue('warm_expected_outputs', {'dataset_id': dataset_id}, priority=WARM_PRIORITY, unique=True)
+
+
+@task('warm_expected_outputs')
+def warm_expected_outputs(dataset_id=None, case_id=None):
+    """Recomputes stale expected results of auto-graded questions, so the first answer isn't slowed by it."""
+    questions = (
+        Question.objects.filter(question_type__in=['SQL', 'PYTHON'], case__dataset__isnull=False)
+        .exclude(validation_query='')
+        .select_related('case__dataset')
+    )
+    if dataset_id is not None:
+        questions = questions.filter(case__dataset_id=dataset_id)
+    if case_id is not None:
+        questions = questions.filter(case_id=case_id)
+
+    for question in questions:
+        dataset = question.case.dataset
+        if not dataset.file or not os.path.exists(dataset.file.path):
+            continue
+        _, error = ensure_expected(question)
+        if error:
+            # A broken validation query won't fix itself on retry; report it and carry on
+            logger.warning("Couldn't compute the expected result of %s: %s", question, error)
+
+def queue_ingest(dataset, generate_case=True):
+    """Marks a dataset as processing and queues its ingest."""
+    Dataset.objects.filter(pk=dataset.pk).update(status='processing')
+    dataset.status = 'processing'
+    return enqueue(
+        'ingest_dataset', {'dataset_id': dataset.pk, 'generate_case': generate_case},
+        priority=INGEST_PRIORITY, unique=True,
+    )
@@ -1,3 +1,948 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import QueryDict
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from . import executors
+from .engines.columnar import columnar_path, ensure_columnar
+from .engines.governor import QueryLimits
+from .engines.grid import GridError, GridQuery, fetch_window
+from .engines.indexer import choose_indexes, create_indexes, recommend_indexes
+from .engines.loader import SchemaBuilder, apply_schema, infer_schema, read_columnar, read_dataset_chunks, write_columnar
+from .engines.parquet import ensure_parquet, load_dataset, pq
+from .engines.pool import ConnectionPool
+from .engines.python_pool import PythonLimits, PythonWorkerPool, get_python_pool, session_options
+from .engines.python_sessions import SessionStore
+from .engines.result_cache import normalize_sql, sql_fingerprint
+from .engines.snapshot import build_snapshot, snapshot_summary
+from .engines.sql_engine import SQLEngine
+from .engines.stats import FrequentValues, HyperLogLog
+from .grading import cached_expected
+from .jobs import _claim, claim_next, enqueue, requeue_expired, run_job, task
+from .leaderboard import Ranking, _SkipList, week_board
+from .progression import progression_map
+from .models import Case, Dataset, DatasetBlob, Job, LeaderboardEntry, Question, Submission, UserProfile
+from .storage import commit_version
+from .tasks import warm_expected_outputs
+
+PEOPLE_CSV = "id,name,age\n" + "".join(f"{i},person{i},{20 + i % 50}\n" for i in range(1, 201))
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class DatasetFilesMixin:
+    """Writes datasets, snapshots and cached copies under a temporary directory."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = Path(tempfile.mkdtemp())
+        cls.files_override = override_settings(
+            MEDIA_ROOT=cls.tmp / 'media',
+            DATASET_SNAPSHOT_ROOT=cls.tmp / 'snapshots',
+            DATASET_COLUMNAR_ROOT=cls.tmp / 'columns',
+            DATASET_PARQUET_ROOT=cls.tmp / 'parquet',
+            PYTHON_SESSIONS={'SPILL_DIR': cls.tmp / 'sessions'},
+            CACHES=LOCMEM_CACHES,
+        )
+        cls.files_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.files_override.disable()
+        shutil.rmtree(cls.tmp, ignore_errors=True)
+
+    @classmethod
+    def write_csv(cls, name, content):
+        path = cls.tmp / 'media' / 'datasets' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        return path
+
+
+class NormalizeSqlTests(SimpleTestCase):
+    def test_comments_and_whitespace_are_dropped(self):
+        self.assertEqual(normalize_sql("SELECT name  FROM dataset\n-- note\n;"), "SELECT name FROM dataset")
+        self.assertEqual(sql_fingerprint("SELECT name /* x */ FROM dataset"), sql_fingerprint("SELECT name\nFROM dataset"))
+
+    def test_case_is_kept(self):
+        self.assertNotEqual(sql_fingerprint("SELECT a IS NULL FROM dataset"), sql_fingerprint("select a is null from dataset"))
+        self.assertEqual(normalize_sql('SELECT "Name" FROM dataset'), 'SELECT "Name" FROM dataset')
+
+    def test_string_literals_are_kept(self):
+        self.assertNotEqual(
+            sql_fingerprint("SELECT * FROM dataset WHERE name = 'Alice'"),
+            sql_fingerprint("SELECT * FROM dataset WHERE name = 'alice'"),
+        )
+
+
+class SQLEngineCacheTests(DatasetFilesMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.csv = str(cls.write_csv('engine.csv', PEOPLE_CSV))
+
+    def test_column_headers_follow_the_query_spelling(self):
+        engine = SQLEngine(self.csv)
+        spellings = {
+            "SELECT name AS person FROM dataset": ['person'],
+            "SELECT name AS Person FROM dataset": ['Person'],
+            "SELECT age IS NULL FROM dataset": ['age IS NULL'],
+            "select age is null from dataset": ['age is null'],
+            "SELECT age  IS NULL FROM dataset": ['age  IS NULL'],
+        }
+        for query, columns in spellings.items():
+            result = engine.execute_query(query)
+            self.assertEqual(result['columns'], columns)
+            self.assertFalse(result.get('cached'), query)
+        self.assertTrue(engine.execute_query("SELECT age IS NULL FROM dataset;\n").get('cached'))
+
+    def test_first_result_is_cached_before_the_snapshot_exists(self):
+        csv = str(self.write_csv('fresh.csv', PEOPLE_CSV))
+        engine = SQLEngine(csv)
+        self.assertFalse(engine.execute_query("SELECT COUNT(*) FROM dataset").get('cached'))
+        self.assertTrue(engine.execute_query("SELECT COUNT(*) FROM dataset").get('cached'))
+
+    def test_results_are_cached_per_limits(self):
+        query = "SELECT id FROM dataset ORDER BY id"
+        capped = SQLEngine(self.csv, limits=QueryLimits(max_rows_returned=5)).execute_query(query, page_size=50)
+        self.assertEqual(len(capped['rows']), 5)
+
+        result = SQLEngine(self.csv).execute_query(query, page_size=50)
+        self.assertFalse(result.get('cached'))
+        self.assertEqual(len(result['rows']), 50)
+        self.assertTrue(SQLEngine(self.csv).execute_query(query, page_size=50).get('cached'))
+
+
+class QueryGovernorTests(DatasetFilesMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.csv = str(cls.write_csv('governed.csv', PEOPLE_CSV))
+
+    def run_limited(self, query, page=1, **limits):
+        with self.assertLogs('core.engines.sql_engine', 'WARNING'):
+            result = SQLEngine(self.csv, limits=QueryLimits(**limits)).execute_query(query, page=page, page_size=100)
+        self.assertFalse(result['success'])
+        return result
+
+    def test_nested_full_scans_are_rejected_before_running(self):
+        query = "SELECT COUNT(*) FROM dataset a, dataset b"
+        result = self.run_limited(query, max_rows_scanned=10_000)
+        self.assertEqual((result['error_code'], result['limit']), ('plan_too_expensive', 10_000))
+        self.assertEqual(SQLEngine(self.csv).execute_query(query)['rows'], [[40_000]])
+
+    def test_long_queries_are_interrupted(self):
+        endless = "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT MAX(i) FROM n"
+        result = self.run_limited(endless, time_limit=0.05, max_instructions=10 ** 12)
+        self.assertEqual((result['error_code'], result['limit']), ('time_limit', 0.05))
+        result = self.run_limited(endless, max_instructions=100_000)
+        self.assertEqual(result['error_code'], 'instruction_limit')
+
+    def test_pages_past_the_row_cap_are_refused(self):
+        result = self.run_limited("SELECT id FROM dataset", page=2, max_rows_returned=100)
+        self.assertEqual((result['error_code'], result['limit']), ('row_limit', 100))
+
+
+class SQLEngineInstrumentationTests(DatasetFilesMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.csv = str(cls.write_csv('timed.csv', PEOPLE_CSV))
+
+    def test_debug_reports_stage_timings_and_plan(self):
+        result = SQLEngine(self.csv).execute_query("SELECT name FROM dataset WHERE age > 60", debug=True)
+        debug = result['debug']
+        self.assertEqual(list(debug['timings_ms']), ['load', 'prepare', 'execute', 'fetch', 'serialize'])
+        self.assertEqual(debug['rows_returned'], len(result['rows']))
+        self.assertTrue(any('SCAN' in step['detail'] for step in debug['plan']))
+        self.assertNotIn('debug', SQLEngine(self.csv).execute_query("SELECT 1"))
+
+    def test_executions_are_logged_at_debug_only(self):
+        with self.assertLogs('core.engines.sql_engine', level='DEBUG') as logs:
+            SQLEngine(self.csv).execute_query("SELECT 2")
+        (record,) = [r for r in logs.records if r.getMessage().startswith('sql_query ')]
+        self.assertEqual(record.levelname, 'DEBUG')
+        self.assertEqual(json.loads(record.getMessage()[len('sql_query '):])['rows_returned'], 1)
+
+
+class ConnectionPoolTests(DatasetFilesMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.csv = str(cls.write_csv('pool.csv', PEOPLE_CSV))
+        cls.other_csv = str(cls.write_csv('pool-other.csv', PEOPLE_CSV))
+
+    def test_user_sql_cannot_write_to_the_shared_dataset(self):
+        engine = SQLEngine(self.csv, pool=ConnectionPool())
+        for statement in (
+            "PRAGMA query_only = OFF",
+            "DELETE FROM dataset",
+            "DROP TABLE dataset",
+            "CREATE TABLE notes (a)",
+            "ATTACH DATABASE ':memory:' AS other",
+        ):
+            result = engine.execute_query(statement)
+            self.assertFalse(result['success'], statement)
+            self.assertIn('not authorized', result['error'])
+        self.assertEqual(engine.execute_query("SELECT COUNT(*) FROM dataset")['rows'], [[200]])
+
+    def test_refused_connections_are_not_reused(self):
+        pool = ConnectionPool()
+        with pool.connection('people', self.csv) as conn:
+            with self.assertRaises(sqlite3.DatabaseError):
+                conn.execute("DELETE FROM dataset")
+        self.assertEqual(pool.stats()['datasets'], 1)
+        (entry,) = pool._entries.values()
+        self.assertEqual(entry.idle, [])
+
+        with pool.connection('people', self.csv) as conn:
+            conn.execute("SELECT COUNT(*) FROM dataset").fetchone()
+        self.assertEqual(len(entry.idle), 1)
+
+    def test_least_recently_used_dataset_is_evicted_over_budget(self):
+        pool = ConnectionPool(memory_budget=1)
+        with pool.connection('first', self.csv):
+            pass
+        with pool.connection('second', self.other_csv):
+            pass
+        stats = pool.stats()
+        self.assertEqual((stats['datasets'], stats['evictions']), (1, 1))
+        self.assertEqual([key[0] for key in pool._entries], ['second'])
+
+        with pool.connection('second', self.other_csv) as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM dataset").fetchone()[0], 200)
+        self.assertEqual(pool.stats()['hits'], 1)
+
+
+class IndexerTests(SimpleTestCase):
+    def test_similar_column_names_get_their_own_indexes(self):
+        columns = ['a b', 'a_b', 'A.B']
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE dataset ("a b", "a_b", "A.B")')
+        create_indexes(conn, 'dataset', columns)
+        indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+        indexed = [conn.execute("SELECT name FROM pragma_index_info(?)", (index,)).fetchone()[0] for index in indexes]
+        self.assertCountEqual(indexed, columns)
+
+    def test_ingest_indexes_keys_then_low_cardinality_columns(self):
+        profile = {
+            'passenger_id': {'distinct': 5000, 'nulls': 0},
+            'class': {'distinct': 3, 'nulls': 0},
+            'port': {'distinct': 40, 'nulls': 0},
+            'sex': {'distinct': 2, 'nulls': 0},
+            'cabin': {'distinct': 50, 'nulls': 4000},
+            'name': {'distinct': 5000, 'nulls': 0},
+        }
+        self.assertEqual(choose_indexes(profile, 5000), ['passenger_id', 'class', 'port'])
+        self.assertEqual(choose_indexes(profile, 10), [])
+
+    def test_workload_recommends_frequent_predicate_columns(self):
+        workload = [
+            ("SELECT * FROM dataset WHERE Age > 30", 60),
+            ('SELECT * FROM dataset d WHERE d."Port" = \'S\'', 30),
+            ("SELECT * FROM dataset WHERE name LIKE 'A%'", 2),
+            ("SELECT COUNT(*) FROM dataset", 100),
+        ]
+        columns = ['age', 'Port', 'name', 'fare']
+        self.assertEqual(recommend_indexes(workload, columns), ['age', 'Port'])
+        self.assertEqual(recommend_indexes(workload, columns, existing=['age']), ['Port'])
+
+
+class CompactLoadingTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        raw = pd.DataFrame({
+            'small': [1, 2, 3, 4],
+            'gappy': [1.0, None, 3.0, 4.0],
+            'ratio': [0.5, 0.25, 1.5, 2.0],
+            'port': ['S', 'C', 'S', 'S'],
+        })
+        self.schema = infer_schema(raw)
+        self.frame = apply_schema(raw, self.schema)
+
+    def test_storage_dtypes_are_compact(self):
+        self.assertEqual(
+            {col: spec['dtype'] for col, spec in self.schema.items()},
+            {'small': 'int8', 'gappy': 'Int8', 'ratio': 'float32', 'port': 'category'},
+        )
+
+    def test_user_code_gets_wide_numbers(self):
+        write_columnar(self.frame, self.tmp / 'columns')
+        df = read_columnar(self.tmp / 'columns')
+        self.assertEqual(
+            {col: str(dtype) for col, dtype in df.dtypes.items()},
+            {'small': 'int64', 'gappy': 'Int64', 'ratio': 'float64', 'port': 'category'},
+        )
+        self.assertEqual((df['small'] * 100).tolist(), [100, 200, 300, 400])
+        self.assertEqual((df['gappy'] * 1000).tolist()[2], 3000)
+
+
+@override_settings(DATASET_INGEST={'CHUNK_ROWS': 7, 'PREVIEW_ROWS': 5})
+class ChunkedIngestTests(DatasetFilesMixin, SimpleTestCase):
+    # 'code' is numeric for the first chunks and text in the last; 'score' is empty at first
+    MIXED_CSV = "id,code,score,seen\n" + "".join(
+        f"{i},{i if i < 20 else f'X{i}'},{'' if i < 10 else i / 4},2024-01-{i % 28 + 1:02d}\n" for i in range(1, 26)
+    )
+
+    def test_chunked_schema_matches_the_whole_file(self):
+        path = self.write_csv('mixed.csv', self.MIXED_CSV)
+        builder = SchemaBuilder()
+        for chunk in read_dataset_chunks(path, chunk_rows=7):
+            builder.update(chunk)
+        self.assertEqual(builder.schema(), infer_schema(pd.read_csv(path)))
+        self.assertEqual(builder.row_count, 25)
+
+    def test_snapshot_is_retyped_when_a_later_chunk_widens_a_column(self):
+        path = self.write_csv('mixed-snapshot.csv', self.MIXED_CSV)
+        snapshot = build_snapshot(str(path))
+        summary = snapshot_summary(snapshot)
+        self.assertEqual((summary['row_count'], len(summary['preview'])), (25, 5))
+        self.assertEqual(summary['schema']['code']['affinity'], 'TEXT')
+        conn = sqlite3.connect(snapshot)
+        self.addCleanup(conn.close)
+        codes = [row[0] for row in conn.execute("SELECT code FROM dataset ORDER BY id")]
+        self.assertEqual((codes[0], codes[-1]), ('1', 'X25'))
+
+    def test_empty_files_are_rejected(self):
+        with self.assertRaises(ValueError):
+            build_snapshot(str(self.write_csv('empty.csv', '')))
+
+
+@override_settings(DATASET_INGEST={'CHUNK_ROWS': 7})
+class ParquetDatasetTests(DatasetFilesMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.csv = str(cls.write_csv('parquet.csv', PEOPLE_CSV))
+        cls.schema = infer_schema(pd.read_csv(cls.csv))
+
+    def test_csv_reads_only_the_requested_window(self):
+        df = load_dataset(self.csv, self.schema, columns=['name'], rows=(10, 15))
+        self.assertEqual(list(df.columns), ['name'])
+        self.assertEqual(list(df['name']), [f'person{i}' for i in range(11, 16)])
+
+    @override_settings(DATASET_INGEST={'PARQUET': False})
+    def test_copy_can_be_turned_off(self):
+        self.assertIsNone(ensure_parquet(self.csv, self.schema))
+
+    @skipUnless(pq, "needs pyarrow")
+    def test_parquet_copy_reads_like_the_csv(self):
+        from_csv = load_dataset(self.csv, self.schema)
+        self.assertIsNotNone(ensure_parquet(self.csv, self.schema))
+        pd.testing.assert_frame_equal(load_dataset(self.csv, self.schema), from_csv)
+        window = load_dataset(self.csv, self.schema, columns=['id', 'age'], rows=(5, 19))
+        pd.testing.assert_frame_equal(window, from_csv[['id', 'age']].iloc[5:19].reset_index(drop=True))
+
+
+class SharedColumnsTests(SimpleTestCase):
+    def setUp(self):
+        tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, tmp, ignore_errors=True)
+        write_columnar(pd.DataFrame({'a': [1, 2, 3], 'note': ['x', 'y', 'z']}), tmp / 'columns')
+        self.df = read_columnar(tmp / 'columns')
+
+    def test_numeric_columns_are_read_only_maps(self):
+        self.assertFalse(self.df['a'].to_numpy().flags.writeable)
+
+    def test_user_edits_copy_only_their_own_frame(self):
+        # What python_worker hands each job
+        scope_df = self.df.copy(deep=False)
+        scope_df.loc[0, 'a'] = 10
+        scope_df['note'] = scope_df['note'].str.upper()
+        self.assertEqual(scope_df['a'].tolist(), [10, 2, 3])
+        self.assertEqual(self.df['a'].tolist(), [1, 2, 3])
+        self.assertEqual(self.df['note'].tolist(), ['x', 'y', 'z'])
+
+
+class DatasetGridTests(DatasetFilesMixin, SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.csv = str(cls.write_csv('grid.csv', PEOPLE_CSV))
+
+    def window(self, params):
+        query = GridQuery.from_params(QueryDict(params), ['id', 'name', 'age'])
+        return fetch_window(self.csv, query)
+
+    def test_unknown_columns_and_operators_are_rejected(self):
+        for params in (
+            'sort=salary',
+            'columns=id&columns=name;DROP TABLE dataset',
+            'filters=[{"column": "age", "op": "between", "value": 1}]',
+            'filters=[{"column": "age) OR (1", "op": "eq", "value": 1}]',
+            'filters=[{"column": "age", "op": "eq", "value": [1, 2]}]',
+            'filters=age>1',
+            'limit=ten',
+        ):
+            with self.assertRaises(GridError, msg=params):
+                self.window(params)
+
+    def test_unfiltered_windows_are_row_ranges(self):
+        window = self.window('offset=150&limit=10&columns=name')
+        self.assertEqual(window['row_numbers'], list(range(151, 161)))
+        self.assertEqual(window['rows'][0], ['person151'])
+        self.assertEqual((window['total'], window['has_more']), (200, True))
+
+    def test_filtered_windows_are_sorted_and_counted(self):
+        window = self.window('sort=age&order=desc&limit=500&filters=[{"column": "age", "op": "gte", "value": 60}]')
+        ages = [int(row[2]) for row in window['rows']]
+        self.assertEqual((window['total'], len(ages), window['has_more']), (40, 40, False))
+        self.assertEqual(ages, sorted(ages, reverse=True))
+        self.assertEqual(min(ages), 60)
+
+    def test_search_and_like_filters_match_literally(self):
+        self.assertEqual(self.window('q=person19')['total'], 11)
+        self.assertEqual(self.window('filters=[{"column": "name", "op": "contains", "value": "son19"}]')['total'], 11)
+        self.assertEqual(self.window('filters=[{"column": "name", "op": "contains", "value": "_"}]')['total'], 0)
+
+
+class PythonWorkerPoolTests(DatasetFilesMixin, SimpleTestCase):
+    """Runs jobs on a one-process pool of its own."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.columnar = ensure_columnar(str(cls.write_csv('python.csv', PEOPLE_CSV)))
+        cls.pool = PythonWorkerPool(processes=1, max_jobs=3, max_datasets=2, max_rss_mb=1024)
+        cls.addClassCleanup(cls.pool.shutdown)
+
+    def job(self, code, session=None, **extra):
+        return dict({
+            'dataset_key': 'python', 'version': self.columnar.name, 'columnar': str(self.columnar),
+            'code': code, 'validation_code': None, 'session': session,
+        }, **extra)
+
+    def run_code(self, code, session=None, **limits):
+        return self.pool.run(self.job(code, session), PythonLimits(**limits))
+
+    def assertLimitHit(self, result, error_code, limit):
+        self.assertFalse(result['success'])
+        self.assertEqual((result['error_code'], result['limit']), (error_code, limit))
+
+    def test_workers_keep_datasets_warm_and_retire(self):
+        before = self.pool.stats()
+        for _ in range(3):
+            result = self.run_code("print(len(df), df['age'].dtype)")
+            self.assertEqual(result['output'], '200 int64\n')
+            self.assertEqual(set(result['usage']), {'cpu_seconds', 'wall_seconds', 'peak_rss_mb'})
+        after = self.pool.stats()
+        self.assertGreaterEqual(after['warm_hits'] - before['warm_hits'], 1)
+        self.assertGreaterEqual(after['recycled'] - before['recycled'], 1)
+
+    def test_cpu_limit(self):
+        self.assertLimitHit(self.run_code("while True: pass", cpu_seconds=1), 'cpu_limit', 1)
+        self.assertTrue(self.run_code("print(1)")['success'])
+
+    def test_memory_limit(self):
+        self.assertLimitHit(self.run_code("block = bytearray(512 * 2 ** 20)", memory_mb=64), 'memory_limit', 64)
+        self.assertTrue(self.run_code("block = bytearray(16 * 2 ** 20)")['success'])
+
+    def test_output_limit_keeps_what_was_printed(self):
+        result = self.run_code("for i in range(100): print('x' * 9)", max_output_chars=50)
+        self.assertLimitHit(result, 'output_limit', 50)
+        self.assertEqual(result['output'], 'xxxxxxxxx\n' * 5)
+
+    def test_wall_limit_replaces_the_worker(self):
+        timed_out = self.pool.stats()['timed_out']
+        self.assertLimitHit(self.run_code("import time; time.sleep(30)", wall_seconds=1), 'wall_limit', 1)
+        self.assertEqual(self.pool.stats()['timed_out'], timed_out + 1)
+        self.assertTrue(self.run_code("print(1)")['success'])
+
+
+    def test_sessions_keep_variables_between_runs(self):
+        first = self.run_code("adults = df[df.age >= 30]", session=session_options('1:1'))
+        self.assertEqual(first['session']['status'], 'new')
+        self.assertIn('adults', first['session']['variables'])
+        second = self.run_code("print(len(adults))", session=session_options('1:1'))
+        self.assertEqual(second['output'], '160\n')
+        # 'restored' when the worker retired in between and spilled it to disk
+        self.assertIn(second['session']['status'], ('memory', 'restored'))
+
+        self.assertFalse(self.run_code("print(len(adults))", session=session_options('2:1'))['success'])
+        self.assertFalse(self.run_code("print(len(adults))", session=session_options('1:1', reset=True))['success'])
+
+
+    def test_stdout_streams_until_the_run_is_cancelled(self):
+        code = "import time\nfor i in range(100):\n    print(i)\n    time.sleep(0.5)"
+        run = self.pool.stream(self.job(code, stream=True), run_id='streamed', owner=1)
+        event, data = next(run)
+        self.assertEqual(event, 'stdout')
+        self.assertTrue(data.startswith('0\n'))
+        self.assertFalse(self.pool.cancel('streamed', owner=2))
+        self.assertTrue(self.pool.cancel('streamed', owner=1))
+        result = [data for event, data in run if event == 'result'][0]
+        self.assertEqual(result['error_code'], 'cancelled')
+        self.assertFalse(self.pool.cancel('streamed', owner=1))
+
+
+class SessionStoreTests(SimpleTestCase):
+    def setUp(self):
+        spill_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spill_dir, ignore_errors=True)
+        self.options = {'reset': False, 'idle_seconds': 60, 'max_session_mb': 64, 'max_total_mb': 0, 'spill_dir': spill_dir}
+        self.df = pd.DataFrame({'a': [1, 2, 3]})
+
+    def open(self, store, key, version='v1', **options):
+        return store.open(dict(self.options, key=key, **options), version, self.df)
+
+    def test_stale_sessions_start_over(self):
+        store = SessionStore()
+        session, status = self.open(store, 'a')
+        session.scope['x'] = 1
+        self.assertEqual(status, 'new')
+        self.assertEqual(self.open(store, 'a')[1], 'memory')
+        self.assertEqual(self.open(store, 'a', version='v2')[1], 'expired')
+        self.assertEqual(self.open(store, 'a', version='v2', reset=True)[1], 'new')
+
+    def test_least_recently_used_sessions_spill_to_disk(self):
+        store = SessionStore()
+        first, _ = self.open(store, 'first')
+        first.scope.update(total=6, square=lambda v: v * v)
+        first.measure()
+        self.open(store, 'second')[0].measure()
+        store.enforce(self.options)
+        self.assertEqual(store.keys(), ['second'])
+
+        # Picked up by another worker's store; lambdas don't survive pickling
+        restored, status = self.open(SessionStore(), 'first')
+        self.assertEqual(status, 'restored')
+        self.assertEqual((restored.scope['total'], 'square' in restored.scope), (6, False))
+        self.assertEqual(self.open(SessionStore(), 'first')[1], 'new')
+
+
+class CaseQueryTestCase(DatasetFilesMixin, TransactionTestCase):
+    """A case over PEOPLE_CSV with one SQL question. The views run on executor
+    threads, which don't see a TestCase transaction."""
+
+    def setUp(self):
+        self.write_csv('people.csv', PEOPLE_CSV)
+        dataset = Dataset.objects.create(name='People', file='datasets/people.csv')
+        self.case = Case.objects.create(title='People', description='d', dataset=dataset, difficulty='Easy')
+        Question.objects.create(
+            case=self.case, text='How many people?', question_type='SQL', validation_query='SELECT COUNT(*) FROM dataset',
+        )
+        self.user = User.objects.create_user('detective', password='x')
+        UserProfile.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def run_query(self, query, **extra):
+        response = self.client.post(
+            f'/case/{self.case.id}/execute_query/', json.dumps(dict(query=query, **extra)), content_type='application/json',
+        )
+        return response.json()
+
+
+class SqlPagingViewTests(CaseQueryTestCase):
+    def test_pages_are_read_from_the_cursor(self):
+        first = self.run_query("SELECT id FROM dataset ORDER BY id", page_size=75)
+        self.assertEqual((len(first['rows']), first['has_more']), (75, True))
+        last = self.run_query("SELECT id FROM dataset ORDER BY id", page=3, page_size=75)
+        self.assertEqual(last['rows'][0], [151])
+        self.assertEqual((len(last['rows']), last['has_more']), (50, False))
+
+    def test_rows_are_counted_only_on_request(self):
+        self.assertNotIn('row_count', self.run_query("SELECT * FROM dataset WHERE age > 30"))
+        self.assertEqual(self.run_query("SELECT * FROM dataset WHERE age > 30", count_only=True),
+                         {'success': True, 'row_count': 156})
+
+
+class BoundedExecutorTests(SimpleTestCase):
+    async def test_work_over_capacity_is_rejected(self):
+        executor = executors.BoundedExecutor('test', max_workers=1, max_queue=1, retry_after=3)
+        release = threading.Event()
+        running = [asyncio.ensure_future(executor.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with self.assertRaises(executors.ExecutorSaturated) as raised:
+            await executor.run(lambda: None)
+        self.assertEqual(raised.exception.retry_after, 3)
+        self.assertEqual((executor.stats()['in_flight'], executor.stats()['rejected']), (2, 1))
+
+        release.set()
+        await asyncio.gather(*running)
+        self.assertEqual(await executor.run(lambda: 'ran'), 'ran')
+        self.assertEqual(executor.stats()['in_flight'], 0)
+
+
+class BusyExecutorViewTests(CaseQueryTestCase):
+    def test_saturated_executor_answers_429(self):
+        executor = executors.BoundedExecutor('sql', max_workers=1, max_queue=0, retry_after=7)
+        executor._acquire()
+        with patch.dict(executors._executors, {'sql': executor}):
+            response = self.client.post(
+                f'/case/{self.case.id}/execute_query/', json.dumps({'query': 'SELECT 1'}), content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '7')
+        self.assertEqual(response.json()['error_code'], 'busy')
+
+
+class SqlBatchViewTests(CaseQueryTestCase):
+    def run_batch(self, queries, **extra):
+        response = self.client.post(
+            f'/case/{self.case.id}/execute_query/batch/', json.dumps(dict(queries=queries, **extra)),
+            content_type='application/json',
+        )
+        return response.json()
+
+    def test_queries_run_in_order(self):
+        result = self.run_batch(["SELECT COUNT(*) FROM dataset", "SELECT MAX(age) FROM dataset"])
+        self.assertTrue(result['success'])
+        self.assertEqual([r['rows'] for r in result['results']], [[[200]], [[69]]])
+        self.assertTrue(all('elapsed_ms' in r for r in result['results']))
+
+    def test_stop_on_error_skips_the_rest(self):
+        queries = ["SELECT 1", "SELECT missing FROM dataset", "SELECT 2"]
+        result = self.run_batch(queries)
+        self.assertFalse(result['success'])
+        self.assertEqual([r['success'] for r in result['results']], [True, False, True])
+
+        result = self.run_batch(queries, stop_on_error=True)
+        self.assertEqual([r['success'] for r in result['results']], [True, False, False])
+        self.assertTrue(result['results'][2]['skipped'])
+
+    def test_batch_size_is_capped(self):
+        result = self.run_batch(["SELECT 1"] * 21)
+        self.assertEqual(result, {'success': False, 'error': 'At most 20 queries per batch'})
+
+
+class SqlGradingViewTests(CaseQueryTestCase):
+    def test_running_a_query_does_not_grade_it(self):
+        result = self.run_query("SELECT COUNT(*) FROM dataset")
+        self.assertTrue(result['success'])
+        self.assertNotIn('is_correct', result)
+
+    def test_submitted_answers_are_graded(self):
+        self.assertTrue(self.run_query("select count(*) from dataset where age > 0", submit=True)['is_correct'])
+        self.assertFalse(self.run_query("SELECT COUNT(*) - 1 FROM dataset", submit=True)['is_correct'])
+
+    def test_column_count_is_checked_first(self):
+        result = self.run_query("SELECT COUNT(*), 1 FROM dataset", submit=True)
+        self.assertFalse(result['is_correct'])
+        self.assertIn('Expected 1 columns, got 2', result['validation_message'])
+
+
+class PythonGradingViewTests(CaseQueryTestCase):
+    def run_python(self, code):
+        response = self.client.post(
+            f'/case/{self.case.id}/execute_python/', json.dumps({'code': code}), content_type='application/json',
+        )
+        return response.json()
+
+    def test_runs_are_graded_against_the_validation_code(self):
+        Question.objects.create(case=self.case, text='How many?', question_type='PYTHON', validation_query='print(len(df))')
+        self.assertTrue(self.run_python('print(df.shape[0])')['is_correct'])
+        self.assertFalse(self.run_python('print(1)')['is_correct'])
+
+    def test_broken_validation_code_is_a_grading_error(self):
+        Question.objects.create(case=self.case, text='How many?', question_type='PYTHON',
+                                validation_query='raise ValueError("grader bug")')
+        with self.assertLogs('core.views', 'WARNING') as logs:
+            result = self.run_python('print(len(df))')
+        self.assertIn('grader bug', logs.output[0])
+        self.assertTrue(result['success'])
+        self.assertEqual(result['output'].strip(), '200')
+        self.assertIsNone(result['error'])
+        self.assertIsNone(result['is_correct'])
+        self.assertIn('grading_error', result)
+        self.assertNotIn('grader bug', json.dumps(result))
+
+
+class ExpectedOutputCacheTests(CaseQueryTestCase):
+    def test_expected_results_are_computed_once_per_version(self):
+        question = Question.objects.create(case=self.case, text='How many?', question_type='PYTHON', validation_query='print(len(df))')
+        warm_expected_outputs(case_id=self.case.id)
+        question.refresh_from_db()
+        self.assertEqual(question.expected_output, '200\n')
+        sql_question = Question.objects.get(case=self.case, question_type='SQL')
+        self.assertEqual(sql_question.expected_fingerprint['rows'], 1)
+
+        jobs = get_python_pool().stats()['jobs']
+        warm_expected_outputs(case_id=self.case.id)
+        self.assertEqual(get_python_pool().stats()['jobs'], jobs)
+
+        columnar = columnar_path(self.case.dataset.file.path)
+        self.assertIsNotNone(cached_expected(question, columnar))
+        question.validation_query = 'print(len(df) + 0)'
+        self.assertIsNone(cached_expected(question, columnar))
+
+    def test_broken_validation_code_is_reported_and_not_stored(self):
+        question = Question.objects.create(case=self.case, text='How many?', question_type='PYTHON', validation_query='1 / 0')
+        with self.assertLogs('core.tasks', 'WARNING') as logs:
+            warm_expected_outputs(case_id=self.case.id)
+        self.assertIn('ZeroDivisionError', logs.output[0])
+        question.refresh_from_db()
+        self.assertEqual(question.expected_output_key, '')
+
+
+class PythonCancelViewTests(CaseQueryTestCase):
+    def cancel(self, run_id):
+        return self.client.post(
+            f'/case/{self.case.id}/execute_python/cancel/', json.dumps({'run_id': run_id}), content_type='application/json',
+        )
+
+    def test_only_the_owner_can_cancel_a_run(self):
+        # Never iterated, so it stays registered without taking a worker
+        run = get_python_pool().stream({'code': ''}, run_id='run-1', owner=self.user.id)
+        self.addCleanup(run.close)
+        other = User.objects.create_user('suspect', password='x')
+        self.client.force_login(other)
+        self.assertFalse(self.cancel('run-1').json()['success'])
+        self.client.force_login(self.user)
+        self.assertTrue(self.cancel('run-1').json()['success'])
+
+    def test_anonymous_users_are_sent_to_login(self):
+        self.client.logout()
+        self.assertEqual(self.cancel('run-1').status_code, 302)
+
+
+failures = []
+
+
+@task('test_fail', on_failure=lambda error, **payload: failures.append(payload))
+def failing_task(**payload):
+    raise ValueError("always fails")
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        failures.clear()
+
+    def test_highest_priority_due_job_is_claimed_once(self):
+        enqueue('test_fail', {'n': 1})
+        urgent = enqueue('test_fail', {'n': 2}, priority=10)
+        self.assertEqual(enqueue('test_fail', {'n': 2}, unique=True), urgent)
+
+        claimed = claim_next('worker-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (urgent.pk, 'running', 1))
+        self.assertIsNone(_claim(urgent.pk, 'worker-2'))
+
+    def test_failed_jobs_are_retried_with_backoff_then_failed(self):
+        job = enqueue('test_fail', {'n': 1}, max_attempts=2)
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertFalse(run_job(claim_next('worker')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertIn('always fails', job.last_error)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+        self.assertIsNone(claim_next('worker'))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            run_job(claim_next('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(failures, [{'n': 1}])
+
+    def test_jobs_of_dead_workers_are_requeued(self):
+        retried = enqueue('test_fail', {'n': 1})
+        exhausted = enqueue('test_fail', {'n': 2}, max_attempts=1)
+        for _ in range(2):
+            claim_next('worker')
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertEqual(requeue_expired(), 1)
+        retried.refresh_from_db()
+        exhausted.refresh_from_db()
+        self.assertEqual((retried.status, retried.locked_by), ('queued', ''))
+        self.assertEqual(exhausted.status, 'failed')
+
+
+class BlobStorageTests(DatasetFilesMixin, TestCase):
+    def upload(self, name, content):
+        self.write_csv(name, content)
+        dataset = Dataset.objects.create(name=name, file=f'datasets/{name}')
+        with self.captureOnCommitCallbacks(execute=True):
+            commit_version(dataset)
+        return dataset
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.upload('first.csv', PEOPLE_CSV)
+        second = self.upload('second.csv', PEOPLE_CSV)
+        self.assertEqual(first.file.name, second.file.name)
+        blob = DatasetBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertFalse((self.tmp / 'media' / 'datasets' / 'first.csv').exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        self.assertTrue(Path(blob.file.path).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(DatasetBlob.objects.exists())
+        self.assertFalse(Path(blob.file.path).exists())
+
+    def test_new_content_is_a_new_version(self):
+        dataset = self.upload('people.csv', PEOPLE_CSV)
+        self.assertEqual(commit_version(dataset).number, 1)
+
+        self.write_csv('people.csv', PEOPLE_CSV + "201,late,30\n")
+        dataset.file.name = 'datasets/people.csv'
+        with self.captureOnCommitCallbacks(execute=True):
+            version = commit_version(dataset)
+        self.assertEqual(version.number, 2)
+        self.assertEqual(list(DatasetBlob.objects.values_list('ref_count', flat=True)), [1, 1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class ProgressionMapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('detective')
+        UserProfile.objects.create(user=self.user)
+        self.cases = [
+            Case.objects.create(title=f'Case {order}', description='d', difficulty='Easy', order=order)
+            for order in (2, 1, 3)
+        ]
+
+    def statuses(self):
+        return [(case['title'], case['status']) for case in progression_map(self.user)]
+
+    def test_solving_a_case_updates_the_cached_map(self):
+        self.assertEqual(self.statuses(), [('Case 1', 'active'), ('Case 2', 'locked'), ('Case 3', 'locked')])
+        with self.captureOnCommitCallbacks(execute=True):
+            Submission.objects.create(user=self.user, case=self.cases[1], completed=True)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.statuses(), [('Case 1', 'solved'), ('Case 2', 'active'), ('Case 3', 'locked')])
+
+    def test_case_changes_rebuild_every_map(self):
+        self.statuses()
+        with self.captureOnCommitCallbacks(execute=True):
+            Case.objects.create(title='Case 0', description='d', difficulty='Easy', order=0)
+        self.assertEqual(self.statuses()[0], ('Case 0', 'active'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Case.objects.get(title='Case 0').delete()
+        self.assertEqual(len(self.statuses()), 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class WeeklyLeaderboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('detective')
+        UserProfile.objects.create(user=self.user)
+        self.case = Case.objects.create(title='Case', description='d', difficulty='Easy', xp_reward=150)
+
+    def week_score(self):
+        return LeaderboardEntry.objects.get(board=week_board(), user=self.user).score
+
+    def test_resaving_a_completed_submission_counts_once(self):
+        submission = Submission.objects.create(user=self.user, case=self.case)
+        self.assertFalse(LeaderboardEntry.objects.filter(board=week_board(), user=self.user).exists())
+        submission.completed = True
+        submission.save()
+        submission.score = 80
+        submission.save()
+        self.assertEqual(self.week_score(), 150)
+
+    def test_each_completed_case_counts(self):
+        other = Case.objects.create(title='Other', description='d', difficulty='Easy', xp_reward=50)
+        Submission.objects.create(user=self.user, case=self.case, completed=True)
+        Submission.objects.create(user=self.user, case=other, completed=True)
+        self.assertEqual(self.week_score(), 200)
+
+
+class SkipListTests(SimpleTestCase):
+    """Checked against a sorted Python list after random changes."""
+
+    def assertMatches(self, skiplist, keys):
+        self.assertEqual(len(skiplist), len(keys))
+        self.assertEqual(skiplist.slice(0, len(keys) + 5), keys)
+        for start in range(-2, len(keys) + 2, 7):
+            self.assertEqual(skiplist.slice(start, start + 9), keys[max(start, 0):max(start + 9, 0)])
+        for probe in range(-1, 1002, 13):
+            self.assertEqual(skiplist.bisect_left(probe), sum(key < probe for key in keys))
+
+    def test_random_inserts_and_removes(self):
+        rng = random.Random(25)
+        keys = sorted(rng.sample(range(1000), 300))
+        skiplist = _SkipList(keys)
+        self.assertMatches(skiplist, keys)
+        for _ in range(500):
+            key = rng.randrange(1000)
+            if key in keys:
+                skiplist.remove(key)
+                keys.remove(key)
+            else:
+                skiplist.insert(key)
+                keys.append(key)
+                keys.sort()
+        self.assertMatches(skiplist, keys)
+        with self.assertRaises(KeyError):
+            skiplist.remove(1000)
+
+
+class RankingTests(SimpleTestCase):
+    def test_ranks_match_a_full_sort(self):
+        rng = random.Random(7)
+        ranking, scores = Ranking(), {}
+        ranking.load([(user, 0, 0) for user in range(50)])
+        scores.update((user, (0, 0)) for user in range(50))
+        for step in range(1, 400):
+            user, score = rng.randrange(60), rng.randrange(20) * 10
+            ranking.update(user, score, step)
+            scores[user] = (score, step)
+
+        ordered = sorted(scores, key=lambda user: (-scores[user][0], scores[user][1], user))
+        # Competition ranking: one more than the users with a higher score
+        expected = [
+            {'rank': 1 + sum(s > scores[user][0] for s, _ in scores.values()), 'user_id': user, 'score': scores[user][0]}
+            for user in ordered
+        ]
+        self.assertEqual(len(ranking), 60)
+        self.assertEqual(ranking.top(10), expected[:10])
+        for i, user in enumerate(ordered):
+            self.assertEqual(ranking.position(user), expected[i])
+            self.assertEqual(ranking.around(user, 2), expected[max(i - 2, 0):i + 3])
+        self.assertIsNone(ranking.position(999))
+        self.assertEqual(ranking.around(999, 2), [])
+
+
+class ColumnStatsTests(SimpleTestCase):
+    def hll_estimate(self, values):
+        hll = HyperLogLog()
+        for chunk in np.array_split(values, 7):
+            hll.add_hashes(pd.util.hash_array(chunk))
+        return hll.estimate()
+
+    def test_hyperloglog_estimate_is_within_error_bound(self):
+        # 1.6% standard error at the default precision; 5% is over three of them
+        for distinct in (500, 20_000, 200_000):
+            values = np.arange(distinct, dtype='int64')
+            estimate = self.hll_estimate(np.concatenate([values, values[::3]]))
+            self.assertLess(abs(estimate - distinct) / distinct, 0.05, (distinct, estimate))
+
+    def test_frequent_values_undercount_is_bounded(self):
+        rng = np.random.default_rng(7)
+        values = pd.Series(rng.zipf(1.3, 50_000) % 2000)
+        summary = FrequentValues(capacity=20)
+        for start in range(0, len(values), 5000):
+            summary.update(values.iloc[start:start + 5000].value_counts())
+        self.assertTrue(summary.truncated)
+
+        bound = len(values) / summary.capacity
+        for value, true_count in values.value_counts().items():
+            counted = summary.counts.get(value, 0)
+            self.assertLessEqual(counted, true_count)
+            self.assertLessEqual(true_count - counted, bound)
+            if true_count > bound:
+                self.assertIn(value, summary.counts)
@@ -8,9 +8,13 @@ urlpatterns = [
     path('register/', views.register_view, name='register'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('case/<int:id>/', views.case_detail_view, name='case_detail'),
+    path('case/<int:id>/grid/', views.case_grid_view, name='case_grid'),
     path('case/<int:id>/solve/', views.solve_view, name='solve'),
     path('case/<int:case_id>/execute_query/', views.execute_query_view, name='execute_query'),
+    path('case/<int:case_id>/execute_query/batch/', views.execute_query_batch_view, name='execute_query_batch'),
     path('case/<int:case_id>/execute_python/', views.execute_python_view, name='execute_python'),
+    path('case/<int:case_id>/execute_python/stream/', views.execute_python_stream_view, name='execute_python_stream'),
+    path('case/<int:case_id>/execute_python/cancel/', views.cancel_python_view, name='cancel_python'),
     path('result/', views.result_view, name='result'),
     path('leaderboard/', views.leaderboard_view, name='leaderboard'),
     path('profile/', views.profile_view, name='profile'),
@@ -4,7 +4,10 @@ from django.contrib.auth import authenticate, login
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.utils import timezone
-from .models import Case, UserProfile, Submission
+from django.conf import settings
+from .models import Case, Dataset, UserProfile, Submission
+from .progression import progression_map, case_catalog
+from .leaderboard import GLOBAL, week_board, case_board, standings
 
 def landing(request):
     return render(request, 'core/landing.html')
@@ -69,36 +72,20 @@ def register_view(request):
 
 @login_required
 def dashboard_view(request):
-    # Fetch all cases ordered by ID (progression order)
-    all_cases = Case.objects.all().order_by('id')
-    
-    # Get IDs of cases the user has solved correctly
-    solved_ids = set(Submission.objects.filter(
-        user=request.user, 
-        completed=True
-    ).values_list('case_id', flat=True))
-    
-    cases_with_status = []
-    is_next_active = True  # The first case is active by default
-    
-    for case in all_cases:
-        if case.id in solved_ids:
-            case.status = 'solved'
-            # If current is solved, the next one remains active (pending logic below)
-            is_next_active = True 
-        elif is_next_active:
-            case.status = 'active'
-            # We found the active case, subsequent ones should be locked
-            is_next_active = False
-        else:
-            case.status = 'locked'
-        
-        cases_with_status.append(case)
-
-    return render(request, 'core/dashboard.html', {'cases': cases_with_status})
+    # Active cases in learning-path order, each solved/active/locked for this
+    # user; cached per user and kept current as cases are solved
+    cases = progression_map(request.user)
+    return render(request, 'core/dashboard.html', {
+        'cases': cases,
+        'solved_count': sum(1 for case in cases if case['status'] == 'solved'),
+    })
 
-import pandas as pd
 import os
+from itertools import zip_longest
+from .engines.loader import display_frame
+from .engines.parquet import load_dataset
+from .engines.stats import describe_column
+from .engines.snapshot import source_signature
 
 @login_required
 def case_detail_view(request, id):
@@ -107,18 +94,38 @@ def case_detail_view(request, id):
     # Load Dataset
     columns = []
     rows = []
+    column_hints = []
+    metadata = {}
+    grid_ready = False
+    grid_columns = {}
     if case.dataset and case.dataset.file:
         try:
             # Open the file from the storage
             file_path = case.dataset.file.path
-            if os.path.exists(file_path):
-                df = pd.read_csv(file_path)
-                # handle NaN
-                df = df.fillna('')
+            metadata = case.dataset.columns_metadata
+            if os.path.exists(file_path) and metadata.get('preview_signature') == source_signature(file_path):
+                # Stored at ingest, so the page doesn't parse the file
+                columns = metadata['columns']
+                rows = metadata['preview']
+                stats = metadata.get('stats', {})
+                schema = metadata.get('schema', {})
+                column_hints = [describe_column(schema.get(col), stats.get(col)) for col in columns]
+                grid_ready = True
+                # Filter choices in the header menus: frequent values from ingest
+                grid_columns = {
+                    col: {
+                        'text': schema.get(col, {}).get('dtype') in ('category', 'object'),
+                        'values': [value for value, _count in stats.get(col, {}).get('top', [])],
+                    }
+                    for col in columns
+                }
+            elif os.path.exists(file_path):
+                df = load_dataset(file_path, metadata.get('schema'), rows=(0, 100))
                 columns = df.columns.tolist()
                 # Determine "primary key" or ID column for UI (first column usually)
                 # Limit rows for initial view to preventing crashing browser
-                rows = df.head(100).values.tolist() 
+                # handle NaN
+                rows = display_frame(df).values.tolist()
             else:
                  # Fallback for seeded data if path issues (e.g. storage weirdness)
                  columns = ['Error']
@@ -130,7 +137,12 @@ def case_detail_view(request, id):
     context = {
         'case': case,
         'columns': columns,
+        # Per-column summary of the ingest statistics, shown when hovering a header
+        'column_headers': list(zip_longest(columns, column_hints, fillvalue='')),
         'rows': rows,
+        # The rest of the rows are fetched from case_grid as the grid scrolls
+        'row_count': metadata.get('row_count') if grid_ready else None,
+        'grid_columns': grid_columns,
     }
     return render(request, 'core/case_detail.html', context)
 
@@ -138,28 +150,120 @@ def solve_view(request, id):
     case = get_object_or_404(Case, id=id)
     return render(request, 'core/solve.html', {'case': case})
 
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 import json
-from .engines.sql_engine import SQLEngine
+import logging
+import uuid
+from .workload import record_query
+from .executors import get_executor, ExecutorSaturated
+from .engines.pool import get_pool
+from .engines.result_cache import get_result_cache
+from .engines.metrics import get_metrics, get_python_metrics
+from .engines.python_pool import get_python_pool, PythonLimits, session_options
+from .engines.columnar import ensure_columnar
+from .jobs import queue_stats
+from .engines.grid import GridQuery, GridError, fetch_window
+from .engines.governor import QueryLimitExceeded
+from .grading import python_job, case_sql_engine, cached_expected, store_expected, grade_python, grade_sql
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_QUERIES = 20
+
+def _busy_response(exc):
+    response = JsonResponse(
+        {'success': False, 'error': 'The server is busy running other queries. Please retry shortly.', 'error_code': 'busy'},
+        status=429,
+    )
+    response['Retry-After'] = str(exc.retry_after)
+    return response
+
+@login_required
+def case_grid_view(request, id):
+    """
+    One window of the case's dataset for the grid on the case page, read
+    from its snapshot: GET offset/limit (or page/page_size), columns, sort,
+    order, filters, q (see GridQuery.from_params). Returns the rows with
+    their row numbers and the total matching the filters.
+    """
+    case = get_object_or_404(Case, id=id)
+    dataset = case.dataset
+    if not (dataset and dataset.file) or not os.path.exists(dataset.file.path):
+        return JsonResponse({'success': False, 'error': 'No dataset found for this case.'}, status=404)
+    metadata = dataset.columns_metadata
+    if not metadata.get('columns'):
+        return JsonResponse(
+            {'success': False, 'error': 'The dataset is still being processed.', 'error_code': 'not_ready'}, status=409,
+        )
+
+    try:
+        query = GridQuery.from_params(request.GET, metadata['columns'], metadata.get('schema'))
+        window = fetch_window(dataset.file.path, query, dataset_key=dataset.id, schema=metadata.get('schema'))
+    except GridError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except QueryLimitExceeded as e:
+        return JsonResponse(e.as_result())
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
+    if query.filters and query.offset == 0:
+        # Columns students filter the grid on are index candidates too
+        record_query(dataset.id, query.count()[0])
+    return JsonResponse(dict(window, success=True))
+
+# The execute views are async: engine work runs on a bounded thread pool
+# (see core/executors.py) so waiting requests don't hold a server worker.
 
 @login_required
 @csrf_exempt # For simplicity in this demo, handling CSRF via template tag locally is better, but this ensures it works for now. 
 # Ideally we pass X-CSRFToken in headers. I'll add that to the JS.
-def execute_query_view(request, id):
+async def execute_query_view(request, case_id):
+    try:
+        return await get_executor('sql').run(_execute_query, request, case_id)
+    except ExecutorSaturated as e:
+        return _busy_response(e)
+
+def _execute_query(request, case_id):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             query = data.get('query')
-            case = get_object_or_404(Case, id=id)
+            case = get_object_or_404(Case, id=case_id)
 
             if not query:
                 return JsonResponse({'success': False, 'error': 'No query provided'})
 
             # Initialize Engine
             if case.dataset and case.dataset.file:
-                 engine = SQLEngine(case.dataset.file.path)
-                 result = engine.execute_query(query)
+                 engine = case_sql_engine(case)
+                 if data.get('count_only'):
+                     # "Count rows" on the case page, asked for after the first page is shown
+                     row_count = engine.count_rows(query)
+                     if row_count is None:
+                         return JsonResponse({'success': False, 'error': "This query's rows can't be counted."})
+                     return JsonResponse({'success': True, 'row_count': row_count})
+                 # Pages after the first are requested by the "Load more" button
+                 result = engine.execute_query(
+                     query,
+                     page=data.get('page', 1),
+                     page_size=data.get('page_size', 50),
+                     # Timing breakdown and query plan, for local dev and staff
+                     debug=bool(data.get('debug')) and (settings.DEBUG or request.user.is_staff),
+                 )
+                 # Counting walks the whole result, so it's opt-in
+                 if result['success'] and data.get('include_count'):
+                     result = dict(result, row_count=engine.count_rows(query))
+                 if result['success'] and result.get('page') == 1:
+                     # Feed the index advisor; later pages are the same query
+                     record_query(case.dataset.id, query)
+                 if result['success'] and result.get('page') == 1 and data.get('submit'):
+                     # Grading hashes the full result, so only answers the student submits are checked
+                     # against the case's SQL question (one per case for prototype)
+                     question = case.questions.filter(question_type='SQL').exclude(validation_query='').first()
+                     if question:
+                         is_correct, validation_message = grade_sql(question, engine, query, columns=result['columns'])
+                         result = dict(result, is_correct=is_correct, validation_message=validation_message)
                  return JsonResponse(result)
             else:
                  return JsonResponse({'success': False, 'error': 'No dataset found for this case.'})
@@ -169,116 +273,233 @@ def execute_query_view(request, id):
     
     return JsonResponse({'success': False, 'error': 'Invalid method'})
 
+@login_required
+@csrf_exempt
+async def execute_query_batch_view(request, case_id):
+    """
+    Runs a list of queries (e.g. the sub-steps of one question) in order on a
+    single connection. Body: {"queries": [...], "stop_on_error": bool}.
+    Returns per-query results with elapsed_ms.
+    """
+    try:
+        return await get_executor('sql').run(_execute_query_batch, request, case_id)
+    except ExecutorSaturated as e:
+        return _busy_response(e)
+
+def _execute_query_batch(request, case_id):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid method'})
+
+    try:
+        data = json.loads(request.body)
+        queries = data.get('queries')
+        case = get_object_or_404(Case, id=case_id)
+
+        if not queries or not isinstance(queries, list):
+            return JsonResponse({'success': False, 'error': 'No queries provided'})
+        if len(queries) > MAX_BATCH_QUERIES:
+            return JsonResponse({'success': False, 'error': f'At most {MAX_BATCH_QUERIES} queries per batch'})
+        if not (case.dataset and case.dataset.file):
+            return JsonResponse({'success': False, 'error': 'No dataset found for this case.'})
+
+        result = case_sql_engine(case).execute_batch(
+            [str(query) for query in queries],
+            stop_on_error=bool(data.get('stop_on_error')),
+            page_size=data.get('page_size', 50),
+            debug=bool(data.get('debug')) and (settings.DEBUG or request.user.is_staff),
+        )
+        for query, query_result in zip(queries, result['results']):
+            if query_result['success']:
+                record_query(case.dataset.id, query)
+        return JsonResponse(result)
+
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': str(e)})
+
 @csrf_exempt
-def execute_python_view(request, case_id):
+async def execute_python_view(request, case_id):
     """
     Executes user-submitted Python code with the dataset loaded as 'df'.
     Captures stdout and returns it. Handles errors gracefully.
     """
+    try:
+        return await get_executor('python').run(_execute_python, request, case_id)
+    except ExecutorSaturated as e:
+        return _busy_response(e)
+
+def _execute_python(request, case_id):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Invalid request method'})
 
     try:
-        data = json.loads(request.body)
-        code = data.get('code', '')
-        case = get_object_or_404(Case, id=case_id)
-        
-        # Load Dataset
-        if not case.dataset:
-             return JsonResponse({'success': False, 'error': 'No dataset associated with this case.'})
-             
-        file_path = case.dataset.file.path
-        if not os.path.exists(file_path):
-             return JsonResponse({'success': False, 'error': 'Dataset file not found.'})
-
-        # Context for execution
-        import pandas as pd
-        import io
-        import sys
-        
-        # Load df
-        try:
-            df = pd.read_csv(file_path)
-        except Exception as e:
-             return JsonResponse({'success': False, 'error': f'Failed to load CSV: {str(e)}'})
-
-        # Capture Stdout
-        old_stdout = sys.stdout
-        redirected_output = io.StringIO()
-        sys.stdout = redirected_output
-
-        # Restricted Environment (Safe-ish for local dev, not prod)
-        # We allow pandas as 'pd' and 'df'
-        local_scope = {
-            'pd': pd,
-            'df': df
-        }
-        
-        try:
-            # Execute User Code
-            exec(code, {}, local_scope)
-            output = redirected_output.getvalue()
-            success = True
-            error_message = None
-
-            # Validation Logic
-            is_correct = False
-            validation_message = ""
-            
-            # Find the active Python question for this case (assuming 1 per case for prototype)
-            # In a real app, we'd pass question_id from frontend
-            question = case.questions.filter(question_type='PYTHON').first()
-            
-            if question and question.validation_query:
-                # Run Validation Code (Expected Result)
-                # We expect the validation code to produce an output or define a variable 'expected_result'
-                # For this prototype, let's assume we compare STDOUT equality
-                
-                # Capture Expected Output
-                expected_output_io = io.StringIO()
-                sys.stdout = expected_output_io
-                
-                validation_scope = {'pd': pd, 'df': df} # Clean scope
-                exec(question.validation_query, {}, validation_scope)
-                expected_output = expected_output_io.getvalue()
-                
-                # Restore Stdout for final return
-                sys.stdout = old_stdout
-                
-                # Compare
-                if output.strip() == expected_output.strip():
-                    is_correct = True
-                    validation_message = "Correct! Task Completed."
-                else:
-                    validation_message = "Incorrect output."
-            elif question:
-                 # If no validation query but question exists, maybe just running it is enough?
-                 # ideally we should have a validation query.
-                 pass
+        prepared = _prepare_python(request, case_id)
+        if isinstance(prepared, JsonResponse):
+            return prepared
+        job, limits, respond = prepared
+        return JsonResponse(respond(get_python_pool().run(job, limits)))
 
-        except Exception as e:
-            # Capture the full traceback or just the error message
-            import traceback
-            success = False
-            output = redirected_output.getvalue() # Get partially printed lines if any
-            error_message = traceback.format_exc()
-            is_correct = False
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': f"Server Error: {str(e)}"})
+
+def _prepare_python(request, case_id, stream=False):
+    """
+    Returns (job, limits, respond) for the posted code, or a JsonResponse
+    error. respond(result) stores a freshly computed expected answer,
+    grades the run and builds the response data.
+    """
+    data = json.loads(request.body)
+    code = data.get('code', '')
+    case = get_object_or_404(Case, id=case_id)
+    
+    # Load Dataset
+    if not case.dataset:
+         return JsonResponse({'success': False, 'error': 'No dataset associated with this case.'})
+         
+    file_path = case.dataset.file.path
+    if not os.path.exists(file_path):
+         return JsonResponse({'success': False, 'error': 'Dataset file not found.'})
+
+    # Find the active Python question for this case (assuming 1 per case for prototype)
+    # In a real app, we'd pass question_id from frontend
+    question = case.questions.filter(question_type='PYTHON').first()
+    if question and not question.validation_query:
+        # Nothing to validate against; running it is all there is
+        question = None
+
+    try:
+        columnar = ensure_columnar(file_path, case.dataset.columns_metadata.get('schema'))
+    except Exception as e:
+         return JsonResponse({'success': False, 'error': f'Failed to load CSV: {str(e)}'})
+
+    # The expected answer (stdout and result fingerprint of the validation
+    # code) is computed once per dataset version. When it isn't stored yet
+    # it runs in the same job.
+    expected = cached_expected(question, columnar) if question else None
+    validation_code = question.validation_query if question and expected is None else None
+
+    # Opt-in: keep this user's variables between runs on this case
+    session = None
+    if data.get('session') and request.user.is_authenticated:
+        session = session_options(f"{request.user.id}:{case.id}", reset=bool(data.get('reset_session')))
+
+    # User code runs in a warm executor process with pandas as 'pd' and the
+    # dataset as 'df'. Safe-ish for local dev, not prod.
+    job = dict(python_job(case.dataset, columnar, code, validation_code, session), stream=stream)
+
+    def respond(result):
+        nonlocal expected
+        if validation_code and result['expected_output'] is not None:
+            expected = (result['expected_output'], result['expected_fingerprint'])
+            store_expected(question, columnar, *expected)
+
+        is_correct = False
+        validation_message = ""
+        grading_error = None
+        if not result['success']:
             validation_message = "Execution Error"
-        finally:
-            sys.stdout = old_stdout
+        elif result.get('grading_error'):
+            # The validation code failed: no verdict, and its traceback
+            # stays in the server log
+            logger.warning("Validation code of %s failed: %s", question, result['grading_error'])
+            is_correct = None
+            grading_error = "Your code ran, but this question's answer couldn't be checked right now."
+        elif question:
+            is_correct, validation_message = grade_python(question, result, *expected)
 
-        return JsonResponse({
-            'success': success,
-            'output': output if success else output, # Send output even on fail (partial logs)
-            'error': error_message,
+        response = {
+            'success': result['success'],
+            'output': result['output'], # Send output even on fail (partial logs)
+            'error': result['error'],
             'is_correct': is_correct,
-            'validation_message': validation_message
-        })
+            'validation_message': validation_message,
+            # CPU seconds, wall seconds and peak RSS this run used
+            'usage': result['usage'],
+        }
+        if grading_error:
+            response['grading_error'] = grading_error
+        if result['error_code']:
+            response.update(error_code=result['error_code'], limit=result['limit'])
+        if result['session']:
+            # {status, variables, size_mb}, or {status: 'dropped', message}
+            response['session'] = result['session']
+        return response
+
+    return job, PythonLimits.for_difficulty(case.difficulty), respond
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
+def _python_events(run, respond):
+    """
+    Server-Sent Events of a streaming run: 'run' with the id to cancel it
+    by, 'stdout' and 'progress' while it runs, then 'result' (the usual
+    response data, minus the output the client has already received).
+    """
+    try:
+        yield _sse('run', {'run_id': run.run_id})
+        for event, data in run:
+            if event == 'result':
+                response = respond(data)
+                del response['output']
+                yield _sse('result', response)
+            elif event == 'stdout':
+                yield _sse('stdout', {'text': data})
+            else:
+                yield _sse('progress', data)
+    finally:
+        # Client gone or response closed early: stop the code too
+        run.close()
+
+def _start_python_stream(request, case_id):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+    try:
+        prepared = _prepare_python(request, case_id, stream=True)
+        if isinstance(prepared, JsonResponse):
+            return prepared
+        job, limits, respond = prepared
+        # Only the user who started a run can cancel it, by its random id
+        owner = request.user.id if request.user.is_authenticated else None
+        run = get_python_pool().stream(job, limits, run_id=uuid.uuid4().hex, owner=owner)
+        return _python_events(run, respond)
     except Exception as e:
         return JsonResponse({'success': False, 'error': f"Server Error: {str(e)}"})
-    
-    return JsonResponse({'success': False, 'error': 'Invalid method'})
+
+@csrf_exempt
+async def execute_python_stream_view(request, case_id):
+    """
+    Like execute_python_view, but answers with Server-Sent Events that
+    forward stdout while the code runs (see _python_events).
+    """
+    executor = get_executor('python')
+    try:
+        events = await executor.run(_start_python_stream, request, case_id)
+        if isinstance(events, JsonResponse):
+            return events
+        response = StreamingHttpResponse(executor.stream(events), content_type='text/event-stream')
+    except ExecutorSaturated as e:
+        return _busy_response(e)
+    response['Cache-Control'] = 'no-cache'
+    # Keep reverse proxies (nginx) from buffering the events
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@csrf_exempt
+@login_required
+def cancel_python_view(request, case_id):
+    """
+    Cancels one of the user's streaming runs by the run_id it announced.
+    Runs are tracked per server process.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+    try:
+        run_id = str(json.loads(request.body).get('run_id', ''))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON'})
+    if not get_python_pool().cancel(run_id, owner=request.user.id):
+        return JsonResponse({'success': False, 'error': 'No such run; it may have already finished.'})
+    return JsonResponse({'success': True})
 
 @login_required
 def result_view(request):
@@ -286,7 +507,41 @@ def result_view(request):
 
 
 def leaderboard_view(request):
-    return render(request, 'core/leaderboard.html')
+    """
+    Global (total XP), weekly (?board=week, XP gained this week) or per-case
+    (?board=case&case=<id>, best score) rankings: the top users, and the
+    viewer's rank with their neighbours (see core/leaderboard.py).
+    """
+    cases = case_catalog()
+    board = request.GET.get('board', 'global')
+    case = None
+    if board == 'case':
+        case_id = request.GET.get('case', '')
+        case = next((c for c in cases if str(c['id']) == case_id), None)
+        if case is None:
+            board = 'global'
+    if board == 'week':
+        name = week_board()
+    elif board == 'case':
+        name = case_board(case['id'])
+    else:
+        board, name = 'global', GLOBAL
+
+    ranking = standings(name, request.user)
+    top = ranking['top']
+    shown = {row['user_id'] for row in top}
+    return render(request, 'core/leaderboard.html', {
+        'board': board,
+        'case': case,
+        'cases': cases,
+        'total': ranking['total'],
+        # (place, row) in podium order: 2nd, 1st, 3rd
+        'podium': [(place, top[place - 1]) for place in (2, 1, 3) if place <= len(top)],
+        'rows': top[3:],
+        'me': ranking['me'],
+        # The viewer's neighbourhood, when they're below the top rows
+        'around': ranking['around'] if ranking['me'] and ranking['me']['user_id'] not in shown else [],
+    })
 
 @user_passes_test(lambda u: u.is_authenticated)
 def profile_view(request):
@@ -306,6 +561,25 @@ def admin_dashboard_view(request):
     active_today = User.objects.filter(last_login__date=timezone.now().date()).count()
     total_cases_solved = Submission.objects.filter(completed=True).count()
     profiles = UserProfile.objects.select_related('user').all()[:20]
+    # Stats of this worker process only
+    pool_stats = get_pool().stats()
+    result_cache_stats = get_result_cache().stats()
+    executor_stats = [get_executor(name).stats() for name in ('sql', 'python')]
+    python_pool_stats = get_python_pool().stats()
+    # Shared by all processes, unlike the stats above
+    job_stats = queue_stats()
+    dataset_names = dict(Dataset.objects.values_list('id', 'name'))
+    dataset_latency = sorted(
+        (dict(summary, dataset=dataset_names.get(key, key))
+         for key, summary in get_metrics().dataset_summaries().items()),
+        key=lambda summary: summary['p95_ms'], reverse=True,
+    )
+    slow_queries = get_metrics().slowest_shapes(limit=5)
+    python_usage = sorted(
+        (dict(summary, dataset=dataset_names.get(key, key))
+         for key, summary in get_python_metrics().dataset_summaries().items()),
+        key=lambda summary: summary['cpu_seconds'], reverse=True,
+    )
 
     context = {
         'total_users': total_users,
@@ -313,5 +587,13 @@ def admin_dashboard_view(request):
         'active_today': active_today,
         'total_cases_solved': total_cases_solved,
         'profiles': profiles,
+        'pool_stats': pool_stats,
+        'result_cache_stats': result_cache_stats,
+        'executor_stats': executor_stats,
+        'python_pool_stats': python_pool_stats,
+        'job_stats': job_stats,
+        'dataset_latency': dataset_latency,
+        'slow_queries': slow_queries,
+        'python_usage': python_usage,
     }
     return render(request, 'core/admin_dashboard.html', context)
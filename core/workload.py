@@ -0,0 +1,62 @@
+"""
+Buffered recording of the SQL workload per dataset.
+
+Each worker counts executions in memory and periodically folds them into
+QueryLog rows, so the editor doesn't write to the database on every query.
+The index advisor (`manage.py advise_indexes`) reads the aggregated log.
+"""
+import time
+import threading
+
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from .engines.result_cache import normalize_sql, sql_fingerprint
+from .models import QueryLog
+
+FLUSH_INTERVAL = 30  # seconds
+FLUSH_SIZE = 200     # distinct buffered queries
+
+_buffer = {}  # (dataset_id, fingerprint) -> [executions, normalized query]
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def record_query(dataset_id, query):
+    global _last_flush
+    key = (dataset_id, sql_fingerprint(query))
+    with _lock:
+        entry = _buffer.get(key)
+        if entry is None:
+            _buffer[key] = [1, normalize_sql(query)]
+        else:
+            entry[0] += 1
+        due = len(_buffer) >= FLUSH_SIZE or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+    if due:
+        flush()
+
+
+def flush():
+    global _buffer, _last_flush
+    with _lock:
+        pending, _buffer = _buffer, {}
+        _last_flush = time.monotonic()
+
+    now = timezone.now()
+    for (dataset_id, fingerprint), (executions, query) in pending.items():
+        updated = QueryLog.objects.filter(dataset_id=dataset_id, fingerprint=fingerprint).update(
+            executions=F('executions') + executions, last_run_at=now
+        )
+        if updated:
+            continue
+        try:
+            QueryLog.objects.create(
+                dataset_id=dataset_id, fingerprint=fingerprint, query=query,
+                executions=executions, last_run_at=now,
+            )
+        except IntegrityError:
+            # Another worker created the row between our update and insert
+            QueryLog.objects.filter(dataset_id=dataset_id, fingerprint=fingerprint).update(
+                executions=F('executions') + executions, last_run_at=now
+            )